@@ -0,0 +1,455 @@
+"""NumPy batch simulator: many independent AI-vs-AI matches at once.
+
+Every match is one lane of a set of arrays (ball, paddles, timers, scores,
+missiles, star) and BatchSim.step() advances all lanes with a handful of
+vectorized operations.  The rules mirror engine.GameState; the random draws
+come from a numpy Generator, so individual matches differ from the engine's
+but the statistics are the same.  Effects come from the same engine.EFFECTS
+table but count down in arrays, a lane holds one star at a time (the
+default MAX_STARS) and the stacks of a stacking effect end together.
+
+    python batch.py --matches 20000 --winning-score 10
+"""
+import argparse
+import time
+
+import numpy
+
+import engine
+from engine import (
+    SCREEN_WIDTH, SCREEN_HEIGHT, PADDLE_WIDTH, PADDLE_HEIGHT, BALL_SIZE,
+    WINNING_SCORE, AI_DIFFICULTY_MAP, MISSILE_SIZE,
+    STAR_SIZE, STAR_TYPES, STAR_EFFECTS, SHOOTER,
+    EFFECTS, EFFECT_INDEX, STUN, EXTEND, STACK, MAX_BOUNCES, LEFT, RIGHT, tunable,
+)
+
+PADDLE_X = (30, SCREEN_WIDTH - 40)
+STAR_X = SCREEN_WIDTH // 2 - STAR_SIZE // 2
+BALL_START_X = SCREEN_WIDTH // 2 - BALL_SIZE // 2
+BALL_START_Y = SCREEN_HEIGHT // 2 - BALL_SIZE // 2
+# A missile lives ~96 ticks and the cooldown is 90, or 45 with rapid fire,
+# so each side can have at most three in flight: slots 0-2 belong to the
+# left side, 3-5 to the right.
+MISSILE_SLOTS = 3
+
+# Arrays with one entry per lane, and with a row per side (or missile slot)
+RESULT_ARRAYS = ('done', 'winner', 'ticks', 'paddle_hits', 'points')
+LANE_ARRAYS = RESULT_ARRAYS + (
+    'ids', 'winning_score', 'ball_x', 'ball_y', 'ball_speed_x', 'ball_speed_y', 'speed_multiplier',
+    'star_alive', 'star_y', 'star_type', 'star_spawn_timer', 'plan_dirty')
+SIDE_ARRAYS = (
+    'miss_chance', 'paddle_y', 'score', 'missile_cooldown', 'effect_timer', 'effect_stacks', 'ai_approaching', 'ai_miss', 'ai_target_y', 'missile_x', 'missile_y', 'missile_alive')
+COMPACT_EVERY = 64  # ticks between checks for finished lanes to drop
+
+# Uniform draws used per tick, one row each
+(U_FIRE_L, U_FIRE_R, U_MISS_L, U_MISS_R, U_STAR_Y, U_STAR_TYPE, U_SERVE) = range(7)
+DRAWS = 7
+
+
+def miss_chance(difficulty):
+    """Accept a difficulty name, a miss chance or an array of either."""
+    if isinstance(difficulty, str):
+        return AI_DIFFICULTY_MAP.get(difficulty, 0.05)
+    if isinstance(difficulty, (list, tuple)):
+        return numpy.array([miss_chance(d) for d in difficulty])
+    return difficulty
+
+
+def intercept_y(x, y, dx, dy, face_x):
+    """engine.intercept_y() over arrays."""
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        ticks = numpy.maximum(0.0, (face_x - x) / dx)
+    span = SCREEN_HEIGHT - BALL_SIZE
+    folded = numpy.mod(y + dy * ticks, 2 * span)
+    return numpy.where(folded <= span, folded, 2 * span - folded)
+
+
+def sweep_boxes(x, y, dx, dy, size, rx, ry, rw, rh):
+    """engine.sweep() for arrays: fraction of the move at which a moving box
+    first overlaps a rect, or inf where it does not."""
+    inf = numpy.inf
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        entries = []
+        exits = []
+        for p, d, r, w in ((x, dx, rx, rw), (y, dy, ry, rh)):
+            entry = numpy.where(d > 0, (r - (p + size)) / d, (r + w - p) / d)
+            exit = numpy.where(d > 0, (r + w - p) / d, (r - (p + size)) / d)
+            inside = (r - size < p) & (p < r + w)
+            entries.append(numpy.where(d == 0, numpy.where(inside, -inf, inf), entry))
+            exits.append(numpy.where(d == 0, inf, exit))
+    entry = numpy.maximum(*entries)
+    exit = numpy.minimum(*exits)
+    hit = (entry < exit) & (entry <= 1) & (exit > 0)
+    return numpy.where(hit, numpy.maximum(entry, 0.0), inf)
+
+
+def overlaps(ax, ay, aw, ah, bx, by, bw, bh):
+    # Same test as pygame.Rect.colliderect
+    return (ax < bx + bw) & (ay < by + bh) & (ax + aw > bx) & (ay + ah > by)
+
+
+class BatchSim:
+    """N independent matches advanced together.
+
+    `left_difficulty` and `right_difficulty` may be names from
+    AI_DIFFICULTY_MAP, miss chances, or length-N arrays of either so a whole
+    difficulty sweep fits in one batch.
+    """
+
+    def __init__(self, n, winning_score=WINNING_SCORE, left_difficulty='Normal',
+                 right_difficulty='Normal', seed=None):
+        self.n = n
+        self.rng = numpy.random.default_rng(seed)
+        self.winning_score = numpy.broadcast_to(numpy.asarray(winning_score), (n,))
+        self.miss_chance = numpy.empty((2, n))
+        self.miss_chance[LEFT] = miss_chance(left_difficulty)
+        self.miss_chance[RIGHT] = miss_chance(right_difficulty)
+
+        # Ball
+        self.ball_x = numpy.full(n, BALL_START_X, dtype=numpy.int32)
+        self.ball_y = numpy.full(n, BALL_START_Y, dtype=numpy.int32)
+        self.ball_speed_x = engine.BALL_SPEED_X * self.rng.choice([-1, 1], n).astype(numpy.int32)
+        self.ball_speed_y = engine.BALL_SPEED_Y * self.rng.choice([-1, 1], n).astype(numpy.int32)
+        self.speed_multiplier = numpy.ones(n)
+        # Per side: row LEFT and row RIGHT
+        self.paddle_y = numpy.full((2, n), SCREEN_HEIGHT // 2 - PADDLE_HEIGHT // 2, dtype=numpy.int32)
+        self.score = numpy.zeros((2, n), dtype=numpy.int32)
+        self.missile_cooldown = numpy.zeros((2, n), dtype=numpy.int32)
+        # Per effect in EFFECTS and side: ticks left and stacks in force
+        self.effect_timer = numpy.zeros((len(EFFECTS), 2, n), dtype=numpy.int32)
+        self.effect_stacks = numpy.zeros((len(EFFECTS), 2, n), dtype=numpy.int8)
+        self.ai_approaching = numpy.zeros((2, n), dtype=bool)
+        self.ai_miss = numpy.zeros((2, n), dtype=bool)
+        self.ai_target_y = numpy.full((2, n), SCREEN_HEIGHT // 2, dtype=numpy.int32)
+        # Lanes whose ball changed course since the AIs last planned
+        self.plan_dirty = numpy.ones(n, dtype=bool)
+        # Missiles
+        self.missile_x = numpy.zeros((2 * MISSILE_SLOTS, n), dtype=numpy.int32)
+        self.missile_y = numpy.zeros((2 * MISSILE_SLOTS, n), dtype=numpy.int32)
+        self.missile_alive = numpy.zeros((2 * MISSILE_SLOTS, n), dtype=bool)
+        # Star power-up
+        self.star_alive = numpy.zeros(n, dtype=bool)
+        self.star_y = numpy.zeros(n, dtype=numpy.int32)
+        self.star_type = numpy.zeros(n, dtype=numpy.int8)
+        self.star_spawn_timer = numpy.zeros(n, dtype=numpy.int32)
+
+        # Results
+        self.done = numpy.zeros(n, dtype=bool)
+        self.winner = numpy.full(n, -1, dtype=numpy.int8)
+        self.ticks = numpy.zeros(n, dtype=numpy.int64)
+        self.paddle_hits = numpy.zeros(n, dtype=numpy.int64)
+        self.points = numpy.zeros(n, dtype=numpy.int64)
+        self.tick = 0
+        # Lane i is match ids[i]; compact() removes finished lanes
+        self.ids = numpy.arange(n)
+        self.final = {name: getattr(self, name).copy() for name in RESULT_ARRAYS}
+
+    def _fire(self, side, mask):
+        base = side * MISSILE_SLOTS
+        if side == LEFT:
+            x = PADDLE_X[LEFT] + PADDLE_WIDTH
+        else:
+            x = PADDLE_X[RIGHT] - MISSILE_SIZE
+        y = self.paddle_y[side] + PADDLE_HEIGHT // 2 - MISSILE_SIZE // 2
+        # The first free slot; with none free the last one is reused
+        left = mask
+        for slot in range(base, base + MISSILE_SLOTS):
+            use = left & ~self.missile_alive[slot] if slot < base + MISSILE_SLOTS - 1 else left
+            self.missile_x[slot][use] = x
+            self.missile_y[slot][use] = y[use]
+            self.missile_alive[slot] |= use
+            left = left & ~use
+        cooldown = engine.MISSILE_COOLDOWN_FRAMES * self._factor('cooldown')[side]
+        self.missile_cooldown[side][mask] = cooldown[mask].astype(numpy.int32)
+
+    def _factor(self, attribute):
+        # Per side and lane, the product of that factor over the effects in force
+        factor = numpy.ones((2, self.n))
+        for index, effect in enumerate(EFFECTS):
+            value = tunable(getattr(effect, attribute))
+            if value == 1.0:
+                continue
+            stacks = self.effect_stacks[index]
+            if stacks.any():
+                # value ** stacks, looked up
+                factor *= (value ** numpy.arange(effect.max_stacks + 1))[stacks]
+        return factor
+
+    def _apply(self, index, side, mask):
+        # Mirrors engine.GameState.apply_effect() in the lanes of `mask`
+        effect = EFFECTS[index]
+        duration = tunable(effect.duration)
+        timer = self.effect_timer[index, side]
+        stacks = self.effect_stacks[index, side]
+        if effect.stacking == EXTEND:
+            timer[mask] = numpy.where(stacks[mask] > 0, timer[mask] + duration, duration + 1)
+        else:
+            timer[mask] = duration + 1
+        if effect.stacking == STACK:
+            stacks[mask] = numpy.minimum(stacks[mask] + 1, effect.max_stacks)
+        else:
+            stacks[mask] = 1
+
+    def step(self):
+        """Advance every match by one tick."""
+        self.tick += 1
+        u = self.rng.random((DRAWS, self.n))
+        live = ~self.done
+        self.ticks += live
+
+        # Missile cooldowns and effects
+        for timer in (self.missile_cooldown, self.effect_timer):
+            timer -= timer > 0
+        self.effect_stacks *= self.effect_timer > 0
+
+        # Star power-up spawning
+        waiting = ~self.star_alive
+        self.star_spawn_timer += waiting
+        spawn = self.star_spawn_timer >= engine.STAR_SPAWN_INTERVAL
+        if spawn.any():
+            self.star_alive |= spawn
+            self.star_y[spawn] = 50 + (u[U_STAR_Y][spawn] * (SCREEN_HEIGHT - 100 + 1)).astype(numpy.int32)
+            self.star_type[spawn] = (u[U_STAR_TYPE][spawn] * len(STAR_TYPES)).astype(numpy.int8)
+            self.star_spawn_timer[spawn] = 0
+
+        # AI missile firing
+        stunned = self.effect_stacks[STUN] > 0
+        for side, draw in ((LEFT, U_FIRE_L), (RIGHT, U_FIRE_R)):
+            fire = (self.missile_cooldown[side] <= 0) & ~stunned[side] & (u[draw] < engine.AI_FIRE_CHANCE)
+            if fire.any():
+                self._fire(side, fire)
+
+        # AI planning, only in lanes where the ball's course has changed
+        if self.plan_dirty.any():
+            self._plan(numpy.nonzero(self.plan_dirty)[0], u)
+            self.plan_dirty[:] = False
+
+        # AI movement (only if not stunned)
+        speeds = (engine.PADDLE_SPEED * self._factor('speed')).astype(numpy.int32)
+        for side in (LEFT, RIGHT):
+            free = ~stunned[side]
+            y = self.paddle_y[side]
+            distance = self.ai_target_y[side] - (y + PADDLE_HEIGHT // 2)
+            speed = speeds[side]
+            down = free & (distance > 0) & (y + PADDLE_HEIGHT < SCREEN_HEIGHT)
+            up = free & (distance < 0) & (y > 0)
+            step = numpy.minimum(speed, numpy.abs(distance))
+            y += step * down
+            y -= step * up
+
+        # Update missiles
+        for slot in range(2 * MISSILE_SLOTS):
+            side = LEFT if slot < MISSILE_SLOTS else RIGHT
+            target = 1 - side
+            alive = self.missile_alive[slot]
+            if not alive.any():
+                continue
+            mx = self.missile_x[slot]
+            my = self.missile_y[slot]
+            if side == LEFT:
+                mx += engine.MISSILE_SPEED * alive
+                gone = alive & (mx > SCREEN_WIDTH)
+            else:
+                mx -= engine.MISSILE_SPEED * alive
+                gone = alive & (mx < 0)
+            alive &= ~gone
+            hit = alive & (self.effect_stacks[STUN, target] == 0) & overlaps(
+                mx, my, MISSILE_SIZE, MISSILE_SIZE,
+                PADDLE_X[target], self.paddle_y[target], PADDLE_WIDTH, PADDLE_HEIGHT)
+            if hit.any():
+                self._apply(STUN, target, hit)
+            alive &= ~hit
+            star = alive & self.star_alive & overlaps(
+                mx, my, MISSILE_SIZE, MISSILE_SIZE, STAR_X, self.star_y, STAR_SIZE, STAR_SIZE)
+            if star.any():
+                for kind, star_type in enumerate(STAR_TYPES):
+                    name, whom = STAR_EFFECTS[star_type]
+                    picked = star & (self.star_type == kind)
+                    if picked.any():
+                        self._apply(EFFECT_INDEX[name], side if whom == SHOOTER else target, picked)
+                self.star_alive &= ~star
+                alive &= ~star
+
+        # Ball movement, swept like engine.GameState._move_ball()
+        hit_any, impact_any = self._move_ball()
+        self.plan_dirty |= impact_any
+        self.speed_multiplier[hit_any] *= 1.05  # Increase speed by 5%
+        self.paddle_hits += hit_any & live
+        bx = self.ball_x
+        by = self.ball_y
+
+        # Score update
+        right_scores = bx <= 0
+        left_scores = ~right_scores & (bx + BALL_SIZE >= SCREEN_WIDTH)
+        scored = right_scores | left_scores
+        if scored.any():
+            self.score[RIGHT] += right_scores & live
+            self.score[LEFT] += left_scores & live
+            self.points += scored & live
+            bx[scored] = BALL_START_X
+            by[scored] = BALL_START_Y
+            # The next serve heads towards the side that scored
+            self.ball_speed_x[right_scores] = engine.BALL_SPEED_X
+            self.ball_speed_x[left_scores] = -engine.BALL_SPEED_X
+            self.ball_speed_y[scored] = numpy.where(u[U_SERVE][scored] < 0.5,
+                                                    -engine.BALL_SPEED_Y, engine.BALL_SPEED_Y)
+            self.ai_approaching[:, scored] = False
+            self.plan_dirty |= scored
+            self.speed_multiplier[scored] = 1.0
+            for side in (LEFT, RIGHT):
+                won = live & (self.score[side] >= self.winning_score)
+                self.winner[won] = side
+                self.done |= won
+
+    def _move_ball(self):
+        # Resolve up to MAX_BOUNCES impacts per lane, earliest first.  Only
+        # the first pass covers every lane; later ones just the lanes that
+        # bounced and still have motion left.
+        x = self.ball_x.astype(numpy.float64)
+        y = self.ball_y.astype(numpy.float64)
+        remaining = numpy.ones(self.n)
+        hit_any = numpy.zeros(self.n, dtype=bool)
+        impact_any = numpy.zeros(self.n, dtype=bool)
+        lanes = slice(None)
+        inf = numpy.inf
+        for _ in range(MAX_BOUNCES):
+            lx = x[lanes]
+            ly = y[lanes]
+            speed_x = self.ball_speed_x[lanes]
+            speed_y = self.ball_speed_y[lanes]
+            multiplier = self.speed_multiplier[lanes]
+            left_remaining = remaining[lanes]
+            dx = numpy.trunc(speed_x * multiplier) * left_remaining
+            dy = numpy.trunc(speed_y * multiplier) * left_remaining
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                t_wall = numpy.where(
+                    (dy < 0) & (ly + dy <= 0), numpy.maximum(0.0, -ly / dy),
+                    numpy.where((dy > 0) & (ly + BALL_SIZE + dy >= SCREEN_HEIGHT),
+                                numpy.maximum(0.0, (SCREEN_HEIGHT - BALL_SIZE - ly) / dy), inf))
+            right = dx > 0
+            t_paddle = sweep_boxes(lx, ly, dx, dy, BALL_SIZE,
+                                   numpy.where(right, PADDLE_X[RIGHT], PADDLE_X[LEFT]),
+                                   numpy.where(right, self.paddle_y[RIGHT][lanes], self.paddle_y[LEFT][lanes]),
+                                   PADDLE_WIDTH, PADDLE_HEIGHT)
+            wall = (t_wall <= t_paddle) & (t_wall <= 1)
+            paddle = ~wall & (t_paddle <= 1)
+            impact = wall | paddle
+            impact_any[lanes] |= impact
+            when = numpy.where(impact, numpy.minimum(t_wall, t_paddle), 1.0)
+            x[lanes] = lx + dx * when
+            y[lanes] = ly + dy * when
+            speed_y = numpy.where(wall, -speed_y, speed_y)
+            if paddle.any():
+                speed_x = numpy.where(paddle, -speed_x, speed_x)
+                speed_y += paddle * self.rng.integers(-2, 3, len(paddle), dtype=numpy.int32)
+                hit_any[lanes] |= paddle
+            self.ball_speed_x[lanes] = speed_x
+            self.ball_speed_y[lanes] = speed_y
+            left_remaining = numpy.where(impact, left_remaining * (1.0 - when), 0.0)
+            remaining[lanes] = left_remaining
+            again = impact & (left_remaining > 0)
+            lanes = numpy.nonzero(again)[0] if isinstance(lanes, slice) else lanes[again]
+            if not len(lanes):
+                break
+        self.ball_x[:] = numpy.round(x)
+        self.ball_y[:] = numpy.round(y)
+        return hit_any, impact_any
+
+    def _plan(self, lanes, u):
+        # Mirrors engine.GameState.plan() for the given lanes
+        dx = numpy.trunc(self.ball_speed_x[lanes] * self.speed_multiplier[lanes])
+        dy = numpy.trunc(self.ball_speed_y[lanes] * self.speed_multiplier[lanes])
+        bx = self.ball_x[lanes]
+        by = self.ball_y[lanes]
+        offset = PADDLE_HEIGHT // 2 + BALL_SIZE
+        for side, roll in ((LEFT, U_MISS_L), (RIGHT, U_MISS_R)):
+            approaching = dx > 0 if side == RIGHT else dx < 0
+            volley = approaching & ~self.ai_approaching[side][lanes]
+            miss = self.ai_miss[side][lanes]
+            miss = numpy.where(volley, u[roll][lanes] < self.miss_chance[side][lanes], miss)
+            self.ai_miss[side][lanes] = miss
+            self.ai_approaching[side][lanes] = approaching
+            face_x = PADDLE_X[side] - BALL_SIZE if side == RIGHT else PADDLE_X[side] + PADDLE_WIDTH
+            target = intercept_y(bx, by, dx, dy, face_x) + BALL_SIZE // 2
+            target = numpy.where(~miss, target,
+                                 numpy.where(target + offset <= SCREEN_HEIGHT - PADDLE_HEIGHT // 2,
+                                             target + offset, target - offset))
+            self.ai_target_y[side][lanes] = numpy.where(approaching, target, SCREEN_HEIGHT // 2).astype(numpy.int32)
+
+    def compact(self):
+        """Drop finished matches from the arrays so later ticks skip them.
+
+        Their results move to the full-size arrays behind results().
+        """
+        keep = ~self.done
+        gone = self.ids[self.done]
+        for name in RESULT_ARRAYS:
+            self.final[name][gone] = getattr(self, name)[self.done]
+        for name in LANE_ARRAYS:
+            setattr(self, name, getattr(self, name)[keep])
+        for name in SIDE_ARRAYS:
+            setattr(self, name, getattr(self, name)[..., keep])
+        self.n = len(self.ids)
+
+    def results(self):
+        """Full-size done, winner, ticks, paddle_hits and points arrays."""
+        results = {name: self.final[name].copy() for name in RESULT_ARRAYS}
+        for name in RESULT_ARRAYS:
+            results[name][self.ids] = getattr(self, name)
+        return results
+
+    def run(self, max_ticks=None):
+        """Step until every match is finished (or max_ticks) and return self."""
+        while not self.done.all():
+            if max_ticks is not None and self.tick >= max_ticks:
+                break
+            self.step()
+            if self.tick % COMPACT_EVERY == 0 and self.done.sum() * 4 > self.n:
+                self.compact()
+        return self
+
+
+def sweep(matches, winning_score=WINNING_SCORE, seed=None):
+    """Play every difficulty pairing in one batch.
+
+    Returns {(left, right): (left win rate, mean ticks, mean rally length)}
+    and the BatchSim.results() arrays.
+    """
+    names = list(AI_DIFFICULTY_MAP)
+    pairs = [(left, right) for left in names for right in names]
+    left = numpy.repeat([AI_DIFFICULTY_MAP[p[0]] for p in pairs], matches)
+    right = numpy.repeat([AI_DIFFICULTY_MAP[p[1]] for p in pairs], matches)
+    sim = BatchSim(len(left), winning_score, left, right, seed).run()
+    played = sim.results()
+    results = {}
+    for i, pair in enumerate(pairs):
+        lanes = slice(i * matches, (i + 1) * matches)
+        finished = played['done'][lanes]
+        rally = played['paddle_hits'][lanes].sum() / max(1, played['points'][lanes].sum())
+        results[pair] = (
+            float((played['winner'][lanes][finished] == LEFT).mean()) if finished.any() else float('nan'),
+            float(played['ticks'][lanes].mean()),
+            float(rally),
+        )
+    return results, played
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Vectorized AI-vs-AI difficulty sweep')
+    parser.add_argument('--matches', type=int, default=2000, help='matches per difficulty pairing')
+    parser.add_argument('--winning-score', type=int, default=WINNING_SCORE)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results, played = sweep(args.matches, args.winning_score, args.seed)
+    elapsed = time.perf_counter() - start
+    print(f"{'Left':>8} {'Right':>8} {'Left wins':>10} {'Ticks':>9} {'Rally':>7}")
+    for (left, right), (win_rate, ticks, rally) in results.items():
+        print(f'{left:>8} {right:>8} {win_rate:>10.3f} {ticks:>9.0f} {rally:>7.2f}')
+    match_ticks = int(played['ticks'].sum())
+    print(f'{match_ticks} match-ticks in {elapsed:.2f}s ({match_ticks / elapsed:,.0f}/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,410 @@
+"""Benchmarks for the simulation, rendering, menus and startup.
+
+Runs headless on SDL's dummy video and audio drivers.  Every benchmark
+reports one number; the results can be written as JSON and compared with a
+stored baseline, and any benchmark that got worse by more than its
+threshold fails the run.
+
+    python bench.py --save-baseline              # record bench_baseline.json
+    python bench.py                              # compare against it
+    python bench.py --only render_frame --threshold render_frame=0.25
+"""
+import os
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import argparse
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import pygame
+
+import main
+from engine import GameState, INPUT_FIRE, LEFT, RIGHT
+from replay import Recording, replay
+
+BASELINE_FILE = 'bench_baseline.json'
+THRESHOLD = 0.10  # default allowed slowdown, as a fraction of the baseline
+SIM_TICKS = 20000
+RENDER_FRAMES = 600
+TEXT_CALLS = 5000
+MENU_FRAMES = 300
+MISSILES_PER_TICK = 8  # per side, on top of the normal fire
+COLD_STARTS = 5
+MULTIBALL_BALLS = 1000
+
+# name: (unit, higher is better)
+UNITS = {
+    'sim': ('ticks/s', True),
+    'batch_sim': ('match-ticks/s', True),
+    'missile_sim': ('ticks/s', True),
+    'env_state': ('steps/s', True),
+    'env_pixels': ('steps/s', True),
+    'multiball_sim': ('ticks/s', True),
+    'render_frame': ('us', False),
+    'render_full_frame': ('us', False),
+    'missile_render_frame': ('us', False),
+    'multiball_render_frame': ('us', False),
+    'draw_text': ('us', False),
+    'draw_text_uncached': ('us', False),
+    'title_menu_frame': ('us', False),
+    'settings_menu_frame': ('us', False),
+    'title_idle_cpu': ('% cpu', False),
+    'cold_start': ('ms', False),
+    'replay': ('ticks/s', True),
+}
+
+
+def key_event(key):
+    return pygame.event.Event(pygame.KEYDOWN, key=key, mod=0, unicode='', scancode=0)
+
+
+class EventFeeder:
+    """Stands in for main.wait_events(): hands a menu one key per call
+    instead of sleeping, times each call-to-call round (handling the key
+    and redrawing) and after `frames` rounds gives the keys that leave."""
+
+    def __init__(self, frames, key, leave):
+        self.frames = frames
+        self.key = key
+        self.leave = leave
+        self.times = []
+        self.last = None
+
+    def __call__(self, timeout=None):
+        now = time.perf_counter()
+        if self.last is not None:
+            self.times.append(now - self.last)
+        self.last = now
+        if len(self.times) >= self.frames:
+            return [key_event(key) for key in self.leave]
+        return [key_event(self.key)]
+
+
+def setup():
+    main.init_display()
+    main.load_fonts()
+    main.load_sprites()
+
+
+def playing_game(seed=1):
+    """An AI-vs-AI game a few seconds into play."""
+    game = GameState(10, 'Normal', 'Normal', rng=random.Random(seed))
+    for _ in range(300):
+        game.step()
+    return game
+
+
+def bench_sim(ticks=SIM_TICKS):
+    rng = random.Random(1)
+    game = GameState(10, 'Normal', 'Normal', rng=rng)
+    start = time.perf_counter()
+    for _ in range(ticks):
+        if game.winner is not None:
+            game = GameState(10, 'Normal', 'Normal', rng=rng)
+        game.step()
+    return ticks / (time.perf_counter() - start)
+
+
+def bench_batch_sim(matches=2000):
+    from batch import BatchSim
+    start = time.perf_counter()
+    sim = BatchSim(matches, 3, 'Normal', 'Normal', seed=1).run()
+    return int(sim.results()['ticks'].sum()) / (time.perf_counter() - start)
+
+
+def bench_env(observation, steps):
+    from env import VecEnv
+    envs = VecEnv(16, observation, seed=1)
+    envs.reset(1)
+    rng = random.Random(1)
+    actions = [[rng.randrange(8) for _ in range(len(envs))] for _ in range(steps // len(envs))]
+    start = time.perf_counter()
+    for row in actions:
+        envs.step(row)
+    return len(actions) * len(envs) / (time.perf_counter() - start)
+
+
+def bench_env_state(steps=SIM_TICKS):
+    return bench_env('state', steps)
+
+
+def bench_env_pixels(steps=SIM_TICKS // 4):
+    return bench_env('pixels', steps)
+
+
+def missile_game(seed=1):
+    game = GameState(10 ** 6, 'Normal', 'Normal', rng=random.Random(seed))
+    for _ in range(150):
+        missile_tick(game)
+    return game
+
+
+def missile_tick(game):
+    # Both sides fire every tick, several missiles at once
+    for _ in range(MISSILES_PER_TICK):
+        game.fire(LEFT)
+        game.fire(RIGHT)
+    game.left.missile_cooldown = game.right.missile_cooldown = 0
+    return game.step(INPUT_FIRE, INPUT_FIRE)
+
+
+def bench_missile_sim(ticks=2000):
+    game = missile_game()
+    start = time.perf_counter()
+    for _ in range(ticks):
+        missile_tick(game)
+    return ticks / (time.perf_counter() - start)
+
+
+def multiball_game(seed=1):
+    from multiball import MultiBallState
+    game = MultiBallState(10 ** 9, rng=random.Random(seed), balls=MULTIBALL_BALLS)
+    for _ in range(150):
+        game.step()
+    return game
+
+
+def bench_multiball_sim(ticks=2000):
+    game = multiball_game()
+    start = time.perf_counter()
+    for _ in range(ticks):
+        game.step()
+    return ticks / (time.perf_counter() - start)
+
+
+def time_frames(game, frames, advance, dirty_rects=True):
+    # Only the draw is timed, like the draw section of main_game()
+    renderer = main.MatchRenderer(dirty_rects)
+    renderer.draw(game)
+    total = 0.0
+    for frame in range(frames):
+        prev = main.positions(game)
+        advance(game)
+        start = time.perf_counter()
+        renderer.draw(game, prev, (frame % 4) / 4)
+        total += time.perf_counter() - start
+    return total / frames * 1e6
+
+
+def bench_render_frame(frames=RENDER_FRAMES):
+    game = playing_game()
+    result = time_frames(game, frames, GameState.step)
+    check_steady_text(game)
+    return result
+
+
+def check_steady_text(game):
+    """Fail the run if redrawing a frame whose text has not changed
+    rasterizes any text, going by main.text_cache's miss counter."""
+    renderer = main.MatchRenderer()
+    renderer.draw(game)
+    misses = main.text_cache.misses
+    renderer.draw(game)
+    if main.text_cache.misses != misses:
+        raise AssertionError(f'a steady frame rendered {main.text_cache.misses - misses} text surfaces')
+
+
+def bench_render_full_frame(frames=RENDER_FRAMES):
+    return time_frames(playing_game(), frames, GameState.step, dirty_rects=False)
+
+
+def bench_missile_render_frame(frames=RENDER_FRAMES // 4):
+    return time_frames(missile_game(), frames, missile_tick)
+
+
+def bench_multiball_render_frame(frames=RENDER_FRAMES // 4):
+    return time_frames(multiball_game(), frames, GameState.step)
+
+
+def bench_draw_text(calls=TEXT_CALLS):
+    texts = [str(score) for score in range(10)]
+    start = time.perf_counter()
+    for i in range(calls):
+        main.draw_text(texts[i % 10], main.font_medium, main.WHITE, main.screen, 200, 40)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def bench_draw_text_uncached(calls=TEXT_CALLS // 10):
+    start = time.perf_counter()
+    for i in range(calls):
+        main.draw_text(f'Points to Win: {i}', main.font_small, main.WHITE, main.screen, 400, 300)
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def time_menu(menu, leave, frames=MENU_FRAMES):
+    # Down moves the selection each round; `frames` is a multiple of the
+    # rows so `leave` starts from the first row
+    feeder = EventFeeder(frames, pygame.K_DOWN, leave)
+    wait_events = main.wait_events
+    main.wait_events = feeder
+    try:
+        pygame.event.clear()
+        menu()
+    finally:
+        main.wait_events = wait_events
+    times = feeder.times[:frames]
+    return sum(times) / len(times) * 1e6
+
+
+def bench_title_menu_frame():
+    return time_menu(main.title_screen, [pygame.K_RETURN])
+
+
+def bench_title_idle_cpu(seconds=2.0):
+    """CPU time per second spent sitting at the title screen, in percent."""
+    pygame.event.clear()
+    threading.Timer(seconds, pygame.event.post, [key_event(pygame.K_RETURN)]).start()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    main.title_screen()
+    return (time.process_time() - cpu) / (time.perf_counter() - wall) * 100
+
+
+def bench_settings_menu_frame():
+    # Up from the first row lands on Back; the settings are saved to a
+    # scratch file rather than the real config
+    path = main.settings.path
+    saved = dict(main.settings)
+    with tempfile.TemporaryDirectory() as scratch:
+        main.settings.path = os.path.join(scratch, os.path.basename(path))
+        try:
+            return time_menu(main.settings_screen, [pygame.K_UP, pygame.K_RETURN])
+        finally:
+            main.settings.path = path
+            main.settings.update(saved)
+
+
+def bench_cold_start(runs=COLD_STARTS):
+    """Median time from process start to the first frame, in a fresh
+    interpreter each run, as reported by --profile-startup."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for _ in range(runs):
+        process = subprocess.Popen([sys.executable, '-u', os.path.join(here, 'main.py'), '--no-splash', '--profile-startup'],
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, cwd=here)
+        try:
+            for line in process.stdout:
+                if line.split()[:2] == ['first', 'frame']:
+                    # Interpreter start up to STARTUP_START is not in the report
+                    first_frame = float(line.split()[-1])
+                    results.append(first_frame)
+                    break
+        finally:
+            process.kill()
+            process.wait()
+    results.sort()
+    return results[len(results) // 2]
+
+
+def bench_replay(path):
+    recording = Recording.load(path)
+    start = time.perf_counter()
+    replay(recording)
+    return recording.ticks / (time.perf_counter() - start)
+
+
+BENCHMARKS = {
+    'sim': bench_sim,
+    'batch_sim': bench_batch_sim,
+    'missile_sim': bench_missile_sim,
+    'env_state': bench_env_state,
+    'env_pixels': bench_env_pixels,
+    'multiball_sim': bench_multiball_sim,
+    'render_frame': bench_render_frame,
+    'render_full_frame': bench_render_full_frame,
+    'missile_render_frame': bench_missile_render_frame,
+    'multiball_render_frame': bench_multiball_render_frame,
+    'draw_text': bench_draw_text,
+    'draw_text_uncached': bench_draw_text_uncached,
+    'title_menu_frame': bench_title_menu_frame,
+    'settings_menu_frame': bench_settings_menu_frame,
+    'title_idle_cpu': bench_title_idle_cpu,
+    'cold_start': bench_cold_start,
+}
+
+
+def run(names, repeat=3, replay_path=None):
+    """Run benchmarks and return {name: best value over `repeat` runs}."""
+    setup()
+    benchmarks = {name: BENCHMARKS[name] for name in names}
+    if replay_path:
+        benchmarks['replay'] = lambda: bench_replay(replay_path)
+    results = {}
+    for name, bench in benchmarks.items():
+        higher = UNITS[name][1]
+        values = [bench() for _ in range(1 if name in ('cold_start', 'title_idle_cpu') else repeat)]
+        results[name] = max(values) if higher else min(values)
+    return results
+
+
+def compare(results, baseline, thresholds):
+    """[(name, value, baseline, change)] for every benchmark that got worse
+    by more than its threshold.  change is the fractional slowdown."""
+    regressions = []
+    for name, value in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]['value'] if isinstance(baseline[name], dict) else baseline[name]
+        higher = UNITS[name][1]
+        change = (base - value) / base if higher else (value - base) / base
+        if change > thresholds.get(name, thresholds[None]):
+            regressions.append((name, value, base, change))
+    return regressions
+
+
+def as_json(results):
+    return {name: {'value': value, 'unit': UNITS[name][0]} for name, value in results.items()}
+
+
+def parse_threshold(text):
+    """'0.2' for every benchmark or 'name=0.2' for one."""
+    name, _, value = text.rpartition('=')
+    return name or None, float(value)
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description='Pong benchmarks')
+    parser.add_argument('--only', action='append', choices=list(BENCHMARKS), help='run just these (repeatable)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the best one counts')
+    parser.add_argument('--replay', metavar='PATH', help='also time a headless replay of this recording')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--threshold', type=parse_threshold, action='append', default=[],
+                        help=f"allowed slowdown, e.g. 0.2 or render_frame=0.25 (default {THRESHOLD})")
+    args = parser.parse_args()
+
+    results = run(args.only or list(BENCHMARKS), args.repeat, args.replay)
+    for name, value in results.items():
+        print(f'{name:<22} {value:14,.1f} {UNITS[name][0]}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(as_json(results), f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(as_json(results), f, indent=2)
+        return
+    if not os.path.exists(args.baseline):
+        print(f'no baseline at {args.baseline}, run with --save-baseline to make one')
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    thresholds = {None: THRESHOLD}
+    thresholds.update(args.threshold)
+    regressions = compare(results, baseline, thresholds)
+    for name, value, base, change in regressions:
+        print(f'REGRESSION {name}: {value:,.1f} vs baseline {base:,.1f} {UNITS[name][0]} ({change:+.0%})')
+    if regressions:
+        sys.exit(1)
+    print(f'no regressions against {args.baseline}')
+
+
+if __name__ == '__main__':
+    main_bench()
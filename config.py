@@ -1,2 +0,0 @@
-WINNING_SCORE = 3
-AI_DIFFICULTY = 'Extreme'
@@ -0,0 +1,784 @@
+"""Headless Pong rules.
+
+Everything that decides what happens in a match lives here: paddles, ball,
+missiles, stars, stuns and scoring.  Nothing in this module opens a window,
+plays a sound or sleeps, so a match can be stepped as fast as Python allows.
+main.py draws the state and turns the events returned by step() into sounds.
+"""
+import heapq
+import random
+
+import pygame
+
+# Game constants
+SCREEN_WIDTH = 800
+SCREEN_HEIGHT = 600
+PADDLE_WIDTH = 10
+PADDLE_HEIGHT = 100
+BALL_SIZE = 20
+PADDLE_SPEED = 7
+BALL_SPEED_X = 6
+BALL_SPEED_Y = 6
+WINNING_SCORE = 10
+
+# All timers below count simulation ticks
+TICK_RATE = 60
+MISSILE_SPEED = 8
+MISSILE_SIZE = 10
+MISSILE_COOLDOWN_FRAMES = 90  # 1.5 seconds at 60fps
+AI_FIRE_CHANCE = 0.01  # 1% chance per frame
+MISSILE_CAPACITY = 4096  # live missiles; firing beyond this does nothing
+GRID_CELL = 64  # broadphase cell size in pixels
+STAR_SIZE = 20
+STAR_SPAWN_INTERVAL = 600  # 10 seconds at 60fps
+MAX_STARS = 1  # stars on the field at once
+POWER_UP_DURATION = 300  # 5 seconds at 60fps
+STUN_DURATION = 30  # frames (0.5 seconds at 60fps)
+MAX_BOUNCES = 4  # ball impacts resolved within one tick
+FAST_MOVEMENT_FACTOR = 1.25
+TALL_PADDLE_FACTOR = 1.5
+SLOW_MOVEMENT_FACTOR = 0.6
+RAPID_FIRE_FACTOR = 0.5  # missile cooldown multiplier
+
+# AI difficulty mapping: chance the AI misses a volley on purpose
+AI_DIFFICULTY_MAP = {
+    'Easy': 0.15,   # 15% miss
+    'Normal': 0.05, # 5% miss
+    'Hard': 0.01,   # 1% miss
+    'Extreme': 0.001, # 0.1% miss
+}
+
+# Sides
+LEFT = 0   # the human player in the interactive game
+RIGHT = 1  # the AI in the interactive game
+
+# Stacking rules for an effect applied again while it lasts
+REFRESH = 'refresh'  # start its duration over
+EXTEND = 'extend'    # add its duration to what is left
+STACK = 'stack'      # add an instance with its own end; factors multiply
+
+
+def tunable(value):
+    """A number, or the name of a module constant read now, so effects
+    defined at import still follow the settings."""
+    return globals()[value] if isinstance(value, str) else value
+
+
+class Effect:
+    """What an effect does to the side it is on, and for how long."""
+    __slots__ = ('name', 'duration', 'stacking', 'max_stacks', 'stun', 'speed', 'height', 'cooldown')
+
+    def __init__(self, name, duration, stacking=REFRESH, max_stacks=1, stun=False, speed=1.0, height=1.0,
+                 cooldown=1.0):
+        self.name = name
+        self.duration = duration  # ticks
+        self.stacking = stacking
+        self.max_stacks = max_stacks
+        self.stun = stun  # no moving or firing
+        self.speed = speed  # paddle speed multiplier
+        self.height = height  # paddle height multiplier, only drawn
+        self.cooldown = cooldown  # missile cooldown multiplier
+
+
+EFFECTS = (
+    Effect('stun', 'STUN_DURATION', stun=True),
+    Effect('tall_paddle', 'POWER_UP_DURATION', height='TALL_PADDLE_FACTOR'),
+    Effect('fast_movement', 'POWER_UP_DURATION', speed='FAST_MOVEMENT_FACTOR'),
+    Effect('slow_movement', 'POWER_UP_DURATION', STACK, max_stacks=3, speed='SLOW_MOVEMENT_FACTOR'),
+    Effect('rapid_fire', 'POWER_UP_DURATION', EXTEND, cooldown='RAPID_FIRE_FACTOR'),
+)
+EFFECT_INDEX = {effect.name: i for i, effect in enumerate(EFFECTS)}
+STUN = EFFECT_INDEX['stun']
+
+# Which effect a star gives when shot, and to whom
+SHOOTER = 'shooter'
+OPPONENT = 'opponent'
+STAR_EFFECTS = {
+    'yellow': ('stun', OPPONENT),
+    'blue': ('tall_paddle', SHOOTER),
+    'green': ('fast_movement', SHOOTER),
+    'purple': ('slow_movement', OPPONENT),
+    'orange': ('rapid_fire', SHOOTER),
+}
+STAR_TYPES = list(STAR_EFFECTS)
+# Colours main.py and env.py draw stars and each side's missiles in
+STAR_COLORS = {'yellow': (255, 255, 0), 'blue': (0, 0, 255), 'green': (0, 255, 0), 'purple': (160, 32, 240),
+               'orange': (255, 140, 0)}
+MISSILE_COLORS = {LEFT: (255, 0, 0), RIGHT: (0, 0, 255)}  # Red for player, blue for AI
+
+# Input bits for a side driven from outside the engine
+INPUT_UP = 1
+INPUT_DOWN = 2
+INPUT_FIRE = 4  # fire on this tick (an edge, not a held key)
+
+# Events returned by GameState.step()
+PADDLE_HIT = 'paddle_hit'    # (PADDLE_HIT, side)
+MISSILE_HIT = 'missile_hit'  # (MISSILE_HIT, side that was stunned)
+STAR_HIT = 'star_hit'        # (STAR_HIT, side that shot it, star_type)
+POINT = 'point'              # (POINT, side that scored)
+SPEED_UP = 'speed_up'        # (SPEED_UP, side whose hit sped the ball up, new speed multiplier)
+EFFECT_END = 'effect_end'    # (EFFECT_END, side, effect name) when its last instance ends
+GAME_OVER = 'game_over'      # (GAME_OVER, winning side)
+COUNTDOWN = 'countdown'      # (COUNTDOWN, 3, 2, 1 or 0 for "GO!"), from MatchFlow
+
+# MatchFlow phases
+PHASE_COUNTDOWN = 'countdown'
+PHASE_SERVING = 'serving'        # playing field shown, ball not moving yet
+PHASE_PLAYING = 'playing'
+PHASE_POINT_SCORED = 'point_scored'
+PHASE_GAME_OVER = 'game_over'
+
+# Phase lengths in ticks
+FLOW_TIMING = {
+    'point_scored': TICK_RATE * 3 // 16,   # the miss beeps (~180 ms)
+    'countdown_step': TICK_RATE,           # each of 3, 2, 1
+    'countdown_after_point': TICK_RATE,    # each of 3, 2, 1 before later serves
+    'go': TICK_RATE // 2,                  # "GO!" before the first serve
+    'go_after_point': TICK_RATE * 3 // 2,  # "GO!" before later serves
+    'serving': TICK_RATE,                  # field shown before a later serve
+}
+# Headless runs skip straight from one point to the next serve
+HEADLESS_TIMING = dict.fromkeys(FLOW_TIMING, 0)
+
+
+# Broadphase id of the first star, the others follow; the paddles use LEFT and RIGHT
+STAR_TARGET = 2
+
+
+def overlaps(x, y, size, rect):
+    # pygame.Rect.colliderect for a size x size square at (x, y)
+    return x < rect.right and x + size > rect.x and y < rect.bottom and y + size > rect.y
+
+
+def intercept_y(x, y, dx, dy, face_x):
+    """Ball top when its x reaches face_x, moving (dx, dy) per tick and
+    bouncing off the top and bottom walls on the way."""
+    ticks = max(0.0, (face_x - x) / dx)
+    span = SCREEN_HEIGHT - BALL_SIZE
+    folded = (y + dy * ticks) % (2 * span)
+    return folded if folded <= span else 2 * span - folded
+
+
+def sweep(x, y, dx, dy, size, rect):
+    """Swept AABB test of a size x size box moving by (dx, dy) against rect.
+
+    Returns the fraction of the move at which they first overlap (0 if they
+    already do), or None if they never do during this move.
+    """
+    if dx > 0:
+        x_entry = (rect.left - (x + size)) / dx
+        x_exit = (rect.right - x) / dx
+    elif dx < 0:
+        x_entry = (rect.right - x) / dx
+        x_exit = (rect.left - (x + size)) / dx
+    elif rect.left - size < x < rect.right:
+        x_entry, x_exit = float('-inf'), float('inf')
+    else:
+        return None
+    if dy > 0:
+        y_entry = (rect.top - (y + size)) / dy
+        y_exit = (rect.bottom - y) / dy
+    elif dy < 0:
+        y_entry = (rect.bottom - y) / dy
+        y_exit = (rect.top - (y + size)) / dy
+    elif rect.top - size < y < rect.bottom:
+        y_entry, y_exit = float('-inf'), float('inf')
+    else:
+        return None
+    entry = max(x_entry, y_entry)
+    exit = min(x_exit, y_exit)
+    if entry >= exit or entry > 1 or exit <= 0:
+        return None
+    return max(entry, 0.0)
+
+
+class MissilePool:
+    """Fixed-capacity missiles stored as parallel lists.
+
+    The first `count` slots are live.  remove() moves the last live missile
+    into the freed slot, so adding and removing are both O(1).
+    """
+    __slots__ = ('capacity', 'count', 'x', 'y', 'side')
+
+    def __init__(self, capacity=MISSILE_CAPACITY):
+        self.capacity = capacity
+        self.count = 0
+        self.x = [0] * capacity
+        self.y = [0] * capacity
+        self.side = [0] * capacity
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """Yield (x, y, side) for every live missile."""
+        for i in range(self.count):
+            yield self.x[i], self.y[i], self.side[i]
+
+    def add(self, x, y, side):
+        if self.count == self.capacity:
+            return False
+        i = self.count
+        self.x[i] = x
+        self.y[i] = y
+        self.side[i] = side
+        self.count = i + 1
+        return True
+
+    def remove(self, i):
+        last = self.count - 1
+        self.x[i] = self.x[last]
+        self.y[i] = self.y[last]
+        self.side[i] = self.side[last]
+        self.count = last
+
+    def clear(self):
+        self.count = 0
+
+    def snapshot(self):
+        n = self.count
+        return self.x[:n], self.y[:n], self.side[:n]
+
+    def restore(self, state):
+        xs, ys, sides = state
+        n = self.count = len(xs)
+        self.x[:n] = xs
+        self.y[:n] = ys
+        self.side[:n] = sides
+
+
+class Grid:
+    """Uniform grid broadphase: which targets could touch a small rect."""
+
+    def __init__(self, cell=GRID_CELL):
+        self.cell = cell
+        self.cells = {}
+
+    def clear(self):
+        self.cells.clear()
+
+    def insert(self, rect, target):
+        cell = self.cell
+        for cx in range(rect.left // cell, (rect.right - 1) // cell + 1):
+            for cy in range(rect.top // cell, (rect.bottom - 1) // cell + 1):
+                self.cells.setdefault((cx, cy), []).append(target)
+
+    def query(self, x, y, w, h):
+        """Targets in the cells covered by (x, y, w, h); may repeat."""
+        cell = self.cell
+        cells = self.cells
+        left = x // cell
+        right = (x + w - 1) // cell
+        top = y // cell
+        bottom = (y + h - 1) // cell
+        found = cells.get((left, top))
+        if left == right and top == bottom:
+            return found
+        found = list(found) if found else []
+        for cx in range(left, right + 1):
+            for cy in range(top, bottom + 1):
+                if cx == left and cy == top:
+                    continue
+                more = cells.get((cx, cy))
+                if more:
+                    found.extend(more)
+        return found
+
+
+class Side:
+    """One paddle and everything attached to it."""
+    __slots__ = ('rect', 'score', 'missile_cooldown', 'effects',
+                 'stunned', 'speed_factor', 'height_factor', 'cooldown_factor',
+                 'ai_miss_chance', 'ai_approaching', 'ai_miss', 'ai_target_y')
+
+    def __init__(self, x, ai_miss_chance):
+        self.rect = pygame.Rect(x, SCREEN_HEIGHT // 2 - PADDLE_HEIGHT // 2, PADDLE_WIDTH, PADDLE_HEIGHT)
+        self.score = 0
+        self.missile_cooldown = 0
+        # Per effect in EFFECTS, the end ticks of its instances in force,
+        # see GameState.apply_effect(), and below what they add up to
+        self.effects = [[] for _ in EFFECTS]
+        self.stunned = False
+        self.speed_factor = self.height_factor = self.cooldown_factor = 1.0
+        self.ai_miss_chance = ai_miss_chance
+        # The AI's plan for the current volley, see GameState.plan()
+        self.ai_approaching = False
+        self.ai_miss = False
+        self.ai_target_y = SCREEN_HEIGHT // 2
+
+    def update_effects(self):
+        """Recompute the factors after an effect starts or ends."""
+        stunned = False
+        speed = height = cooldown = 1.0
+        for effect, ends in zip(EFFECTS, self.effects):
+            if ends:
+                stacks = len(ends)
+                stunned = stunned or effect.stun
+                speed *= tunable(effect.speed) ** stacks
+                height *= tunable(effect.height) ** stacks
+                cooldown *= tunable(effect.cooldown) ** stacks
+        self.stunned = stunned
+        self.speed_factor = speed
+        self.height_factor = height
+        self.cooldown_factor = cooldown
+
+    def remaining(self, index, tick):
+        """Ticks left of effect EFFECTS[index] after `tick`."""
+        ends = self.effects[index]
+        return max(ends) - tick - 1 if ends else 0
+
+    def movement_speed(self):
+        return PADDLE_SPEED * self.speed_factor
+
+    def snapshot(self):
+        return (self.rect.y, self.score, self.missile_cooldown, tuple(tuple(ends) for ends in self.effects),
+                self.ai_approaching, self.ai_miss, self.ai_target_y)
+
+    def restore(self, state):
+        (self.rect.y, self.score, self.missile_cooldown, effects,
+         self.ai_approaching, self.ai_miss, self.ai_target_y) = state
+        self.effects = [list(ends) for ends in effects]
+        self.update_effects()
+
+
+class GameState:
+    """A whole match.  Call step() once per tick.
+
+    Each side is either driven by input bits (INPUT_UP | INPUT_DOWN |
+    INPUT_FIRE) or, when its input is None, by the built-in AI.  `rng` is
+    anything with the `random` module's interface and defaults to it.
+    """
+    multiball = False  # see multiball.MultiBallState
+
+    def __init__(self, winning_score=WINNING_SCORE, right_difficulty='Normal',
+                 left_difficulty='Normal', rng=None):
+        self.rng = rng if rng is not None else random
+        self.winning_score = winning_score
+        self.left = Side(30, AI_DIFFICULTY_MAP.get(left_difficulty, 0.05))
+        self.right = Side(SCREEN_WIDTH - 40, AI_DIFFICULTY_MAP.get(right_difficulty, 0.05))
+        self.sides = (self.left, self.right)
+        # Ball
+        self.ball_rect = pygame.Rect(SCREEN_WIDTH // 2 - BALL_SIZE // 2, SCREEN_HEIGHT // 2 - BALL_SIZE // 2, BALL_SIZE, BALL_SIZE)
+        self.ball_speed_x = BALL_SPEED_X * self.rng.choice([-1, 1])
+        self.ball_speed_y = BALL_SPEED_Y * self.rng.choice([-1, 1])
+        self.speed_multiplier = 1.0
+        self.missiles = MissilePool()
+        self.grid = Grid()
+        # Star power-ups: (rect, star_type) each
+        self.stars = []
+        self.star_spawn_timer = 0
+        # Heap of (end tick, side, effect index), see apply_effect()
+        self.expiries = []
+        self.tick = 0
+        self.winner = None
+        self.plan_dirty = True
+        # A frametime.FrameTimer while frame timing is on
+        self.timer = None
+
+    def reset_ball(self, direction):
+        self.ball_rect.x = SCREEN_WIDTH // 2 - BALL_SIZE // 2
+        self.ball_rect.y = SCREEN_HEIGHT // 2 - BALL_SIZE // 2
+        self.ball_speed_x = BALL_SPEED_X * direction
+        self.ball_speed_y = BALL_SPEED_Y * self.rng.choice([-1, 1])
+        self.plan_dirty = True
+
+    def snapshot(self):
+        """Everything step() reads, as plain values, for restore().
+
+        Cheap enough to take every tick, which rollback netplay does.
+        """
+        stars = tuple((tuple(rect), star_type) for rect, star_type in self.stars)
+        return (self.left.snapshot(), self.right.snapshot(), self.ball_rect.topleft,
+                self.ball_speed_x, self.ball_speed_y, self.speed_multiplier, self.missiles.snapshot(),
+                stars, self.star_spawn_timer, tuple(self.expiries), self.tick, self.winner, self.plan_dirty,
+                self.rng.getstate())
+
+    def restore(self, state):
+        (left, right, self.ball_rect.topleft, self.ball_speed_x, self.ball_speed_y, self.speed_multiplier,
+         missiles, stars, self.star_spawn_timer, expiries, self.tick, self.winner, self.plan_dirty,
+         rng) = state
+        self.left.restore(left)
+        self.right.restore(right)
+        self.missiles.restore(missiles)
+        self.stars = [(pygame.Rect(rect), star_type) for rect, star_type in stars]
+        self.expiries = list(expiries)
+        self.rng.setstate(rng)
+
+    def apply_effect(self, side, index):
+        """Put EFFECTS[index] on `side`.
+
+        An effect applied on tick T for D ticks is in force through tick
+        T + D.  Its end goes on the expiries heap, so step() only touches
+        effects that are ending; entries left behind by a refresh or an
+        extension no longer match an end and are skipped.
+        """
+        effect = EFFECTS[index]
+        s = self.sides[side]
+        ends = s.effects[index]
+        duration = tunable(effect.duration)
+        end = self.tick + duration + 1
+        if ends and effect.stacking == EXTEND:
+            end = ends[0] = ends[0] + duration
+        elif effect.stacking == STACK:
+            if len(ends) == effect.max_stacks:
+                ends.remove(min(ends))
+            ends.append(end)
+        else:
+            ends[:] = [end]
+        heapq.heappush(self.expiries, (end, side, index))
+        s.update_effects()
+
+    def plan(self, side):
+        """Plan an AI paddle's move after a serve, paddle hit or bounce.
+
+        When the ball is coming, aim at the point where it will reach the
+        paddle, folding in every wall bounce on the way.  Whether to miss is
+        decided once per volley, with the side's ai_miss_chance; a missing
+        paddle aims just clear of the ball instead.  Otherwise wait in the
+        middle.
+        """
+        s = self.sides[side]
+        dx = int(self.ball_speed_x * self.speed_multiplier)
+        dy = int(self.ball_speed_y * self.speed_multiplier)
+        if not (dx > 0 if side == RIGHT else dx < 0):
+            s.ai_approaching = False
+            s.ai_target_y = SCREEN_HEIGHT // 2
+            return
+        if not s.ai_approaching:
+            s.ai_approaching = True
+            s.ai_miss = self.rng.random() < s.ai_miss_chance
+        face_x = s.rect.left - BALL_SIZE if side == RIGHT else s.rect.right
+        self.aim(s, intercept_y(self.ball_rect.x, self.ball_rect.y, dx, dy, face_x) + BALL_SIZE // 2)
+
+    @staticmethod
+    def aim(s, target):
+        """Send side `s` to meet a ball arriving at height `target`, or
+        just clear of it when it is missing this volley."""
+        if s.ai_miss:
+            offset = PADDLE_HEIGHT // 2 + BALL_SIZE
+            if target + offset <= SCREEN_HEIGHT - PADDLE_HEIGHT // 2:
+                target += offset
+            else:
+                target -= offset
+        s.ai_target_y = int(target)
+
+    def fire(self, side):
+        shooter = self.sides[side]
+        if side == LEFT:
+            x = shooter.rect.right
+        else:
+            x = shooter.rect.left - MISSILE_SIZE
+        self.missiles.add(x, shooter.rect.centery - MISSILE_SIZE // 2, side)
+        shooter.missile_cooldown = int(MISSILE_COOLDOWN_FRAMES * shooter.cooldown_factor)
+
+    def step(self, left=None, right=None):
+        """Advance the match by one tick and return the events it produced."""
+        events = []
+        if self.winner is not None:
+            return events
+        self.tick += 1
+        rng = self.rng
+        timer = self.timer
+        inputs = (left, right)
+        sides = self.sides
+
+        # Fire missiles from input
+        for side, bits in enumerate(inputs):
+            if bits is not None and bits & INPUT_FIRE:
+                if not sides[side].stunned and sides[side].missile_cooldown <= 0:
+                    self.fire(side)
+
+        # Update missile cooldowns
+        for s in sides:
+            if s.missile_cooldown > 0:
+                s.missile_cooldown -= 1
+
+        # End the effects that are due
+        expiries = self.expiries
+        while expiries and expiries[0][0] <= self.tick:
+            end, side, index = heapq.heappop(expiries)
+            s = sides[side]
+            ends = s.effects[index]
+            if end in ends:
+                ends.remove(end)
+                s.update_effects()
+                if not ends:
+                    events.append((EFFECT_END, side, EFFECTS[index].name))
+
+        # Star power-up spawning
+        if len(self.stars) < MAX_STARS:
+            self.star_spawn_timer += 1
+            if self.star_spawn_timer >= STAR_SPAWN_INTERVAL:
+                self.stars.append((pygame.Rect(SCREEN_WIDTH // 2 - STAR_SIZE // 2, rng.randint(50, SCREEN_HEIGHT - 50), STAR_SIZE, STAR_SIZE),
+                                   rng.choice(STAR_TYPES)))
+                self.star_spawn_timer = 0
+
+        # AI missile firing
+        for side, bits in enumerate(inputs):
+            s = sides[side]
+            if bits is None and s.missile_cooldown <= 0 and not s.stunned and rng.random() < AI_FIRE_CHANCE:
+                self.fire(side)
+
+        if timer:
+            timer.mark('sim')
+
+        # AI planning, only when the ball's course has changed
+        if self.plan_dirty:
+            self.plan_dirty = False
+            for side, bits in enumerate(inputs):
+                if bits is None:
+                    self.plan(side)
+
+        # Paddle movement (only if not stunned)
+        for side, bits in enumerate(inputs):
+            s = sides[side]
+            if s.stunned:
+                continue
+            rect = s.rect
+            movement_speed = int(s.movement_speed())
+            if bits is not None:
+                if bits & INPUT_UP and rect.top > 0:
+                    rect.y -= movement_speed
+                if bits & INPUT_DOWN and rect.bottom < SCREEN_HEIGHT:
+                    rect.y += movement_speed
+                continue
+            # Follow the plan: O(1) per tick
+            distance = s.ai_target_y - rect.centery
+            if distance > 0 and rect.bottom < SCREEN_HEIGHT:
+                rect.y += min(movement_speed, distance)
+            elif distance < 0 and rect.top > 0:
+                rect.y -= min(movement_speed, -distance)
+
+        if timer:
+            timer.mark('ai')
+
+        # Update missiles.  Only targets sharing a grid cell with a missile
+        # get an exact test, so live missiles can run into the thousands.
+        missiles = self.missiles
+        grid = self.grid
+        stars = self.stars
+        if missiles.count:
+            grid.clear()
+            grid.insert(self.left.rect, LEFT)
+            grid.insert(self.right.rect, RIGHT)
+            for i, (rect, _) in enumerate(stars):
+                grid.insert(rect, STAR_TARGET + i)
+        shot = False
+        mx = missiles.x
+        my = missiles.y
+        mside = missiles.side
+        i = 0
+        while i < missiles.count:
+            side = mside[i]
+            if side == LEFT:
+                x = mx[i] = mx[i] + MISSILE_SPEED
+                gone = x > SCREEN_WIDTH
+            else:
+                x = mx[i] = mx[i] - MISSILE_SPEED
+                gone = x < 0
+            if gone:
+                missiles.remove(i)
+                continue
+            y = my[i]
+            targets = grid.query(x, y, MISSILE_SIZE, MISSILE_SIZE)
+            if not targets:
+                i += 1
+                continue
+            target = sides[1 - side]
+            if 1 - side in targets and not target.stunned and overlaps(x, y, MISSILE_SIZE, target.rect):
+                missiles.remove(i)
+                self.apply_effect(1 - side, STUN)
+                events.append((MISSILE_HIT, 1 - side))
+                continue
+            star = None
+            for found in targets:
+                if found >= STAR_TARGET and stars[found - STAR_TARGET] \
+                        and overlaps(x, y, MISSILE_SIZE, stars[found - STAR_TARGET][0]):
+                    star = found - STAR_TARGET
+                    break
+            if star is None:
+                i += 1
+                continue
+            missiles.remove(i)
+            star_type = stars[star][1]
+            # Shot stars stay as None until the loop is over, so grid ids hold
+            stars[star] = None
+            shot = True
+            name, whom = STAR_EFFECTS[star_type]
+            self.apply_effect(side if whom == SHOOTER else 1 - side, EFFECT_INDEX[name])
+            events.append((STAR_HIT, side, star_type))
+        if shot:
+            self.stars = [star for star in stars if star]
+
+        if timer:
+            timer.mark('missiles')
+
+        self._update_ball(events)
+        if timer:
+            timer.mark('ball')
+        return events
+
+    def _update_ball(self, events):
+        # Ball movement, swept so a fast ball cannot pass through a paddle
+        hit_paddle = self._move_ball(events)
+        if hit_paddle is not None:
+            self.speed_multiplier *= 1.05  # Increase speed by 5%
+            events.append((SPEED_UP, hit_paddle, self.speed_multiplier))
+
+        # Score update
+        ball_rect = self.ball_rect
+        if ball_rect.left <= 0:
+            self._score(RIGHT, events)
+        if self.winner is None and ball_rect.right >= SCREEN_WIDTH:
+            self._score(LEFT, events)
+
+    def _move_ball(self, events):
+        """Move the ball through one tick, bouncing off walls and paddles at
+        the exact time of impact and spending the rest of the tick moving
+        away from it.  Returns the last paddle hit, or None."""
+        ball_rect = self.ball_rect
+        x = float(ball_rect.x)
+        y = float(ball_rect.y)
+        remaining = 1.0
+        hit_paddle = None
+        for _ in range(MAX_BOUNCES):
+            dx = int(self.ball_speed_x * self.speed_multiplier) * remaining
+            dy = int(self.ball_speed_y * self.speed_multiplier) * remaining
+            # Earliest impact as a fraction of (dx, dy)
+            when = None
+            what = None
+            if dy < 0 and y + dy <= 0:
+                when, what = max(0.0, -y / dy), 'wall'
+            elif dy > 0 and y + BALL_SIZE + dy >= SCREEN_HEIGHT:
+                when, what = max(0.0, (SCREEN_HEIGHT - BALL_SIZE - y) / dy), 'wall'
+            side = LEFT if dx < 0 else RIGHT
+            if dx != 0:
+                t = sweep(x, y, dx, dy, BALL_SIZE, self.sides[side].rect)
+                if t is not None and (when is None or t < when):
+                    when, what = t, side
+            if when is None:
+                x += dx
+                y += dy
+                break
+            x += dx * when
+            y += dy * when
+            remaining *= 1.0 - when
+            self.plan_dirty = True
+            if what == 'wall':
+                self.ball_speed_y *= -1
+            else:
+                self.ball_speed_x *= -1
+                self.ball_speed_y += self.rng.randint(-2, 2)
+                hit_paddle = what
+                events.append((PADDLE_HIT, what))
+            if remaining <= 0:
+                break
+        ball_rect.x = round(x)
+        ball_rect.y = round(y)
+        return hit_paddle
+
+    def _score(self, side, events):
+        scorer = self.sides[side]
+        scorer.score += 1
+        # The next serve heads towards the side that scored
+        self.reset_ball(1 if side == RIGHT else -1)
+        for s in self.sides:
+            s.ai_approaching = False
+        self.speed_multiplier = 1.0
+        events.append((POINT, side))
+        if scorer.score >= self.winning_score:
+            self.winner = side
+            events.append((GAME_OVER, side))
+
+
+class MatchFlow:
+    """Match flow around a GameState: countdown, serving, playing,
+    point scored and game over, all counted in ticks.
+
+    step() is called once per tick like GameState.step() and only advances
+    the game while playing, so nothing ever has to sleep.  Phases with a
+    length of 0 in `timing` are skipped.
+    """
+
+    def __init__(self, game, timing=FLOW_TIMING):
+        self.game = game
+        self.timing = timing
+        self.tick = 0
+        self.after_point = False
+        self.pending = []
+        self.phase = PHASE_COUNTDOWN
+        self.count = 3
+        self.timer = timing['countdown_step']
+        if self.timer > 0:
+            self.pending.append((COUNTDOWN, self.count))
+        else:
+            self._next(self.pending)
+
+    def snapshot(self):
+        return (self.game.snapshot(), self.tick, self.after_point, list(self.pending),
+                self.phase, self.count, self.timer)
+
+    def restore(self, state):
+        game, self.tick, self.after_point, pending, self.phase, self.count, self.timer = state
+        self.game.restore(game)
+        self.pending = list(pending)
+
+    def _next(self, events):
+        # Leave the current phase, passing through any zero-length ones
+        timing = self.timing
+        while True:
+            if self.phase == PHASE_POINT_SCORED:
+                self.phase = PHASE_COUNTDOWN
+                self.count = 3
+                self.timer = timing['countdown_after_point']
+            elif self.phase == PHASE_COUNTDOWN and self.count > 0:
+                self.count -= 1
+                if self.count > 0:
+                    self.timer = timing['countdown_after_point' if self.after_point else 'countdown_step']
+                else:
+                    self.timer = timing['go_after_point'] if self.after_point else timing['go']
+            elif self.phase == PHASE_COUNTDOWN and self.after_point:
+                self.phase = PHASE_SERVING
+                self.timer = timing['serving']
+            else:
+                self.phase = PHASE_PLAYING
+                return
+            if self.timer > 0:
+                if self.phase == PHASE_COUNTDOWN:
+                    events.append((COUNTDOWN, self.count))
+                return
+
+    def step(self, left=None, right=None):
+        """Advance one tick and return the game's and the flow's events."""
+        events = self.pending
+        self.pending = []
+        if self.phase == PHASE_GAME_OVER:
+            return events
+        self.tick += 1
+        if self.phase == PHASE_PLAYING:
+            scored = False
+            for event in self.game.step(left, right):
+                events.append(event)
+                scored = scored or event[0] == POINT
+            if self.game.winner is not None:
+                self.phase = PHASE_GAME_OVER
+            elif scored:
+                self.after_point = True
+                self.phase = PHASE_POINT_SCORED
+                self.timer = self.timing['point_scored']
+                if self.timer <= 0:
+                    self._next(events)
+            return events
+        self.timer -= 1
+        if self.timer <= 0:
+            self._next(events)
+        return events
+
+
+def run_headless(game, max_ticks=None):
+    """Play an AI-vs-AI match to completion and return the winning side."""
+    while game.winner is None:
+        if max_ticks is not None and game.tick >= max_ticks:
+            break
+        game.step()
+    return game.winner
@@ -0,0 +1,274 @@
+"""Training environment: the Pong rules behind reset() and step().
+
+PongEnv puts an agent on the left paddle against the engine's AI on the
+right.  Each step is one GameState tick, with no countdowns or pauses
+between points.  An action is the left side's input bits (INPUT_UP,
+INPUT_DOWN, INPUT_FIRE, so 0-7).  The reward is +1 when the agent scores
+and -1 when the AI does.  An episode is done when the match has a winner
+or after `max_ticks` ticks.
+
+Observations come in three modes, all buffers that step() updates in place
+and returns again, so copy one to keep it:
+
+    'state'   a float32 vector, the STATE_FIELDS below
+    'pixels'  the RGB pixels of an off-screen surface as a (width, height, 3)
+              view from pygame.surfarray.pixels3d; only the objects that
+              moved are erased and redrawn
+    'gray'    a (height // scale, width // scale) uint8 array drawn straight
+              into with slices
+
+VecEnv steps many environments per call and resets each one when its
+episode ends.
+
+    python env.py --envs 64 --steps 200000 --observation state
+"""
+import argparse
+import random
+import time
+
+import numpy
+import pygame
+
+import engine
+from engine import (
+    SCREEN_WIDTH, SCREEN_HEIGHT, PADDLE_HEIGHT, WINNING_SCORE, MISSILE_SIZE, STAR_TYPES, STAR_COLORS,
+    MISSILE_COLORS, STUN, GameState, POINT, LEFT, RIGHT,
+)
+
+OBSERVATIONS = ('state', 'pixels', 'gray')
+STATE_FIELDS = (
+    'ball_x', 'ball_y', 'ball_dx', 'ball_dy',  # positions in screen sizes, speeds in serve speeds
+    'paddle_y', 'paddle_height', 'stun', 'cooldown',
+    'opponent_y', 'opponent_height', 'opponent_stun', 'opponent_cooldown',
+    'missile_x', 'missile_y',  # the AI's missile closest to the agent, or -1
+    'star_y', 'star_type',  # the first star, -1 with none; the type is its index in STAR_TYPES, scaled to 0-1
+)
+STATE_SIZE = len(STATE_FIELDS)
+GRAY_SCALE = 4  # pixels per gray observation cell along each axis
+MAX_TICKS = 100000  # ticks before an episode is cut short
+
+# Pixel mode colours, as main.py draws them; stars and missiles use the
+# engine's STAR_COLORS and MISSILE_COLORS
+BLACK = (0, 0, 0)
+WHITE = (255, 255, 255)
+# Gray mode shades
+GRAY_PADDLE = 255
+GRAY_BALL = 255
+GRAY_MISSILE = 128
+GRAY_STAR = 192
+
+
+class PongEnv:
+
+    def __init__(self, observation='state', opponent='Normal', winning_score=WINNING_SCORE, seed=None,
+                 max_ticks=MAX_TICKS, scale=GRAY_SCALE, out=None):
+        if observation not in OBSERVATIONS:
+            raise ValueError(f"observation must be one of {', '.join(OBSERVATIONS)}, not {observation!r}")
+        self.observation = observation
+        self.opponent = opponent
+        self.winning_score = winning_score
+        self.max_ticks = max_ticks
+        self.scale = scale
+        self.rng = random.Random(seed)
+        self.game = None
+        self.drawn = []  # rects on the surface or buffer from the last draw
+        # `out` lets VecEnv hand each environment a row of one big array
+        if observation == 'state':
+            self.obs = numpy.zeros(STATE_SIZE, numpy.float32) if out is None else out
+        elif observation == 'gray':
+            shape = (SCREEN_HEIGHT // scale, SCREEN_WIDTH // scale)
+            self.obs = numpy.zeros(shape, numpy.uint8) if out is None else out
+        else:
+            self.surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+            self.surface.fill(BLACK)
+            # Holds the surface locked for good; fill() still works on it
+            self.obs = pygame.surfarray.pixels3d(self.surface)
+
+    def reset(self, seed=None):
+        """Start a new match and return its first observation.  A seed
+        restarts the environment's random stream."""
+        if seed is not None:
+            self.rng.seed(seed)
+        self.game = GameState(self.winning_score, self.opponent, rng=self.rng)
+        if self.observation == 'pixels':
+            self.surface.fill(BLACK)
+            self.drawn = []
+        elif self.observation == 'gray':
+            self.obs[:] = 0
+            self.drawn = []
+        return self._observe()
+
+    def step(self, action):
+        """Advance one tick with `action` as the agent's input bits and
+        return (observation, reward, done, info)."""
+        game = self.game
+        events = game.step(action, None)
+        reward = 0.0
+        for event in events:
+            if event[0] == POINT:
+                reward += 1.0 if event[1] == LEFT else -1.0
+        done = game.winner is not None or game.tick >= self.max_ticks
+        info = {'events': events, 'tick': game.tick, 'score': (game.left.score, game.right.score),
+                'winner': game.winner}
+        return self._observe(), reward, done, info
+
+    def _observe(self):
+        if self.observation == 'state':
+            self._state()
+        elif self.observation == 'pixels':
+            self._draw_pixels()
+        else:
+            self._draw_gray()
+        return self.obs
+
+    def _state(self):
+        game = self.game
+        left, right = game.left, game.right
+        ball = game.ball_rect
+        # The AI's missile nearest the agent's paddle
+        missiles = game.missiles
+        xs, ys, sides = missiles.x, missiles.y, missiles.side
+        missile_x = missile_y = -1.0
+        nearest = SCREEN_WIDTH
+        for i in range(missiles.count):
+            if sides[i] == RIGHT and xs[i] < nearest:
+                nearest = xs[i]
+                missile_x = xs[i] / SCREEN_WIDTH
+                missile_y = ys[i] / SCREEN_HEIGHT
+        star = game.stars[0] if game.stars else None
+        self.obs[:] = (
+            ball.x / SCREEN_WIDTH, ball.y / SCREEN_HEIGHT,
+            game.ball_speed_x * game.speed_multiplier / engine.BALL_SPEED_X,
+            game.ball_speed_y * game.speed_multiplier / engine.BALL_SPEED_Y,
+            left.rect.y / SCREEN_HEIGHT, PADDLE_HEIGHT * left.height_factor / SCREEN_HEIGHT,
+            left.remaining(STUN, game.tick) / engine.STUN_DURATION,
+            left.missile_cooldown / max(1, engine.MISSILE_COOLDOWN_FRAMES),
+            right.rect.y / SCREEN_HEIGHT, PADDLE_HEIGHT * right.height_factor / SCREEN_HEIGHT,
+            right.remaining(STUN, game.tick) / engine.STUN_DURATION,
+            right.missile_cooldown / max(1, engine.MISSILE_COOLDOWN_FRAMES),
+            missile_x, missile_y,
+            star[0].y / SCREEN_HEIGHT if star else -1.0,
+            STAR_TYPES.index(star[1]) / (len(STAR_TYPES) - 1) if star else -1.0,
+        )
+
+    def _shapes(self):
+        """(rect, colour, gray shade) of everything on the field."""
+        game = self.game
+        shapes = [(paddle_rect(game.left), WHITE, GRAY_PADDLE), (paddle_rect(game.right), WHITE, GRAY_PADDLE),
+                  (game.ball_rect, WHITE, GRAY_BALL)]
+        for rect, star_type in game.stars:
+            shapes.append((rect, STAR_COLORS[star_type], GRAY_STAR))
+        missiles = game.missiles
+        xs, ys, sides = missiles.x, missiles.y, missiles.side
+        for i in range(missiles.count):
+            shapes.append(((xs[i], ys[i], MISSILE_SIZE, MISSILE_SIZE), MISSILE_COLORS[sides[i]], GRAY_MISSILE))
+        return shapes
+
+    def _draw_pixels(self):
+        fill = self.surface.fill
+        for rect in self.drawn:
+            fill(BLACK, rect)
+        drawn = []
+        for rect, color, _ in self._shapes():
+            drawn.append(fill(color, rect))
+        self.drawn = drawn
+
+    def _draw_gray(self):
+        obs = self.obs
+        for y0, y1, x0, x1 in self.drawn:
+            obs[y0:y1, x0:x1] = 0
+        scale = self.scale
+        drawn = []
+        for rect, _, shade in self._shapes():
+            x, y, w, h = rect
+            # Cells a rect touches at all, so a thin missile never vanishes
+            area = (max(0, y // scale), (y + h + scale - 1) // scale, max(0, x // scale), (x + w + scale - 1) // scale)
+            obs[area[0]:area[1], area[2]:area[3]] = shade
+            drawn.append(area)
+        self.drawn = drawn
+
+
+def paddle_rect(side):
+    """The paddle as main.py draws it: its height scaled by the tall
+    paddle effect, around the same centre."""
+    rect = side.rect
+    height = int(PADDLE_HEIGHT * side.height_factor)
+    return rect.x, rect.y + PADDLE_HEIGHT // 2 - height // 2, rect.width, height
+
+
+class VecEnv:
+    """`n` PongEnvs stepped together.
+
+    Observations are one (n, ...) array, each environment writing its own
+    row; in pixel mode, whose views belong to each environment's surface,
+    they are a list.  An environment whose episode ends is reset at once,
+    so its row already holds the next episode's first observation.
+    """
+
+    def __init__(self, n, observation='state', opponent='Normal', winning_score=WINNING_SCORE, seed=None,
+                 max_ticks=MAX_TICKS, scale=GRAY_SCALE):
+        seeds = random.Random(seed)
+        if observation == 'state':
+            self.obs = numpy.zeros((n, STATE_SIZE), numpy.float32)
+        elif observation == 'gray':
+            self.obs = numpy.zeros((n, SCREEN_HEIGHT // scale, SCREEN_WIDTH // scale), numpy.uint8)
+        else:
+            self.obs = None
+        self.envs = [PongEnv(observation, opponent, winning_score, seeds.getrandbits(64), max_ticks, scale,
+                             None if self.obs is None else self.obs[i])
+                     for i in range(n)]
+        if self.obs is None:
+            self.obs = [env.obs for env in self.envs]
+        self.rewards = numpy.zeros(n, numpy.float32)
+        self.dones = numpy.zeros(n, bool)
+
+    def __len__(self):
+        return len(self.envs)
+
+    def reset(self, seed=None):
+        seeds = random.Random(seed)
+        for env in self.envs:
+            env.reset(None if seed is None else seeds.getrandbits(64))
+        return self.obs
+
+    def step(self, actions):
+        """Step every environment with its action and return
+        (observations, rewards, dones, infos)."""
+        rewards = self.rewards
+        dones = self.dones
+        infos = []
+        for i, env in enumerate(self.envs):
+            _, rewards[i], done, info = env.step(int(actions[i]))
+            dones[i] = done
+            if done:
+                env.reset()
+            infos.append(info)
+        return self.obs, rewards, dones, infos
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Step Pong environments with random actions and report the rate')
+    parser.add_argument('--envs', type=int, default=16)
+    parser.add_argument('--steps', type=int, default=200000, help='total over all environments')
+    parser.add_argument('--observation', choices=OBSERVATIONS, default='state')
+    parser.add_argument('--opponent', default='Normal')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    envs = VecEnv(args.envs, args.observation, args.opponent, seed=args.seed)
+    envs.reset(args.seed)
+    actions = numpy.random.default_rng(args.seed).integers(0, 8, (args.steps // args.envs + 1, args.envs))
+    points = episodes = 0
+    start = time.perf_counter()
+    for row in actions[:args.steps // args.envs]:
+        _, rewards, dones, _ = envs.step(row)
+        points += int(numpy.count_nonzero(rewards))
+        episodes += int(dones.sum())
+    elapsed = time.perf_counter() - start
+    steps = args.steps // args.envs * args.envs
+    print(f'{steps:,} {args.observation} steps in {elapsed:.2f} s: {steps / elapsed:,.0f} steps/s '
+          f'({points} points, {episodes} episodes finished)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""Match event log: typed events, buffered in memory, written by a thread.
+
+The game loop hands each engine event to EventLog.emit(), which only puts
+it in a fixed-size ring buffer.  A background thread takes batches out of
+the ring, formats them and appends them to the log file, so the loop never
+touches a file.  When the writer falls behind and the ring is full, new
+events are dropped and counted rather than making a frame wait.
+
+Files are JSON lines, one object per event, or with a .bin name compact
+binary records after a MAGIC header.  When a file passes `max_bytes` it is
+renamed to PATH.1 (PATH.1 to PATH.2 and so on, keeping `backups` of them)
+and a new one is started.
+
+    python eventlog.py match.jsonl          # print a log, either format
+"""
+import argparse
+import json
+import os
+import struct
+import threading
+import time
+
+from engine import PADDLE_HIT, SPEED_UP, POINT, MISSILE_HIT, STAR_HIT, EFFECT_END, GAME_OVER, EFFECTS, EFFECT_INDEX, \
+    STAR_TYPES
+
+# Logged event types, by their code in binary records
+TYPES = (PADDLE_HIT, SPEED_UP, POINT, MISSILE_HIT, STAR_HIT, EFFECT_END, GAME_OVER)
+CODES = {kind: code for code, kind in enumerate(TYPES)}
+# The name each event's third field gets in JSON
+DETAILS = {SPEED_UP: 'speed_multiplier', STAR_HIT: 'star_type', EFFECT_END: 'effect'}
+
+CAPACITY = 8192  # events the ring holds
+BATCH = 512  # events per write
+FLUSH_INTERVAL = 0.25  # seconds the writer sleeps when there is little to do
+MAX_BYTES = 8 << 20  # file size that triggers a rotation
+BACKUPS = 3  # rotated files kept
+
+MAGIC = b'PONGEVT1'
+RECORD = struct.Struct('<dIIBbf')  # wall time, match, tick, type code, side, detail
+
+
+class EventLog:
+
+    def __init__(self, path, binary=None, capacity=CAPACITY, batch=BATCH, max_bytes=MAX_BYTES, backups=BACKUPS,
+                 flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.binary = path.endswith('.bin') if binary is None else binary
+        self.capacity = capacity
+        self.batch = batch
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        # Single producer, single consumer: emit() only moves head and the
+        # writer only moves tail, so neither needs a lock
+        self.ring = [None] * capacity
+        self.head = 0
+        self.tail = 0
+        self.match = 0
+        self.emitted = 0
+        self.dropped = 0
+        self.written = 0
+        self.rotations = 0
+        self.file = None
+        self.wake = threading.Event()
+        self.stopping = False
+        self.thread = threading.Thread(target=self._run, name='eventlog', daemon=True)
+        self.thread.start()
+
+    def new_match(self):
+        """Events from now on belong to the next match."""
+        self.match += 1
+
+    def emit(self, tick, event):
+        """Queue an engine event.  Returns False if the ring was full and
+        the event was dropped."""
+        if event[0] not in CODES:
+            return False
+        head = self.head
+        if head - self.tail >= self.capacity:
+            self.dropped += 1
+            return False
+        self.ring[head % self.capacity] = (time.time(), self.match, tick, event)
+        self.head = head + 1
+        self.emitted += 1
+        if head + 1 - self.tail == self.batch:
+            self.wake.set()
+        return True
+
+    def close(self):
+        """Write whatever is still queued and stop the writer."""
+        self.stopping = True
+        self.wake.set()
+        self.thread.join()
+
+    def stats(self):
+        return {'emitted': self.emitted, 'written': self.written, 'dropped': self.dropped,
+                'queued': self.head - self.tail, 'rotations': self.rotations}
+
+    def _run(self):
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            stopping = self.stopping
+            while self.head != self.tail:
+                self._write(self._take())
+            if self.file:
+                self.file.flush()
+            if stopping:
+                break
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def _take(self):
+        tail = self.tail
+        end = min(self.head, tail + self.batch)
+        ring = self.ring
+        capacity = self.capacity
+        records = []
+        for i in range(tail, end):
+            records.append(ring[i % capacity])
+            ring[i % capacity] = None
+        self.tail = end
+        return records
+
+    def _write(self, records):
+        data = encode_binary(records) if self.binary else encode_json(records)
+        if self.file is None:
+            self._open()
+        elif self.file.tell() + len(data) > self.max_bytes:
+            self._rotate()
+        self.file.write(data)
+        self.written += len(records)
+
+    def _open(self):
+        self.file = open(self.path, 'ab')
+        if self.binary and self.file.tell() == 0:
+            self.file.write(MAGIC)
+
+    def _rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'):
+                os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        if self.backups:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
+        self.rotations += 1
+        self._open()
+
+
+def detail(event):
+    """The event's third field as a number, for binary records."""
+    kind = event[0]
+    if kind == STAR_HIT:
+        return STAR_TYPES.index(event[2])
+    if kind == EFFECT_END:
+        return EFFECT_INDEX[event[2]]
+    if kind == SPEED_UP:
+        return event[2]
+    return 0
+
+
+def encode_json(records):
+    lines = []
+    for at, match, tick, event in records:
+        kind = event[0]
+        entry = {'time': round(at, 6), 'match': match, 'tick': tick, 'type': kind, 'side': event[1]}
+        if kind in DETAILS:
+            entry[DETAILS[kind]] = event[2]
+        lines.append(json.dumps(entry, separators=(',', ':')))
+    lines.append('')
+    return '\n'.join(lines).encode()
+
+
+def encode_binary(records):
+    pack = RECORD.pack
+    return b''.join(pack(at, match, tick, CODES[event[0]], event[1], detail(event))
+                    for at, match, tick, event in records)
+
+
+def read(path):
+    """Yield the events of a log file as JSON-style dicts."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            f.seek(0)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
+        data = f.read()
+    for at, match, tick, code, side, value in RECORD.iter_unpack(data[:len(data) - len(data) % RECORD.size]):
+        kind = TYPES[code]
+        entry = {'time': at, 'match': match, 'tick': tick, 'type': kind, 'side': side}
+        if kind == STAR_HIT:
+            entry['star_type'] = STAR_TYPES[int(value)]
+        elif kind == EFFECT_END:
+            entry['effect'] = EFFECTS[int(value)].name
+        elif kind == SPEED_UP:
+            entry['speed_multiplier'] = value
+        yield entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print a match event log')
+    parser.add_argument('path')
+    args = parser.parse_args()
+    for entry in read(args.path):
+        print(json.dumps(entry))
+
+
+if __name__ == '__main__':
+    main()
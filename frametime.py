@@ -0,0 +1,131 @@
+"""Per-phase frame timing.
+
+FrameTimer.mark(phase) charges the time since the previous mark to
+`phase`; end_frame() closes the frame and stores its phase times in a ring
+buffer of the last FRAMES frames.  Everything is preallocated, so a mark is
+a perf_counter() call and two list updates.  Code that is timed holds a
+timer that is None when timing is off and skips the marks entirely.
+
+The buffer gives the numbers for the in-game overlay (FPS, frame time
+percentiles, slowest phase) and is exported as per-phase histograms to
+CSV or JSON.
+"""
+import csv
+import json
+import time
+
+# In the order a frame runs through them
+PHASES = ('events', 'sim', 'ai', 'missiles', 'ball', 'draw', 'flip', 'sound', 'overlay', 'wait')
+FRAMES = 1024  # ring buffer length
+# Histogram bucket upper edges in microseconds; the last bucket is open
+BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16667, 33333, 66667)
+
+
+def percentile(values, p):
+    """p-th percentile (0-100) of an already sorted list."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class FrameTimer:
+
+    def __init__(self, phases=PHASES, frames=FRAMES):
+        self.phases = phases
+        self.index = {phase: i for i, phase in enumerate(phases)}
+        self.frames = frames
+        # One row per frame: seconds spent in each phase
+        self.samples = [[0.0] * len(phases) for _ in range(frames)]
+        self.totals = [0.0] * frames
+        self.count = 0
+        self.current = [0.0] * len(phases)
+        self.last = self.frame_start = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.current[self.index[phase]] += now - self.last
+        self.last = now
+
+    def end_frame(self):
+        now = time.perf_counter()
+        slot = self.count % self.frames
+        row = self.samples[slot]
+        row[:] = self.current
+        self.totals[slot] = now - self.frame_start
+        self.current = [0.0] * len(self.phases)
+        self.count += 1
+        self.last = self.frame_start = now
+
+    def _rows(self):
+        n = min(self.count, self.frames)
+        return self.samples[:n], self.totals[:n]
+
+    def fps(self):
+        _, totals = self._rows()
+        total = sum(totals)
+        return len(totals) / total if total else 0.0
+
+    def frame_percentiles(self, ps=(50, 95, 99)):
+        """Frame time percentiles in seconds."""
+        totals = sorted(self._rows()[1])
+        return [percentile(totals, p) for p in ps]
+
+    def phase_means(self):
+        rows, _ = self._rows()
+        if not rows:
+            return {phase: 0.0 for phase in self.phases}
+        return {phase: sum(row[i] for row in rows) / len(rows) for i, phase in enumerate(self.phases)}
+
+    def slowest_phase(self):
+        """(phase, mean seconds per frame) of the phase taking longest,
+        not counting the wait for the next frame."""
+        means = self.phase_means()
+        means.pop('wait', None)
+        return max(means.items(), key=lambda item: item[1])
+
+    def histograms(self):
+        """{phase: [count per bucket]} over the buffer, plus 'frame'."""
+        rows, totals = self._rows()
+        columns = {phase: [row[i] for row in rows] for i, phase in enumerate(self.phases)}
+        columns['frame'] = totals
+        histograms = {}
+        for name, values in columns.items():
+            counts = [0] * (len(BUCKETS) + 1)
+            for value in values:
+                us = value * 1e6
+                bucket = 0
+                while bucket < len(BUCKETS) and us > BUCKETS[bucket]:
+                    bucket += 1
+                counts[bucket] += 1
+            histograms[name] = counts
+        return histograms
+
+    def summary(self):
+        rows, totals = self._rows()
+        report = {'frames': len(totals), 'fps': self.fps(), 'phases': {}}
+        for name, values in [(phase, [row[i] for row in rows]) for i, phase in enumerate(self.phases)] + [('frame', totals)]:
+            values = sorted(values)
+            report['phases'][name] = {
+                f'p{p}_us': percentile(values, p) * 1e6 for p in (50, 95, 99)
+            }
+            report['phases'][name]['max_us'] = values[-1] * 1e6 if values else 0.0
+        return report
+
+    def export(self, path):
+        """Write the histograms (and for JSON a percentile summary) to a
+        .csv or .json file."""
+        histograms = self.histograms()
+        edges = [0] + list(BUCKETS)
+        if path.endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['phase', 'low_us', 'high_us', 'frames'])
+                for name, counts in histograms.items():
+                    for low, high, count in zip(edges, list(BUCKETS) + [''], counts):
+                        writer.writerow([name, low, high, count])
+            return
+        report = self.summary()
+        report['buckets_us'] = list(BUCKETS)
+        report['histograms'] = histograms
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,127 @@
+"""Load generator for server.py: hundreds of simulated players.
+
+Each player has its own UDP socket, joins, plays restless random input at
+the tick rate and joins again when its match ends.  A player turned away
+with FULL waits and then retries from a new socket, so the server's
+SO_REUSEPORT hash can place it on another worker.  At the end it reports
+how many players got matches, the state updates received per player per
+second and round trip percentiles (the server echoes each player's last
+input timestamp).  Run the server alongside and read its tick times.
+
+    python loadgen.py --players 400 --seconds 30
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from engine import INPUT_FIRE, TICK_RATE
+from netplay import bot_input, now_ms
+from server import END, FULL, INPUT, INPUT_PACKET, JOIN, PORT, STATE, STATE_PACKET, WELCOME, percentile
+
+JOIN_RETRY = 0.5  # seconds between JOINs while waiting
+FULL_BACKOFF = 1.0  # seconds to wait after FULL before retrying from a new socket
+
+
+class Player(asyncio.DatagramProtocol):
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.transport = None
+        self.in_match = False
+        self.side = 0
+        self.held = 0
+        self.retry_at = 0.0
+        self.states = 0
+        self.rtts = []
+        self.matches = 0
+        self.rejected = 0
+        self.rebind = False  # open a new socket before the next JOIN
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        kind = data[0]
+        if kind == STATE and len(data) >= STATE_PACKET.size:
+            self.states += 1
+            fields = STATE_PACKET.unpack_from(data)
+            echo = fields[9 + self.side]
+            if echo:
+                self.rtts.append(((now_ms() - echo) & 0xffffffff) / 1000)
+        elif kind == WELCOME:
+            if not self.in_match:
+                self.matches += 1
+            self.in_match = True
+            self.side = data[5]
+        elif kind == END:
+            self.in_match = False
+            self.retry_at = 0.0
+        elif kind == FULL:
+            self.rejected += 1
+            self.rebind = True
+            self.retry_at = time.monotonic() + FULL_BACKOFF
+
+    def error_received(self, exc):
+        pass
+
+    def update(self, now):
+        if self.in_match:
+            bits = bot_input(self.rng, self.held)
+            self.held = bits & ~INPUT_FIRE
+            self.transport.sendto(INPUT_PACKET.pack(INPUT, bits, now_ms()))
+        elif now >= self.retry_at:
+            self.retry_at = now + JOIN_RETRY
+            self.transport.sendto(bytes([JOIN]))
+
+
+async def run(host, port, players, seconds, seed):
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)
+    clients = []
+    for _ in range(players):
+        _, player = await loop.create_datagram_endpoint(lambda: Player(random.Random(rng.random())),
+                                                        remote_addr=(host, port))
+        clients.append(player)
+    start = next_tick = loop.time()
+    while loop.time() - start < seconds:
+        now = time.monotonic()
+        for player in clients:
+            if player.rebind and now >= player.retry_at:
+                # The same socket would hash to the same full worker
+                player.rebind = False
+                player.transport.close()
+                await loop.create_datagram_endpoint(lambda player=player: player, remote_addr=(host, port))
+            player.update(now)
+        next_tick += 1 / TICK_RATE
+        await asyncio.sleep(max(0.0, next_tick - loop.time()))
+    elapsed = loop.time() - start
+    for player in clients:
+        player.transport.close()
+    return clients, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated players for server.py')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--players', type=int, default=200)
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    clients, elapsed = asyncio.run(run(args.host, args.port, args.players, args.seconds, args.seed))
+    playing = sum(player.in_match for player in clients)
+    rtts = [rtt for player in clients for rtt in player.rtts]
+    states = sum(player.states for player in clients)
+    print(f'{playing}/{len(clients)} players in a match at the end, '
+          f'{sum(player.matches for player in clients)} matches joined, '
+          f'{sum(player.rejected for player in clients)} joins refused')
+    print(f'{states / elapsed:,.0f} state updates/s, '
+          f'{states / elapsed / max(1, playing):.1f} per playing player')
+    print(f'round trip p50 {percentile(rtts, 50) * 1000:.1f} ms, p95 {percentile(rtts, 95) * 1000:.1f} ms, '
+          f'p99 {percentile(rtts, 99) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
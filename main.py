@@ -1,176 +1,325 @@
-import pygame
-import sys
-import random
 import time
+STARTUP_START = time.perf_counter()
+
+import argparse
+import atexit
+import json
+import math
 import os
-import numpy
-
-# Game constants
-SCREEN_WIDTH = 800
-SCREEN_HEIGHT = 600
-PADDLE_WIDTH = 10
-PADDLE_HEIGHT = 100
-BALL_SIZE = 20
-PADDLE_SPEED = 7
-BALL_SPEED_X = 6
-BALL_SPEED_Y = 6
-WINNING_SCORE = 10
+import random
+import sys
+import threading
+from collections import OrderedDict
+
+import pygame
+
+from engine import (
+    SCREEN_WIDTH, SCREEN_HEIGHT, PADDLE_WIDTH, PADDLE_HEIGHT, TALL_PADDLE_FACTOR, BALL_SIZE,
+    MISSILE_SIZE, STAR_SIZE, MISSILE_COLORS, STAR_COLORS,
+    AI_DIFFICULTY_MAP, TICK_RATE, EFFECTS, LEFT, INPUT_UP, INPUT_DOWN, INPUT_FIRE,
+    PADDLE_HIT, MISSILE_HIT, STAR_HIT, POINT, GAME_OVER, COUNTDOWN,
+    FLOW_TIMING, MatchFlow, PHASE_COUNTDOWN, PHASE_PLAYING, PHASE_POINT_SCORED, PHASE_GAME_OVER,
+)
+from eventlog import EventLog
+from frametime import FrameTimer
+from netplay import PORT, LatencyMeter, Peer, report as netplay_report
+from replay import Recorder, Recording, new_seed, verify
+from settings import SettingsStore
+from sounds import SoundBank
+
 SPLASH_TIME = 5  # seconds
+TICK_TIME = 1.0 / TICK_RATE
+MAX_TICKS_PER_FRAME = 5  # catch-up cap for slow frames
+MAX_FPS = 240  # render cap during a match, 0 = uncapped
+DIRTY_RECTS = True  # only push changed parts of the screen during a match
+FULL_FLIP_AREA = SCREEN_WIDTH * SCREEN_HEIGHT // 3  # above this, flip the whole screen
+MAX_DIRTY_RECTS = 200  # above this many, one background copy beats one per rect
+TEXT_CACHE_SIZE = 256  # rendered text surfaces kept around
+MENU_IDLE_TIMEOUT = 1000  # ms a menu sleeps when nothing happens
+LOADER_POLL = 50  # ms between checks on the splash screen's loader thread
+OVERLAY_KEY = pygame.K_F3  # shows or hides the frame timing overlay
+OVERLAY_REFRESH = 15  # frames between overlay text updates
+SPIN_MARGIN = 0.002  # seconds before a deadline where low latency pacing stops sleeping and spins
 
 # Colors
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 GRAY = (200, 200, 200)
+KEY_BITS = {pygame.K_SPACE: INPUT_FIRE, pygame.K_UP: INPUT_UP, pygame.K_w: INPUT_UP,
+            pygame.K_DOWN: INPUT_DOWN, pygame.K_s: INPUT_DOWN}
+# Indicator text per effect in engine.EFFECTS, one row each
+EFFECT_LABELS = {
+    'stun': ('STUNNED', (255, 0, 0)),
+    'tall_paddle': ('TALL PADDLE', (0, 0, 255)),
+    'fast_movement': ('FAST MOVEMENT', (0, 255, 0)),
+    'slow_movement': ('SLOW MOVEMENT', (160, 32, 240)),
+    'rapid_fire': ('RAPID FIRE', (255, 140, 0)),
+}
+
+# Match sprites, filled in by load_sprites()
+sprites = {}
 
-pygame.init()
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption('Pong')
+# Display, fonts and sounds are set up by init_display(), load_fonts() and
+# load_sounds(), not at import, so importing this module is cheap
+screen = None
 clock = pygame.time.Clock()
-font_large = pygame.font.SysFont(None, 100)
-font_medium = pygame.font.SysFont(None, 60)
-font_small = pygame.font.SysFont(None, 40)
+FONT_NAME = None  # None is pygame's default font and needs no font scan
+font_large = None
+font_medium = None
+font_small = None
 
-# Config file path
+# Resolved font paths and synthesized tones are kept here between runs
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), 'pong')
+
+# Settings file, and an old config.py it is migrated from the first time if
+# there is one (see settings.py); config.py is only ever read, never written
+SETTINGS_FILE = 'settings.json'
 CONFIG_FILE = 'config.py'
 
-# Default settings
-DEFAULT_SETTINGS = {
-    'WINNING_SCORE': 10,
-    'AI_DIFFICULTY': 'Normal',  # Options: 'Easy', 'Normal', 'Hard'
-}
+# Sounds are silent until load_sounds() has run
+sound_bank = SoundBank(cache_dir=CACHE_DIR)
 
-# AI difficulty mapping
-AI_DIFFICULTY_MAP = {
-    'Easy': 0.15,   # 15% miss
-    'Normal': 0.05, # 5% miss
-    'Hard': 0.01,   # 1% miss
-    'Extreme': 0.001, # 0.1% miss
-}
+# Frame timing: a FrameTimer while it is on (--frame-timing or the overlay)
+frame_timer = None
+overlay = None  # the overlay's rendered text while it is shown
+font_overlay = None
 
-# Sound
-pygame.mixer.init()
-try:
-    PADDLE_SOUND = pygame.mixer.Sound('paddle.wav')
-except Exception:
-    # Generate a simple beep sound if paddle.wav is not found
-    frequency = 440  # Hz
-    duration = 0.05  # seconds
-    sample_rate = 44100
-    t = numpy.linspace(0, duration, int(sample_rate * duration), False)
-    tone = numpy.sin(frequency * 2 * numpy.pi * t) * 0.5
-    audio = numpy.array(tone * 32767, dtype=numpy.int16)
-    PADDLE_SOUND = pygame.mixer.Sound(buffer=audio.tobytes())
-
-# Missed ball sound (different beep)
-def get_miss_sound():
-    frequency = 220  # Hz (lower pitch)
-    duration = 0.05  # seconds
-    sample_rate = 44100
-    t = numpy.linspace(0, duration, int(sample_rate * duration), False)
-    tone = numpy.sin(frequency * 2 * numpy.pi * t) * 0.5
-    audio = numpy.array(tone * 32767, dtype=numpy.int16)
-    return pygame.mixer.Sound(buffer=audio.tobytes())
-
-MISS_SOUND = get_miss_sound()
-
-# Missile hit sound
-def get_missile_sound():
-    frequency = 880  # Hz (higher pitch)
-    duration = 0.1  # seconds
-    sample_rate = 44100
-    t = numpy.linspace(0, duration, int(sample_rate * duration), False)
-    tone = numpy.sin(frequency * 2 * numpy.pi * t) * 0.5
-    audio = numpy.array(tone * 32767, dtype=numpy.int16)
-    return pygame.mixer.Sound(buffer=audio.tobytes())
-
-MISSILE_SOUND = get_missile_sound()
-
-# Celebration sound
-def get_celebration_sound():
-    frequency = 660  # Hz (medium pitch)
-    duration = 0.2  # seconds
-    sample_rate = 44100
-    t = numpy.linspace(0, duration, int(sample_rate * duration), False)
-    tone = numpy.sin(frequency * 2 * numpy.pi * t) * 0.5
-    audio = numpy.array(tone * 32767, dtype=numpy.int16)
-    return pygame.mixer.Sound(buffer=audio.tobytes())
-
-CELEBRATION_SOUND = get_celebration_sound()
-
-# Countdown sound
-def get_countdown_sound():
-    frequency = 330  # Hz (lower pitch)
-    duration = 0.1  # seconds
-    sample_rate = 44100
-    t = numpy.linspace(0, duration, int(sample_rate * duration), False)
-    tone = numpy.sin(frequency * 2 * numpy.pi * t) * 0.5
-    audio = numpy.array(tone * 32767, dtype=numpy.int16)
-    return pygame.mixer.Sound(buffer=audio.tobytes())
-
-COUNTDOWN_SOUND = get_countdown_sound()
+# --event-log: an EventLog taking every match's events
+event_log = None
 
-def draw_text(text, font, color, surface, x, y, center=True):
-    textobj = font.render(text, True, color)
-    textrect = textobj.get_rect()
+# --low-latency: pace frames to the ticks and sample input just before each
+low_latency = False
+vsync = False  # --vsync: ask the display for vsync
+
+# (phase, seconds since STARTUP_START) for --profile-startup
+startup_phases = []
+
+
+def mark_startup(phase):
+    startup_phases.append((phase, time.perf_counter() - STARTUP_START))
+
+
+def startup_report():
+    lines = ['Startup profile (ms):']
+    previous = 0.0
+    for phase, at in sorted(startup_phases, key=lambda item: item[1]):
+        lines.append(f'  {phase:<22} {(at - previous) * 1000:8.1f} {at * 1000:10.1f}')
+        previous = at
+    return '\n'.join(lines)
+
+
+def read_cache(name, binary=False):
+    try:
+        with open(os.path.join(CACHE_DIR, name), 'rb' if binary else 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def write_cache(name, data):
+    # A cache that cannot be written just means the work is redone next time
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = os.path.join(CACHE_DIR, name)
+        with open(path + '.tmp', 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        pass
+
+
+def init_display():
+    global screen
+    pygame.display.init()
+    pygame.font.init()
+    screen = None
+    if vsync:
+        # SDL only offers vsync on a renderer, which SCALED sets up
+        try:
+            screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), pygame.SCALED, vsync=1)
+        except pygame.error as error:
+            print(f'No vsync: {error}', file=sys.stderr)
+    if screen is None:
+        screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    pygame.display.set_caption('Pong')
+
+
+def resolve_font(name):
+    """Path of a system font, looked up once and then cached on disk."""
+    if name is None:
+        return None
+    cached = read_cache('fonts.json')
+    paths = json.loads(cached) if cached else {}
+    if name not in paths:
+        paths[name] = pygame.font.match_font(name)
+        write_cache('fonts.json', json.dumps(paths))
+    return paths[name]
+
+
+def load_fonts():
+    global font_large, font_medium, font_small
+    path = resolve_font(FONT_NAME)
+    font_large = pygame.font.Font(path, 100)
+    font_medium = pygame.font.Font(path, 60)
+    font_small = pygame.font.Font(path, 40)
+
+
+def load_sounds():
+    if sound_bank.load():
+        mark_startup('sounds')
+
+
+class TextCache:
+    """Bounded LRU cache of rendered text, keyed by text, font and color.
+
+    hits and misses count lookups; a steady frame should only add hits.
+    """
+
+    def __init__(self, maxsize=TEXT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text, font, color):
+        """Return (surface, rect at the origin) for the text."""
+        key = (text, font, color)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+        self.misses += 1
+        surface = font.render(text, True, color)
+        entry = (surface, surface.get_rect())
+        self.entries[key] = entry
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+text_cache = TextCache()
+
+
+def text_rect(text, font, x, y, center=True, color=WHITE):
+    textrect = text_cache.get(text, font, color)[1].copy()
     if center:
         textrect.center = (x, y)
     else:
         textrect.topleft = (x, y)
-    surface.blit(textobj, textrect)
+    return textrect
 
 
-def splash_screen():
+def draw_text(text, font, color, surface, x, y, center=True):
+    textobj = text_cache.get(text, font, color)[0]
+    return surface.blit(textobj, text_rect(text, font, x, y, center, color))
+
+
+def splash_screen(duration=SPLASH_TIME, loader=None):
+    """Show the splash for `duration` seconds, or until a key or click.
+
+    With a loader thread the splash also stays up until it has finished.
+    It is drawn once; after that the loop only sleeps on events.
+    """
     screen.fill(BLACK)
     draw_text('An Adam Production', font_large, WHITE, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)
     pygame.display.flip()
+    mark_startup('first frame')
     start_time = time.time()
-    while time.time() - start_time < SPLASH_TIME:
-        for event in pygame.event.get():
+    while True:
+        loading = loader is not None and loader.is_alive()
+        remaining = duration - (time.time() - start_time)
+        if remaining <= 0 and not loading:
+            return
+        timeout = remaining * 1000 if remaining > 0 else LOADER_POLL
+        if loading:
+            # The loader ends without an event, so check on it now and then
+            timeout = min(timeout, LOADER_POLL)
+        for event in wait_events(max(1, int(timeout))):
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
-        clock.tick(60)
+            if event.type == pygame.KEYDOWN or event.type == pygame.MOUSEBUTTONDOWN:
+                duration = 0
 
 
-def load_settings():
-    if os.path.exists(CONFIG_FILE):
-        try:
-            import importlib.util
-            spec = importlib.util.spec_from_file_location('config', CONFIG_FILE)
-            if spec is not None and spec.loader is not None:
-                config = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(config)
-                return {
-                    'WINNING_SCORE': getattr(config, 'WINNING_SCORE', DEFAULT_SETTINGS['WINNING_SCORE']),
-                    'AI_DIFFICULTY': getattr(config, 'AI_DIFFICULTY', DEFAULT_SETTINGS['AI_DIFFICULTY']),
-                }
-            else:
-                return DEFAULT_SETTINGS.copy()
-        except Exception:
-            return DEFAULT_SETTINGS.copy()
+def wait_events(timeout=MENU_IDLE_TIMEOUT):
+    """Sleep until there are events, `timeout` ms pass or a queued sound is
+    due, play the sounds that are due and return the events.
+
+    Menus wait here instead of redrawing at 60 fps, so an idle menu costs
+    next to no CPU.
+    """
+    due = sound_bank.next_due()
+    if due is not None:
+        timeout = min(timeout, due)
+    if timeout <= 0:
+        events = pygame.event.get()
     else:
-        return DEFAULT_SETTINGS.copy()
+        first = pygame.event.wait(timeout)
+        events = [] if first.type == pygame.NOEVENT else [first] + pygame.event.get()
+    sound_bank.update()
+    return events
+
+
+class MenuRows:
+    """Centred menu rows, each repainted only when its text or color changes."""
+
+    def __init__(self, font, x, y, spacing):
+        self.font = font
+        self.x = x
+        self.y = y
+        self.spacing = spacing
+        self.shown = {}  # row: (text, color, rect)
+
+    def hit(self, rows, pos):
+        """Index of the row under pos, for rows given as (text, color)."""
+        for i, (text, color) in enumerate(rows):
+            if text_rect(text, self.font, self.x, self.y + i * self.spacing, color=color).collidepoint(pos):
+                return i
+        return None
 
-def save_settings(settings):
-    with open(CONFIG_FILE, 'w') as f:
-        f.write(f"WINNING_SCORE = {settings['WINNING_SCORE']}\n")
-        f.write(f"AI_DIFFICULTY = '{settings['AI_DIFFICULTY']}'\n")
+    def draw(self, rows):
+        """Repaint the rows that changed and return the areas to update."""
+        dirty = []
+        for i, (text, color) in enumerate(rows):
+            shown = self.shown.get(i)
+            if shown and shown[:2] == (text, color):
+                continue
+            area = text_rect(text, self.font, self.x, self.y + i * self.spacing, color=color)
+            if shown:
+                area = area.union(shown[2])
+            screen.fill(BLACK, area)
+            rect = draw_text(text, self.font, color, screen, self.x, self.y + i * self.spacing)
+            self.shown[i] = (text, color, rect)
+            dirty.append(area)
+        return dirty
 
-settings = load_settings()
+
+# Defaults until main() loads the file, so importing this module writes nothing
+settings = SettingsStore(SETTINGS_FILE, legacy=CONFIG_FILE)
 
 
 def title_screen():
     options = ['Start', 'Settings', 'Exit']
     selected = 0
-    waiting = True
-    while waiting:
-        screen.fill(BLACK)
-        draw_text('Pong', font_large, WHITE, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 100)
-        for i, option in enumerate(options):
-            color = WHITE if i == selected else GRAY
-            draw_text(option, font_small, color, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 20 + i * 50)
-        pygame.display.flip()
-        for event in pygame.event.get():
+    menu = MenuRows(font_small, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 20, 50)
+
+    def rows():
+        return [(option, WHITE if i == selected else GRAY) for i, option in enumerate(options)]
+
+    screen.fill(BLACK)
+    draw_text('Pong', font_large, WHITE, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 100)
+    menu.draw(rows())
+    pygame.display.flip()
+    while True:
+        chosen = None
+        for event in wait_events():
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
@@ -180,53 +329,48 @@ def title_screen():
                 if event.key == pygame.K_DOWN or event.key == pygame.K_s:
                     selected = (selected + 1) % len(options)
                 if event.key == pygame.K_SPACE or event.key == pygame.K_RETURN:
-                    if options[selected] == 'Start':
-                        return 'start'
-                    elif options[selected] == 'Settings':
-                        return 'settings'
-                    elif options[selected] == 'Exit':
-                        pygame.quit()
-                        sys.exit()
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                mouse_pos = pygame.mouse.get_pos()
-                for i, option in enumerate(options):
-                    text_surface = font_small.render(option, True, WHITE)
-                    text_rect = text_surface.get_rect()
-                    text_rect.center = (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 20 + i * 50)
-                    if text_rect.collidepoint(mouse_pos):
-                        if options[i] == 'Start':
-                            return 'start'
-                        elif options[i] == 'Settings':
-                            return 'settings'
-                        elif options[i] == 'Exit':
-                            pygame.quit()
-                            sys.exit()
-        clock.tick(60)
+                    chosen = selected
+            elif event.type == pygame.MOUSEMOTION:
+                hovered = menu.hit(rows(), event.pos)
+                if hovered is not None:
+                    selected = hovered
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                chosen = menu.hit(rows(), event.pos)
+            if chosen is not None:
+                break
+        if chosen is not None:
+            if options[chosen] == 'Start':
+                return 'start'
+            elif options[chosen] == 'Settings':
+                return 'settings'
+            elif options[chosen] == 'Exit':
+                pygame.quit()
+                sys.exit()
+        dirty = menu.draw(rows())
+        if dirty:
+            pygame.display.update(dirty)
 
 
 def settings_screen():
-    global settings
     options = ['Points to Win', 'AI Difficulty', 'Back']
     selected = 0
     ai_difficulties = list(AI_DIFFICULTY_MAP.keys())
     ai_selected = ai_difficulties.index(settings['AI_DIFFICULTY']) if settings['AI_DIFFICULTY'] in ai_difficulties else 1
     points = settings['WINNING_SCORE']
-    editing = False
+    menu = MenuRows(font_small, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 10, 50)
+
+    def rows():
+        texts = [f"{options[0]}: {points}", f"{options[1]}: {ai_difficulties[ai_selected]}", options[2]]
+        return [(text, WHITE if i == selected else GRAY) for i, text in enumerate(texts)]
+
+    screen.fill(BLACK)
+    draw_text('Settings', font_large, WHITE, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 120)
+    draw_text('Use arrows to change, Enter to select', font_small, GRAY, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT - 40)
+    menu.draw(rows())
+    pygame.display.flip()
     while True:
-        screen.fill(BLACK)
-        draw_text('Settings', font_large, WHITE, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 120)
-        for i, option in enumerate(options):
-            color = WHITE if i == selected else GRAY
-            if option == 'Points to Win':
-                text = f"{option}: {points}"
-            elif option == 'AI Difficulty':
-                text = f"{option}: {ai_difficulties[ai_selected]}"
-            else:
-                text = option
-            draw_text(text, font_small, color, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 10 + i * 50)
-        draw_text('Use arrows to change, Enter to select', font_small, GRAY, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT - 40)
-        pygame.display.flip()
-        for event in pygame.event.get():
+        back = False
+        for event in wait_events():
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
@@ -244,420 +388,710 @@ def settings_screen():
                 if selected == 1 and event.key == pygame.K_RIGHT:
                     ai_selected = (ai_selected + 1) % len(ai_difficulties)
                 if event.key == pygame.K_RETURN or event.key == pygame.K_SPACE:
-                    if options[selected] == 'Back':
-                        # Save settings
-                        settings['WINNING_SCORE'] = points
-                        settings['AI_DIFFICULTY'] = ai_difficulties[ai_selected]
-                        save_settings(settings)
-                        return
-            if event.type == pygame.MOUSEBUTTONDOWN:
-                mouse_pos = pygame.mouse.get_pos()
-                for i, option in enumerate(options):
-                    if option == 'Points to Win':
-                        text = f"{option}: {points}"
-                    elif option == 'AI Difficulty':
-                        text = f"{option}: {ai_difficulties[ai_selected]}"
-                    else:
-                        text = option
-                    text_surface = font_small.render(text, True, WHITE)
-                    text_rect = text_surface.get_rect()
-                    text_rect.center = (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 10 + i * 50)
-                    if text_rect.collidepoint(mouse_pos):
-                        if options[i] == 'Back':
-                            # Save settings
-                            settings['WINNING_SCORE'] = points
-                            settings['AI_DIFFICULTY'] = ai_difficulties[ai_selected]
-                            save_settings(settings)
-                            return
-        clock.tick(60)
+                    back = options[selected] == 'Back'
+            elif event.type == pygame.MOUSEMOTION:
+                hovered = menu.hit(rows(), event.pos)
+                if hovered is not None:
+                    selected = hovered
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                clicked = menu.hit(rows(), event.pos)
+                back = clicked is not None and options[clicked] == 'Back'
+            if back:
+                # Save settings
+                settings['WINNING_SCORE'] = points
+                settings['AI_DIFFICULTY'] = ai_difficulties[ai_selected]
+                settings.save()
+                return
+        dirty = menu.draw(rows())
+        if dirty:
+            pygame.display.update(dirty)
 
 
 def end_screen(winner):
-    waiting = True
-    while waiting:
-        screen.fill(BLACK)
-        draw_text(f'{winner} Wins!', font_large, WHITE, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 40)
-        draw_text('Press SPACE to continue', font_small, GRAY, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 60)
-        pygame.display.flip()
-        for event in pygame.event.get():
+    screen.fill(BLACK)
+    # No winner: a replay whose recording was quit before the match ended
+    draw_text(f'{winner} Wins!' if winner else 'Replay ended', font_large, WHITE, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 40)
+    draw_text('Press SPACE to continue', font_small, GRAY, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 60)
+    pygame.display.flip()
+    while True:
+        for event in wait_events():
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_SPACE:
-                    waiting = False
-        clock.tick(60)
-
-
-def reset_ball(ball_rect, direction):
-    ball_rect.x = SCREEN_WIDTH // 2 - BALL_SIZE // 2
-    ball_rect.y = SCREEN_HEIGHT // 2 - BALL_SIZE // 2
-    ball_speed_x = BALL_SPEED_X * direction
-    ball_speed_y = BALL_SPEED_Y * random.choice([-1, 1])
-    return ball_speed_x, ball_speed_y
-
-
-def countdown():
-    for i in range(3, 0, -1):
-        screen.fill(BLACK)
-        draw_text(str(i), font_large, WHITE, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)
-        pygame.display.flip()
-        if COUNTDOWN_SOUND:
-            COUNTDOWN_SOUND.play()
-        pygame.time.wait(1000)
-    screen.fill(BLACK)
-    draw_text('GO!', font_large, WHITE, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)
-    pygame.display.flip()
-    if COUNTDOWN_SOUND:
-        COUNTDOWN_SOUND.play()
-    pygame.time.wait(500)  # 0.5 seconds for "GO!"
-
-def ball_countdown():
-    for i in range(3, 0, -1):
-        screen.fill(BLACK)
-        draw_text(str(i), font_large, WHITE, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)
-        pygame.display.flip()
-        if COUNTDOWN_SOUND:
-            COUNTDOWN_SOUND.play()
-        pygame.time.wait(1000)
+                    return
+
+
+def draw_countdown(count):
     screen.fill(BLACK)
-    draw_text('GO!', font_large, WHITE, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)
-    pygame.display.flip()
-    if COUNTDOWN_SOUND:
-        COUNTDOWN_SOUND.play()
-    pygame.time.wait(1500)  # 1.5 seconds total (0.5 + 1.0)
-
-
-def main_game():
-    # Paddles
-    player_rect = pygame.Rect(30, SCREEN_HEIGHT // 2 - PADDLE_HEIGHT // 2, PADDLE_WIDTH, PADDLE_HEIGHT)
-    ai_rect = pygame.Rect(SCREEN_WIDTH - 40, SCREEN_HEIGHT // 2 - PADDLE_HEIGHT // 2, PADDLE_WIDTH, PADDLE_HEIGHT)
-    # Ball
-    ball_rect = pygame.Rect(SCREEN_WIDTH // 2 - BALL_SIZE // 2, SCREEN_HEIGHT // 2 - BALL_SIZE // 2, BALL_SIZE, BALL_SIZE)
-    ball_speed_x = BALL_SPEED_X * random.choice([-1, 1])
-    ball_speed_y = BALL_SPEED_Y * random.choice([-1, 1])
-    # Scores
-    player_score = 0
-    ai_score = 0
-    # AI miss chance
-    ai_miss = False
-    ai_miss_timer = 0
-    ai_miss_chance = AI_DIFFICULTY_MAP.get(settings['AI_DIFFICULTY'], 0.05)
-    # Ball speed multiplier
-    speed_multiplier = 1.0
-    # Missiles
-    missiles = []
-    missile_speed = 8
-    # Missile cooldowns
-    player_missile_cooldown = 0
-    ai_missile_cooldown = 0
-    missile_cooldown_frames = 90  # 1.5 seconds at 60fps
+    draw_text(str(count) if count > 0 else 'GO!', font_large, WHITE, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)
+
+
+def positions(game):
+    if game.multiball:
+        return game.ball_x.copy(), game.ball_y.copy(), game.left.rect.y, game.right.rect.y
+    return game.ball_rect.x, game.ball_rect.y, game.left.rect.y, game.right.rect.y
+
+
+def lerp(start, end, alpha):
+    return int(start + (end - start) * alpha)
+
+
+def star_points(center_x, center_y, radius_outer=10, radius_inner=5):
+    points = []
+    for i in range(10):
+        angle = math.radians(i * 36)
+        radius = radius_outer if i % 2 == 0 else radius_inner
+        points.append((int(center_x + radius * math.cos(angle)), int(center_y + radius * math.sin(angle))))
+    return points
+
+
+def load_sprites():
+    """Render every match sprite once, in the display's pixel format."""
+    if sprites:
+        return sprites
+
+    def solid(size, color):
+        surface = pygame.Surface(size)
+        surface.fill(color)
+        return surface.convert()
+
+    def shape(size, draw):
+        # Black is transparent, like the background it is drawn on
+        surface = pygame.Surface(size)
+        surface.fill(BLACK)
+        draw(surface)
+        surface.set_colorkey(BLACK, pygame.RLEACCEL)
+        return surface.convert()
+
+    sprites['paddle'] = solid((PADDLE_WIDTH, PADDLE_HEIGHT), WHITE)
+    paddle_sprite(int(PADDLE_HEIGHT * TALL_PADDLE_FACTOR))
+    sprites['ball'] = shape((BALL_SIZE, BALL_SIZE), lambda s: pygame.draw.ellipse(s, WHITE, s.get_rect()))
+    for side, color in MISSILE_COLORS.items():
+        sprites['missile', side] = solid((MISSILE_SIZE, MISSILE_SIZE), color)
+    # Stars are drawn around (10, 10) so they blit at star_rect.center - 10
+    for star_type, color in STAR_COLORS.items():
+        points = star_points(STAR_SIZE // 2, STAR_SIZE // 2)
+        sprites['star', star_type] = shape((STAR_SIZE + 1, STAR_SIZE + 1),
+                                           lambda s, color=color: pygame.draw.polygon(s, color, points))
+    return sprites
+
+
+def ball_blits(prev, current, alpha):
+    """Blits for every ball of a multi-ball game, interpolated as arrays.
+    Balls that were served again this tick are not slid back from where
+    they scored."""
+    (prev_x, prev_y), (x, y) = prev, current
+    drawn_x = prev_x + (x - prev_x) * alpha
+    drawn_y = prev_y + (y - prev_y) * alpha
+    served = abs(x - prev_x) > SCREEN_WIDTH // 4
+    drawn_x[served] = x[served]
+    drawn_y[served] = y[served]
+    ball = sprites['ball']
+    return [(ball, position) for position in zip(drawn_x.astype(int).tolist(), drawn_y.astype(int).tolist())]
+
+
+def paddle_sprite(height):
+    """A paddle sprite of some other height, made the first time it is needed."""
+    key = 'paddle', height
+    if key not in sprites:
+        surface = pygame.Surface((PADDLE_WIDTH, height))
+        surface.fill(WHITE)
+        sprites[key] = surface.convert()
+    return sprites[key]
+
+
+def text_blit(text, font, color, x, y):
+    """(surface, rect) for a centred string, ready for Surface.blits()."""
+    return text_cache.get(text, font, color)[0], text_rect(text, font, x, y, color=color)
+
+
+def draw_game(game, prev=None, alpha=1.0):
+    """Draw everything that moves or changes over the playfield background.
+
+    prev is positions() before the last tick and alpha how far the clock has
+    moved towards the next tick, so motion stays smooth between ticks.
+    Everything is a pre-rendered sprite or cached text, drawn with a single
+    Surface.blits() call.  Returns the rects that were drawn.
+    """
+    current = positions(game)
+    if prev is None:
+        prev = current
+    player_y, ai_y = (lerp(p, c, alpha) for p, c in zip(prev[2:], current[2:]))
+    load_sprites()
+    blits = []
+
+    # Paddles with power-up effects
+    for side, y in ((game.left, player_y), (game.right, ai_y)):
+        height = int(PADDLE_HEIGHT * side.height_factor)
+        paddle = sprites['paddle'] if height == PADDLE_HEIGHT else paddle_sprite(height)
+        blits.append((paddle, (side.rect.x, y + PADDLE_HEIGHT // 2 - paddle.get_height() // 2)))
+    if game.multiball:
+        blits += ball_blits(prev[:2], current[:2], alpha)
+    else:
+        blits.append((sprites['ball'], (lerp(prev[0], current[0], alpha), lerp(prev[1], current[1], alpha))))
+    blits.append(text_blit(str(game.left.score), font_medium, WHITE, SCREEN_WIDTH // 4, 40))
+    blits.append(text_blit(str(game.right.score), font_medium, WHITE, SCREEN_WIDTH * 3 // 4, 40))
+
+    # Missiles: red for the player, blue for the AI
+    for x, y, side in game.missiles:
+        blits.append((sprites['missile', side], (x, y)))
+
     # Star power-ups
-    star_rect = None
-    star_type = None  # 'yellow', 'blue', 'green'
-    star_spawn_timer = 0
-    star_spawn_interval = 600  # 10 seconds at 60fps
-    # Power-up timers
-    player_tall_paddle_timer = 0
-    player_fast_movement_timer = 0
-    ai_tall_paddle_timer = 0
-    ai_fast_movement_timer = 0
-    power_up_duration = 300  # 5 seconds at 60fps
-    # Stun timers
-    player_stunned = False
-    ai_stunned = False
-    player_stun_timer = 0
-    ai_stun_timer = 0
-    stun_duration = 30  # frames (0.5 seconds at 60fps)
-
-    # Countdown before starting
-    countdown()
-
-    running = True
-    while running:
-        for event in pygame.event.get():
+    for rect, star_type in game.stars:
+        blits.append((sprites['star', star_type], (rect.centerx - STAR_SIZE // 2, rect.centery - STAR_SIZE // 2)))
+
+    # Stun and power-up indicators
+    for side, x in ((game.left, SCREEN_WIDTH // 4), (game.right, SCREEN_WIDTH * 3 // 4)):
+        for row, (effect, ends) in enumerate(zip(EFFECTS, side.effects)):
+            if ends:
+                text, color = EFFECT_LABELS[effect.name]
+                if len(ends) > 1:
+                    text = f'{text} x{len(ends)}'
+                blits.append(text_blit(text, font_small, color, x, 80 + 40 * row))
+    return screen.blits(blits)
+
+
+class MatchRenderer:
+    """Draws the match, pushing only the parts of the screen that changed.
+
+    The background and centre line are rendered once.  Each frame the
+    background is copied back over last frame's entities, the entities are
+    drawn at their new places and only those rects are sent to the display.
+    When they cover a large part of the screen a full flip is cheaper, and
+    with hundreds of them (multi-ball) so is one copy of the background.
+    """
+
+    def __init__(self, dirty_rects=DIRTY_RECTS):
+        self.dirty_rects = dirty_rects
+        self.background = None
+        self.previous = []
+        self.full_redraw = True
+        self.timer = None  # marks 'draw' and 'flip' when set
+
+    def invalidate(self):
+        """Something else drew on the screen: repaint all of it next frame."""
+        self.full_redraw = True
+
+    def draw(self, game, prev=None, alpha=1.0, extra=()):
+        """Draw a frame; `extra` is (surface, position) pairs drawn on top."""
+        timer = self.timer
+        if self.background is None:
+            self.background = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()
+            self.background.fill(BLACK)
+            pygame.draw.aaline(self.background, WHITE, (SCREEN_WIDTH // 2, 0), (SCREEN_WIDTH // 2, SCREEN_HEIGHT))
+        if self.full_redraw or not self.dirty_rects or len(self.previous) > MAX_DIRTY_RECTS:
+            screen.blit(self.background, (0, 0))
+            self.previous = draw_game(game, prev, alpha) + screen.blits(extra)
+            self.full_redraw = False
+            if timer:
+                timer.mark('draw')
+            pygame.display.flip()
+            if timer:
+                timer.mark('flip')
+            return
+        for rect in self.previous:
+            screen.blit(self.background, rect, rect)
+        drawn = draw_game(game, prev, alpha) + screen.blits(extra)
+        dirty = self.previous + drawn
+        self.previous = drawn
+        if timer:
+            timer.mark('draw')
+        if sum(rect.w * rect.h for rect in dirty) > FULL_FLIP_AREA:
+            pygame.display.flip()
+        else:
+            pygame.display.update(dirty)
+        if timer:
+            timer.mark('flip')
+
+
+def draw_field(game):
+    screen.fill(BLACK)
+    pygame.draw.rect(screen, WHITE, game.left.rect)
+    pygame.draw.rect(screen, WHITE, game.right.rect)
+    pygame.draw.aaline(screen, WHITE, (SCREEN_WIDTH // 2, 0), (SCREEN_WIDTH // 2, SCREEN_HEIGHT))
+    draw_text(str(game.left.score), font_medium, WHITE, screen, SCREEN_WIDTH // 4, 40)
+    draw_text(str(game.right.score), font_medium, WHITE, screen, SCREEN_WIDTH * 3 // 4, 40)
+
+
+def toggle_overlay():
+    global frame_timer, overlay
+    if overlay is None:
+        if frame_timer is None:
+            frame_timer = FrameTimer()
+        overlay = []
+    else:
+        overlay = None
+
+
+def render_overlay(timer):
+    """The overlay's text lines as (surface, position) pairs."""
+    global font_overlay
+    if font_overlay is None:
+        font_overlay = pygame.font.Font(resolve_font(FONT_NAME), 20)
+    p50, p95, p99 = (t * 1000 for t in timer.frame_percentiles())
+    phase, mean = timer.slowest_phase()
+    lines = [f'{timer.fps():.0f} FPS  frame p50 {p50:.2f}  p95 {p95:.2f}  p99 {p99:.2f} ms',
+             f'slowest phase: {phase} {mean * 1000:.2f} ms',
+             # Misses only go up when a score or label changes
+             f'text cache: {text_cache.hits} hits, {text_cache.misses} misses']
+    # Opaque so the dirty-rect renderer can simply paint it over
+    return [(font_overlay.render(line, True, WHITE, BLACK), (10, SCREEN_HEIGHT - 72 + i * 22))
+            for i, line in enumerate(lines)]
+
+
+def export_frame_timing(path):
+    if frame_timer is not None and frame_timer.count:
+        frame_timer.export(path)
+
+
+def close_event_log():
+    event_log.close()
+    stats = event_log.stats()
+    print(f"Event log: {stats['written']} events written, {stats['dropped']} dropped")
+
+
+def held_input():
+    """Bits of the movement keys held down right now."""
+    keys = pygame.key.get_pressed()
+    bits = 0
+    if keys[pygame.K_UP] or keys[pygame.K_w]:
+        bits |= INPUT_UP
+    if keys[pygame.K_DOWN] or keys[pygame.K_s]:
+        bits |= INPUT_DOWN
+    return bits
+
+
+def pressed_input(events):
+    """Bits of the keys pressed down in `events`.  A tap that is over
+    before the next tick still counts for that tick."""
+    bits = 0
+    for event in events:
+        if event.type == pygame.KEYDOWN:
+            bits |= KEY_BITS.get(event.key, 0)
+    return bits
+
+
+def read_player_input(events):
+    return held_input() | pressed_input(events)
+
+
+def wait_until(deadline):
+    """Sleep until just short of `deadline` (perf_counter seconds), then
+    spin: sleep alone can wake a millisecond or more late."""
+    remaining = deadline - time.perf_counter()
+    if remaining > SPIN_MARGIN:
+        time.sleep(remaining - SPIN_MARGIN)
+    while time.perf_counter() < deadline:
+        pass
+
+
+def latency_report(meter, samples, elapsed):
+    report = meter.report()
+    return (f"Input to flip p50 {report['p50_ms']:.1f} ms, p95 {report['p95_ms']:.1f} ms "
+            f"over {report['samples']} inputs, input sampled every {elapsed / max(1, samples) * 1000:.1f} ms")
+
+
+def play_event(event):
+    """Play the sound for an engine event."""
+    kind = event[0]
+    if kind == PADDLE_HIT:
+        sound_bank.play('paddle')
+    elif kind == MISSILE_HIT or kind == STAR_HIT:
+        sound_bank.play('missile')
+    elif kind == POINT:
+        sound_bank.play_sequence('miss')
+    elif kind == COUNTDOWN:
+        sound_bank.play('countdown')
+    elif kind == GAME_OVER:
+        # After the miss beeps
+        sound_bank.schedule('celebration', sound_bank.sequence_length('miss') + 60)
+
+
+def main_game(seed=None, record_path=None, replay=None, speed=1.0, balls=None):
+    """Play a match and return 'Player' or 'AI'.
+
+    Every match runs on its own RNG seeded with `seed` (random if None), so
+    with the player's inputs saved to `record_path` it can be replayed.
+    With a Recording as `replay` the left paddle is driven by its inputs
+    instead of the keyboard, `speed` times faster than real time.  More
+    than one ball (`balls`, or the BALLS setting) plays multi-ball, which
+    is never recorded; it is played to the same WINNING_SCORE.
+    """
+    balls = settings['BALLS'] if balls is None else balls
+    # The player is the left side, the AI the right one
+    if replay is None:
+        recording = Recording(new_seed() if seed is None else seed, settings['WINNING_SCORE'],
+                              None, settings['AI_DIFFICULTY'])
+        recorder = Recorder(recording) if record_path and balls == 1 else None
+        inputs = None
+    else:
+        recording = replay
+        recorder = None
+        inputs = iter(replay)
+        balls = 1
+    if balls > 1:
+        # NumPy is only imported for multi-ball, not on every start
+        from multiball import MULTIBALL_TIMING, MultiBallState
+        game = MultiBallState(recording.winning_score, recording.right_difficulty or 'Normal',
+                              rng=random.Random(recording.seed), balls=balls)
+        timing = MULTIBALL_TIMING
+    else:
+        game = recording.new_game()
+        timing = FLOW_TIMING
+    if event_log:
+        event_log.new_match()
+    # Countdowns and pauses between points are phases of the flow, so
+    # events keep being handled and the window keeps drawing through them
+    flow = MatchFlow(game, timing)
+
+    # The simulation runs at a fixed TICK_RATE whatever the frame rate is:
+    # each frame adds the elapsed time to the accumulator and runs as many
+    # ticks as fit, then draws the state interpolated between the last two.
+    # In low latency mode a frame instead waits for the next tick to be
+    # due, samples input, runs that tick and shows its result at once.
+    paced = low_latency and inputs is None
+    accumulator = 0.0
+    last_time = started = time.perf_counter()
+    prev = positions(game)
+    pressed = 0
+    applied = 0
+    samples = 0
+    meter = LatencyMeter() if inputs is None else None
+    renderer = MatchRenderer()
+    shown = None
+    max_ticks = MAX_TICKS_PER_FRAME * max(1, math.ceil(speed))
+
+    def finish(result):
+        if meter and (low_latency or frame_timer):
+            print(latency_report(meter, samples, time.perf_counter() - started))
+        return result
+
+    while True:
+        events = pygame.event.get()
+        for event in events:
             if event.type == pygame.QUIT:
+                if recorder:
+                    # A match quit half way is still worth a bug report
+                    recorder.finish(game, record_path)
                 pygame.quit()
                 sys.exit()
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_SPACE and not player_stunned and player_missile_cooldown <= 0:
-                    # Fire player missile
-                    missile_rect = pygame.Rect(player_rect.right, player_rect.centery - 5, 10, 10)
-                    missiles.append({'rect': missile_rect, 'type': 'player'})
-                    player_missile_cooldown = missile_cooldown_frames
-
-        # Update missile cooldowns
-        if player_missile_cooldown > 0:
-            player_missile_cooldown -= 1
-        if ai_missile_cooldown > 0:
-            ai_missile_cooldown -= 1
-
-        # Update power-up timers
-        if player_tall_paddle_timer > 0:
-            player_tall_paddle_timer -= 1
-        if player_fast_movement_timer > 0:
-            player_fast_movement_timer -= 1
-        if ai_tall_paddle_timer > 0:
-            ai_tall_paddle_timer -= 1
-        if ai_fast_movement_timer > 0:
-            ai_fast_movement_timer -= 1
-
-        # Star power-up spawning
-        if star_rect is None:
-            star_spawn_timer += 1
-            if star_spawn_timer >= star_spawn_interval:
-                star_rect = pygame.Rect(SCREEN_WIDTH // 2 - 10, random.randint(50, SCREEN_HEIGHT - 50), 20, 20)
-                star_type = random.choice(['yellow', 'blue', 'green'])
-                star_spawn_timer = 0
-
-        # AI missile firing
-        if ai_missile_cooldown <= 0 and not ai_stunned and random.random() < 0.01:  # 1% chance per frame
-            missile_rect = pygame.Rect(ai_rect.left - 10, ai_rect.centery - 5, 10, 10)
-            missiles.append({'rect': missile_rect, 'type': 'ai'})
-            ai_missile_cooldown = missile_cooldown_frames
-
-        # Player movement (only if not stunned)
-        if not player_stunned:
-            keys = pygame.key.get_pressed()
-            movement_speed = PADDLE_SPEED * 1.25 if player_fast_movement_timer > 0 else PADDLE_SPEED
-            if (keys[pygame.K_UP] or keys[pygame.K_w]) and player_rect.top > 0:
-                player_rect.y -= int(movement_speed)
-            if (keys[pygame.K_DOWN] or keys[pygame.K_s]) and player_rect.bottom < SCREEN_HEIGHT:
-                player_rect.y += int(movement_speed)
-
-        # AI movement (only if not stunned)
-        if not ai_stunned:
-            ai_movement_speed = PADDLE_SPEED * 1.25 if ai_fast_movement_timer > 0 else PADDLE_SPEED
-            if ball_speed_x > 0 and random.random() < ai_miss_chance and not ai_miss and abs(ball_rect.centery - ai_rect.centery) < 100:
-                ai_miss = True
-                ai_miss_timer = random.randint(20, 40)  # frames to miss
-            if ai_miss:
-                ai_miss_timer -= 1
-                if ai_miss_timer <= 0:
-                    ai_miss = False
-            if not ai_miss:
-                if ai_rect.centery < ball_rect.centery and ai_rect.bottom < SCREEN_HEIGHT:
-                    ai_rect.y += int(ai_movement_speed)
-                elif ai_rect.centery > ball_rect.centery and ai_rect.top > 0:
-                    ai_rect.y -= int(ai_movement_speed)
+            if event.type == pygame.KEYDOWN and event.key == OVERLAY_KEY:
+                toggle_overlay()
+
+        bits = held_input()
+        read_at = time.perf_counter()
+        samples += 1
+        if flow.phase == PHASE_PLAYING:
+            # A press between ticks is kept for the next one
+            pressed |= pressed_input(events)
+        if inputs is None and recorder is None:
+            # Tuning edits in settings.json apply from the next tick, except
+            # in a recorded match, which has to keep the settings it started with
+            settings.reload_if_changed()
+        timer = frame_timer
+        game.timer = renderer.timer = timer
+        if timer:
+            timer.mark('events')
+
+        now = time.perf_counter()
+        accumulator += (now - last_time) * speed
+        last_time = now
+        ticks = 0
+        while accumulator >= TICK_TIME:
+            if ticks == max_ticks:
+                # Too far behind: drop the backlog rather than spiral
+                accumulator = 0.0
+                break
+            prev = positions(game)
+            if flow.phase == PHASE_PLAYING:
+                if inputs is not None:
+                    pressed = 0
+                    bits = next(inputs, None)
+                    if bits is None:
+                        # The recording was quit before the match ended
+                        return replay_result(recording, game)
+                else:
+                    if recorder:
+                        recorder.record(bits | pressed)
+                    if bits | pressed != applied:
+                        meter.sampled(flow.tick + 1, read_at)
+                        applied = bits | pressed
+            played = set()
+            for event in flow.step(bits | pressed, None):
+                # One sound per kind of event a tick, however many balls hit
+                if event[0] not in played:
+                    played.add(event[0])
+                    play_event(event)
+                if event_log:
+                    event_log.emit(game.tick, event)
+            if flow.phase == PHASE_GAME_OVER:
+                if recorder:
+                    recorder.finish(game, record_path)
+                elif inputs is not None:
+                    return replay_result(recording, game)
+                return finish('Player' if game.winner == LEFT else 'AI')
+            pressed = 0
+            accumulator -= TICK_TIME
+            ticks += 1
+        if timer:
+            timer.mark('sim')
+
+        if flow.phase == PHASE_PLAYING:
+            extra = ()
+            if overlay is not None and timer:
+                if not overlay or timer.count % OVERLAY_REFRESH == 0:
+                    overlay[:] = render_overlay(timer)
+                    timer.mark('overlay')
+                extra = overlay
+            # Paced frames show the tick they just ran, not a blend with
+            # the one before it
+            renderer.draw(game, prev, 1.0 if paced else accumulator / TICK_TIME, extra)
+            if meter:
+                meter.displayed(flow.tick, time.perf_counter())
+            shown = None
         else:
-            pass
-
-        # Update stun timers
-        if player_stunned:
-            player_stun_timer -= 1
-            if player_stun_timer <= 0:
-                player_stunned = False
-        if ai_stunned:
-            ai_stun_timer -= 1
-            if ai_stun_timer <= 0:
-                ai_stunned = False
-
-        # Update missiles
-        for missile in missiles[:]:
-            if missile['type'] == 'player':
-                missile['rect'].x += missile_speed
-                if missile['rect'].x > SCREEN_WIDTH:
-                    missiles.remove(missile)
-                elif missile['rect'].colliderect(ai_rect) and not ai_stunned:
-                    missiles.remove(missile)
-                    ai_stunned = True
-                    ai_stun_timer = stun_duration
-                    if MISSILE_SOUND:
-                        MISSILE_SOUND.play()
-                elif star_rect and missile['rect'].colliderect(star_rect):
-                    missiles.remove(missile)
-                    # Apply power-up effect
-                    if star_type == 'yellow':
-                        ai_stunned = True
-                        ai_stun_timer = stun_duration
-                    elif star_type == 'blue':
-                        player_tall_paddle_timer = power_up_duration
-                    elif star_type == 'green':
-                        player_fast_movement_timer = power_up_duration
-                    if MISSILE_SOUND:
-                        MISSILE_SOUND.play()
-                    star_rect = None
-                    star_type = None
-            else:  # AI missile
-                missile['rect'].x -= missile_speed
-                if missile['rect'].x < 0:
-                    missiles.remove(missile)
-                elif missile['rect'].colliderect(player_rect) and not player_stunned:
-                    missiles.remove(missile)
-                    player_stunned = True
-                    player_stun_timer = stun_duration
-                    if MISSILE_SOUND:
-                        MISSILE_SOUND.play()
-                elif star_rect and missile['rect'].colliderect(star_rect):
-                    missiles.remove(missile)
-                    # Apply power-up effect
-                    if star_type == 'yellow':
-                        player_stunned = True
-                        player_stun_timer = stun_duration
-                    elif star_type == 'blue':
-                        ai_tall_paddle_timer = power_up_duration
-                    elif star_type == 'green':
-                        ai_fast_movement_timer = power_up_duration
-                    if MISSILE_SOUND:
-                        MISSILE_SOUND.play()
-                    star_rect = None
-                    star_type = None
-
-        # Ball movement
-        ball_rect.x += int(ball_speed_x * speed_multiplier)
-        ball_rect.y += int(ball_speed_y * speed_multiplier)
-
-        # Collisions with top/bottom
-        if ball_rect.top <= 0 or ball_rect.bottom >= SCREEN_HEIGHT:
-            ball_speed_y *= -1
-
-        # Collisions with paddles
-        hit_paddle = False
-        if ball_rect.colliderect(player_rect):
-            if ball_speed_x < 0:
-                ball_speed_x *= -1
-                ball_speed_y += random.randint(-2, 2)
-                hit_paddle = True
-        if ball_rect.colliderect(ai_rect):
-            if ball_speed_x > 0:
-                ball_speed_x *= -1
-                ball_speed_y += random.randint(-2, 2)
-                hit_paddle = True
-        if hit_paddle:
-            speed_multiplier *= 1.05  # Increase speed by 5%
-            if PADDLE_SOUND:
-                PADDLE_SOUND.play()
-
-        # Score update
-        if ball_rect.left <= 0:
-            ai_score += 1
-            ball_speed_x, ball_speed_y = reset_ball(ball_rect, direction=1)
-            ai_miss = False
-            speed_multiplier = 1.0
-            for _ in range(3):
-                if MISS_SOUND:
-                    MISS_SOUND.play()
-                pygame.time.wait(60)
-            # Check for winner before countdown
-            if ai_score >= settings['WINNING_SCORE']:
-                if CELEBRATION_SOUND:
-                    CELEBRATION_SOUND.play()
-                return 'AI'
-            ball_countdown()
-            # Show playing field and wait 1 second
-            screen.fill(BLACK)
-            pygame.draw.rect(screen, WHITE, player_rect)
-            pygame.draw.rect(screen, WHITE, ai_rect)
-            pygame.draw.aaline(screen, WHITE, (SCREEN_WIDTH // 2, 0), (SCREEN_WIDTH // 2, SCREEN_HEIGHT))
-            draw_text(str(player_score), font_medium, WHITE, screen, SCREEN_WIDTH // 4, 40)
-            draw_text(str(ai_score), font_medium, WHITE, screen, SCREEN_WIDTH * 3 // 4, 40)
-            pygame.display.flip()
-            pygame.time.wait(1000)
-        if ball_rect.right >= SCREEN_WIDTH:
-            player_score += 1
-            ball_speed_x, ball_speed_y = reset_ball(ball_rect, direction=-1)
-            ai_miss = False
-            speed_multiplier = 1.0
-            for _ in range(3):
-                if MISS_SOUND:
-                    MISS_SOUND.play()
-                pygame.time.wait(60)
-            # Check for winner before countdown
-            if player_score >= settings['WINNING_SCORE']:
-                if CELEBRATION_SOUND:
-                    CELEBRATION_SOUND.play()
-                return 'Player'
-            ball_countdown()
-            # Show playing field and wait 1 second
-            screen.fill(BLACK)
-            pygame.draw.rect(screen, WHITE, player_rect)
-            pygame.draw.aaline(screen, WHITE, (SCREEN_WIDTH // 2, 0), (SCREEN_WIDTH // 2, SCREEN_HEIGHT))
-            draw_text(str(player_score), font_medium, WHITE, screen, SCREEN_WIDTH // 4, 40)
-            draw_text(str(ai_score), font_medium, WHITE, screen, SCREEN_WIDTH * 3 // 4, 40)
-            pygame.display.flip()
-            pygame.time.wait(1000)
-
-        # Draw everything
-        screen.fill(BLACK)
-        
-        # Draw paddles with power-up effects
-        player_paddle_height = PADDLE_HEIGHT * 1.5 if player_tall_paddle_timer > 0 else PADDLE_HEIGHT
-        ai_paddle_height = PADDLE_HEIGHT * 1.5 if ai_tall_paddle_timer > 0 else PADDLE_HEIGHT
-        
-        player_paddle_rect = pygame.Rect(player_rect.x, player_rect.centery - player_paddle_height // 2, 
-                                       PADDLE_WIDTH, player_paddle_height)
-        ai_paddle_rect = pygame.Rect(ai_rect.x, ai_rect.centery - ai_paddle_height // 2, 
-                                    PADDLE_WIDTH, ai_paddle_height)
-        
-        pygame.draw.rect(screen, WHITE, player_paddle_rect)
-        pygame.draw.rect(screen, WHITE, ai_paddle_rect)
-        pygame.draw.ellipse(screen, WHITE, ball_rect)
-        pygame.draw.aaline(screen, WHITE, (SCREEN_WIDTH // 2, 0), (SCREEN_WIDTH // 2, SCREEN_HEIGHT))
-        draw_text(str(player_score), font_medium, WHITE, screen, SCREEN_WIDTH // 4, 40)
-        draw_text(str(ai_score), font_medium, WHITE, screen, SCREEN_WIDTH * 3 // 4, 40)
-        
-        # Draw missiles
-        for missile in missiles:
-            if missile['type'] == 'player':
-                pygame.draw.rect(screen, (255, 0, 0), missile['rect'])  # Red for player
-            else:
-                pygame.draw.rect(screen, (0, 0, 255), missile['rect'])  # Blue for AI
-        
-        # Draw star power-up
-        if star_rect:
-            # Draw a proper star shape
-            points = []
-            center_x, center_y = star_rect.centerx, star_rect.centery
-            radius_outer = 10
-            radius_inner = 5
-            for i in range(10):
-                angle = i * 36 * numpy.pi / 180
-                if i % 2 == 0:
-                    x = center_x + radius_outer * numpy.cos(angle)
-                    y = center_y + radius_outer * numpy.sin(angle)
+            # Between points the ball was reset: no interpolation
+            prev = positions(game)
+            screen_state = (flow.phase, flow.count, game.left.score, game.right.score)
+            if flow.phase == PHASE_POINT_SCORED:
+                renderer.draw(game)
+            elif screen_state != shown:
+                # Countdown and serving screens only change when a phase does
+                if flow.phase == PHASE_COUNTDOWN:
+                    draw_countdown(flow.count)
                 else:
-                    x = center_x + radius_inner * numpy.cos(angle)
-                    y = center_y + radius_inner * numpy.sin(angle)
-                points.append((int(x), int(y)))
-            
-            if star_type == 'yellow':
-                color = (255, 255, 0)  # Yellow
-            elif star_type == 'blue':
-                color = (0, 0, 255)    # Blue
-            else:  # green
-                color = (0, 255, 0)    # Green
-            pygame.draw.polygon(screen, color, points)
-        
-        # Draw stun indicators
-        if player_stunned:
-            draw_text('STUNNED', font_small, (255, 0, 0), screen, SCREEN_WIDTH // 4, 80)
-        if ai_stunned:
-            draw_text('STUNNED', font_small, (255, 0, 0), screen, SCREEN_WIDTH * 3 // 4, 80)
-        
-        # Draw power-up indicators
-        if player_tall_paddle_timer > 0:
-            draw_text('TALL PADDLE', font_small, (0, 0, 255), screen, SCREEN_WIDTH // 4, 120)
-        if player_fast_movement_timer > 0:
-            draw_text('FAST MOVEMENT', font_small, (0, 255, 0), screen, SCREEN_WIDTH // 4, 160)
-        if ai_tall_paddle_timer > 0:
-            draw_text('TALL PADDLE', font_small, (0, 0, 255), screen, SCREEN_WIDTH * 3 // 4, 120)
-        if ai_fast_movement_timer > 0:
-            draw_text('FAST MOVEMENT', font_small, (0, 255, 0), screen, SCREEN_WIDTH * 3 // 4, 160)
-        
-        pygame.display.flip()
-        clock.tick(60)
-
-        # Check for winner (removed from here since it's now checked before countdown)
+                    draw_field(game)
+                pygame.display.flip()
+                renderer.invalidate()
+            shown = screen_state
+            if timer:
+                timer.mark('draw')
+        sound_bank.update()
+        if timer:
+            timer.mark('sound')
+        if not paced:
+            clock.tick(MAX_FPS)
+        elif not vsync:
+            # Until the next tick is due; with vsync the flip paces frames
+            wait_until(last_time + TICK_TIME - accumulator)
+        if timer:
+            timer.mark('wait')
+            timer.end_frame()
+
+
+def netplay_game(peer):
+    """Play a match against another player over the network.
+
+    Like main_game(), but the ticks run on peer.session, which predicts the
+    other player and rolls back when their real input differs.  Returns
+    'Player' or 'Opponent'.
+    """
+    session = peer.session
+    game = session.game
+    flow = session.flow
+    meter = LatencyMeter()
+    accumulator = 0.0
+    last_time = time.perf_counter()
+    prev = positions(game)
+    pending_fire = 0
+    renderer = MatchRenderer()
+    shown = None
+    try:
+        while not session.over():
+            events = pygame.event.get()
+            for event in events:
+                if event.type == pygame.QUIT:
+                    pygame.quit()
+                    sys.exit()
+            bits = read_player_input(events)
+            read_at = time.perf_counter()
+            if flow.phase == PHASE_PLAYING:
+                pending_fire |= bits & INPUT_FIRE
+            bits &= ~INPUT_FIRE
+            peer.poll()
+
+            now = time.perf_counter()
+            accumulator += now - last_time
+            last_time = now
+            ticks = 0
+            while accumulator >= TICK_TIME and flow.phase != PHASE_GAME_OVER:
+                if ticks == MAX_TICKS_PER_FRAME:
+                    accumulator = 0.0
+                    break
+                if not session.can_advance():
+                    # Too far ahead of the other player's input: let them catch up
+                    session.stalls += 1
+                    accumulator = min(accumulator, TICK_TIME)
+                    break
+                prev = positions(game)
+                if bits | pending_fire != session.local_changes[-1][1]:
+                    meter.sampled(session.tick, read_at)
+                for event in session.advance(bits | pending_fire):
+                    play_event(event)
+                peer.send()
+                pending_fire = 0
+                accumulator -= TICK_TIME
+                ticks += 1
+            if not ticks:
+                # Keep acknowledging their input while we wait
+                peer.send()
+
+            if flow.phase == PHASE_PLAYING:
+                renderer.draw(game, prev, accumulator / TICK_TIME)
+                shown = None
+            else:
+                prev = positions(game)
+                screen_state = (flow.phase, flow.count, game.left.score, game.right.score)
+                if screen_state != shown:
+                    if flow.phase == PHASE_COUNTDOWN:
+                        draw_countdown(flow.count)
+                    else:
+                        draw_field(game)
+                    pygame.display.flip()
+                    renderer.invalidate()
+                shown = screen_state
+            meter.displayed(session.tick - 1, time.perf_counter())
+            sound_bank.update()
+            clock.tick(MAX_FPS)
+        # A few more packets so the other side also confirms the end
+        for _ in range(10):
+            peer.poll()
+            peer.send()
+            clock.tick(TICK_RATE)
+    finally:
+        print(netplay_report(peer, meter))
+        peer.close()
+    return 'Player' if game.winner == session.local_side else 'Opponent'
+
+
+def replay_result(recording, game):
+    if verify(recording, game):
+        print(f'Replay of seed {recording.seed} matches the recording')
+    else:
+        print(f'Replay of seed {recording.seed} does not match the recording')
+    if game.winner is None:
+        return None
+    return 'Player' if game.winner == LEFT else 'AI'
+
+
+def record_path(path, match):
+    """Where to record the `match`th match of the session: `path` for the
+    first, then with -2, -3... before the extension, so none overwrites
+    another."""
+    if not path or match == 1:
+        return path
+    stem, ext = os.path.splitext(path)
+    return f'{stem}-{match}{ext}'
+
+
+def connect_peer(args):
+    """Host or join a netplay match, showing a waiting screen and handling
+    events until the other player is there.  Returns the Peer, or None if
+    ESC was pressed or nobody answered."""
+    link = {'latency': args.latency / 1000, 'jitter': args.jitter / 1000, 'loss': args.loss}
+    if args.host is not None:
+        detail = f'Hosting on port {args.host}'
+    else:
+        detail = f'Connecting to {args.connect}'
+    screen.fill(BLACK)
+    draw_text('Waiting for opponent...', font_medium, WHITE, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 - 30)
+    draw_text(detail, font_small, GRAY, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 20)
+    draw_text('ESC to cancel', font_small, GRAY, screen, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2 + 60)
+    pygame.display.flip()
+
+    def waiting():
+        # Called between socket polls, so the window stays responsive
+        for event in wait_events(0):
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                return False
+        return True
+
+    try:
+        if args.host is not None:
+            return Peer.host(args.host, settings['WINNING_SCORE'], waiting=waiting, **link)
+        host, _, port = args.connect.partition(':')
+        return Peer.connect((host, int(port or PORT)), waiting=waiting, **link)
+    except TimeoutError as error:
+        print(f'netplay: {error}', file=sys.stderr)
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Pong')
+    parser.add_argument('--splash', type=float, default=SPLASH_TIME, help='splash screen seconds')
+    parser.add_argument('--no-splash', action='store_const', const=0, dest='splash', help='skip the splash screen')
+    parser.add_argument('--profile-startup', action='store_true', help='print time to first frame by phase')
+    parser.add_argument('--seed', type=int, help='seed for the first match (random by default)')
+    parser.add_argument('--record', metavar='PATH', help="save the first match's seed and inputs here, later matches to PATH-2, PATH-3...")
+    parser.add_argument('--replay', metavar='PATH', help='watch a recorded match instead of playing')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed multiplier')
+    parser.add_argument('--balls', type=int, help='balls in play (multi-ball above 1; default: the BALLS setting)')
+    parser.add_argument('--host', type=int, nargs='?', const=PORT, metavar='PORT',
+                        help='wait for another player to connect and play them')
+    parser.add_argument('--connect', metavar='HOST[:PORT]', help="play against a player hosting with --host")
+    parser.add_argument('--latency', type=float, default=0, help='netplay: add this many ms to each packet')
+    parser.add_argument('--jitter', type=float, default=0, help='netplay: +- this many ms on the latency')
+    parser.add_argument('--loss', type=float, default=0, help='netplay: fraction of packets to drop')
+    parser.add_argument('--low-latency', action='store_true',
+                        help='sample input just before each tick and show it at once; prints input to flip latency')
+    parser.add_argument('--vsync', action='store_true', help='ask the display for vsync')
+    parser.add_argument('--event-log', metavar='PATH',
+                        help='log match events to this JSON lines file, or compact binary if it ends in .bin')
+    parser.add_argument('--frame-timing', metavar='PATH',
+                        help='time each frame by phase and write histograms to this .csv or .json on exit')
+    return parser.parse_args(argv)
 
 
 def main():
+    global frame_timer, event_log, low_latency, vsync
+    args = parse_args()
+    settings.load()
+    low_latency = args.low_latency
+    vsync = args.vsync
+    if args.frame_timing:
+        frame_timer = FrameTimer()
+        atexit.register(export_frame_timing, args.frame_timing)
+    if args.event_log:
+        event_log = EventLog(args.event_log)
+        atexit.register(close_event_log)
+    mark_startup('imports')
+    init_display()
+    mark_startup('display')
+    load_fonts()
+    mark_startup('fonts')
+    # Audio is set up while the splash is showing
+    loader = threading.Thread(target=load_sounds, daemon=True)
+    loader.start()
     while True:
-        splash_screen()
+        splash_screen(args.splash, loader)
+        loader.join()
+        mark_startup('title screen')
+        if args.profile_startup:
+            print(startup_report())
+        if args.replay:
+            end_screen(main_game(replay=Recording.load(args.replay), speed=args.speed))
+            args.replay = None
+            # The replay ran with its recorded engine settings
+            settings.apply()
+        if args.host is not None or args.connect:
+            peer = connect_peer(args)
+            if peer:
+                end_screen(netplay_game(peer))
+                # and netplay with the host's
+                settings.apply()
+            args.host = args.connect = None
+        matches = 0
         while True:
             action = title_screen()
             if action == 'start':
-                winner = main_game()
+                matches += 1
+                winner = main_game(args.seed, record_path(args.record, matches), balls=args.balls)
+                args.seed = None  # later matches get fresh seeds
                 end_screen(winner)
             elif action == 'settings':
                 settings_screen()
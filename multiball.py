@@ -0,0 +1,215 @@
+"""Multi-ball mode: one match, many balls, the ball physics in NumPy arrays.
+
+MultiBallState is a GameState whose single ball is replaced by arrays of
+positions, speeds and speed multipliers, one entry per ball.  Paddles,
+missiles, stars and effects are the engine's own; every tick the balls are
+moved, bounced off the walls and paddles (with the 5% speed-up per paddle
+hit) and scored with a few array operations, however many there are.  A
+ball that scores is served again from the centre line at once, towards the
+side that scored, so the field never empties.  The AI paddles follow the
+most threatening ball: the one that will reach them first.
+
+Balls do not collide with each other.  Recordings and netplay only hold
+single-ball matches.
+
+    python multiball.py --balls 2000 --ticks 1200     # stress test, headless
+"""
+import argparse
+import random
+import time
+
+import numpy
+
+from batch import intercept_y, sweep_boxes
+import engine
+from engine import (
+    SCREEN_WIDTH, SCREEN_HEIGHT, BALL_SIZE, WINNING_SCORE, FLOW_TIMING, MAX_BOUNCES,
+    PADDLE_HIT, SPEED_UP, POINT, GAME_OVER, LEFT, RIGHT, GameState,
+)
+
+BALLS = 100  # default ball count
+# No pauses once play has started: points come too often to stop for them
+MULTIBALL_TIMING = dict(FLOW_TIMING, point_scored=0, countdown_after_point=0, go_after_point=0, serving=0)
+BALL_START_X = SCREEN_WIDTH // 2 - BALL_SIZE // 2
+
+
+class MultiBallState(GameState):
+    """A match with `balls` balls.  Each ball that scores is a point."""
+    multiball = True
+
+    def __init__(self, winning_score=WINNING_SCORE, right_difficulty='Normal', left_difficulty='Normal', rng=None,
+                 balls=BALLS):
+        super().__init__(winning_score, right_difficulty, left_difficulty, rng)
+        # The arrays draw from their own generator, seeded from the match's
+        self.np_rng = numpy.random.default_rng(self.rng.getrandbits(64))
+        self.balls = balls
+        self.ball_x = numpy.empty(balls, dtype=numpy.int32)
+        self.ball_y = numpy.empty(balls, dtype=numpy.int32)
+        self.ball_speed_x = numpy.empty(balls, dtype=numpy.int32)
+        self.ball_speed_y = numpy.empty(balls, dtype=numpy.int32)
+        self.speed_multiplier = numpy.empty(balls)
+        # The ball each side's AI is following, -1 for none
+        self.threat = [-1, -1]
+        self.serve(numpy.arange(balls), self.np_rng.choice([-1, 1], balls))
+
+    def serve(self, indices, direction):
+        """Put balls back on the centre line at random heights, heading
+        along `direction` (-1 or 1, one per ball or for all of them)."""
+        count = len(indices)
+        self.ball_x[indices] = BALL_START_X
+        self.ball_y[indices] = self.np_rng.integers(0, SCREEN_HEIGHT - BALL_SIZE, count)
+        self.ball_speed_x[indices] = engine.BALL_SPEED_X * direction
+        self.ball_speed_y[indices] = engine.BALL_SPEED_Y * self.np_rng.choice([-1, 1], count)
+        self.speed_multiplier[indices] = 1.0
+        self.plan_dirty = True
+
+    def snapshot(self):
+        """GameState.snapshot() plus copies of the ball arrays, the balls
+        the AIs follow and the state of the arrays' generator."""
+        return (super().snapshot(), self.ball_x.copy(), self.ball_y.copy(), self.ball_speed_x.copy(),
+                self.ball_speed_y.copy(), self.speed_multiplier.copy(), tuple(self.threat),
+                self.np_rng.bit_generator.state)
+
+    def restore(self, state):
+        game, ball_x, ball_y, speed_x, speed_y, multiplier, threat, rng = state
+        super().restore(game)
+        # The base state holds the live speed arrays; copy the saved values back in
+        self.ball_speed_x = numpy.array(speed_x)
+        self.ball_speed_y = numpy.array(speed_y)
+        self.speed_multiplier = numpy.array(multiplier)
+        self.ball_x[:] = ball_x
+        self.ball_y[:] = ball_y
+        self.threat = list(threat)
+        self.np_rng.bit_generator.state = rng
+
+    def plan(self, side):
+        """Like GameState.plan(), for the ball that will reach the paddle
+        first.  The miss is decided whenever the AI switches balls."""
+        s = self.sides[side]
+        dx = numpy.trunc(self.ball_speed_x * self.speed_multiplier)
+        face_x = s.rect.left - BALL_SIZE if side == RIGHT else s.rect.right
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            ticks = (face_x - self.ball_x) / dx
+        # Balls heading away, or already past the paddle, are no threat
+        ticks[~((dx > 0 if side == RIGHT else dx < 0) & (ticks >= 0))] = numpy.inf
+        ball = int(numpy.argmin(ticks))
+        if ticks[ball] == numpy.inf:
+            self.threat[side] = -1
+            s.ai_approaching = False
+            s.ai_target_y = SCREEN_HEIGHT // 2
+            return
+        if ball != self.threat[side]:
+            self.threat[side] = ball
+            s.ai_approaching = True
+            s.ai_miss = self.rng.random() < s.ai_miss_chance
+        dy = numpy.trunc(self.ball_speed_y[ball] * self.speed_multiplier[ball])
+        self.aim(s, float(intercept_y(self.ball_x[ball], self.ball_y[ball], dx[ball], dy, face_x)) + BALL_SIZE // 2)
+
+    def _update_ball(self, events):
+        hit_side = self._move_balls()
+        hit = numpy.nonzero(hit_side >= 0)[0]
+        if len(hit):
+            multiplier = self.speed_multiplier
+            multiplier[hit] *= 1.05  # Increase speed by 5%
+            for ball, side in zip(hit.tolist(), hit_side[hit].tolist()):
+                events.append((PADDLE_HIT, side))
+                events.append((SPEED_UP, side, float(multiplier[ball])))
+
+        # Score update, every ball that got through at once
+        x = self.ball_x
+        for side, scored in ((RIGHT, x <= 0), (LEFT, x + BALL_SIZE >= SCREEN_WIDTH)):
+            balls = numpy.nonzero(scored)[0]
+            if not len(balls):
+                continue
+            scorer = self.sides[side]
+            points = min(len(balls), self.winning_score - scorer.score)
+            scorer.score += points
+            events.extend([(POINT, side)] * points)
+            # The next serves head towards the side that scored
+            self.serve(balls, 1 if side == RIGHT else -1)
+            if scorer.score >= self.winning_score:
+                self.winner = side
+                events.append((GAME_OVER, side))
+                break
+
+    def _move_balls(self):
+        """GameState._move_ball() for every ball at once, after
+        batch.BatchSim._move_ball().  Returns the side whose paddle each
+        ball last hit this tick, or -1."""
+        x = self.ball_x.astype(numpy.float64)
+        y = self.ball_y.astype(numpy.float64)
+        remaining = numpy.ones(self.balls)
+        hit_side = numpy.full(self.balls, -1, dtype=numpy.int8)
+        left, right = self.left.rect, self.right.rect
+        inf = numpy.inf
+        # Only the first pass covers every ball; later ones just the balls
+        # that bounced and still have motion left
+        balls = slice(None)
+        for _ in range(MAX_BOUNCES):
+            bx = x[balls]
+            by = y[balls]
+            speed_x = self.ball_speed_x[balls]
+            speed_y = self.ball_speed_y[balls]
+            multiplier = self.speed_multiplier[balls]
+            left_remaining = remaining[balls]
+            dx = numpy.trunc(speed_x * multiplier) * left_remaining
+            dy = numpy.trunc(speed_y * multiplier) * left_remaining
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                t_wall = numpy.where(
+                    (dy < 0) & (by + dy <= 0), numpy.maximum(0.0, -by / dy),
+                    numpy.where((dy > 0) & (by + BALL_SIZE + dy >= SCREEN_HEIGHT),
+                                numpy.maximum(0.0, (SCREEN_HEIGHT - BALL_SIZE - by) / dy), inf))
+            towards_right = dx > 0
+            t_paddle = sweep_boxes(bx, by, dx, dy, BALL_SIZE,
+                                   numpy.where(towards_right, right.x, left.x),
+                                   numpy.where(towards_right, right.y, left.y),
+                                   left.width, numpy.where(towards_right, right.height, left.height))
+            wall = (t_wall <= t_paddle) & (t_wall <= 1)
+            paddle = ~wall & (t_paddle <= 1)
+            impact = wall | paddle
+            when = numpy.where(impact, numpy.minimum(t_wall, t_paddle), 1.0)
+            x[balls] = bx + dx * when
+            y[balls] = by + dy * when
+            speed_y = numpy.where(wall, -speed_y, speed_y)
+            if paddle.any():
+                speed_x = numpy.where(paddle, -speed_x, speed_x)
+                speed_y += paddle * self.np_rng.integers(-2, 3, len(paddle), dtype=numpy.int32)
+                hit_side[balls] = numpy.where(paddle, towards_right, hit_side[balls])
+            if impact.any():
+                self.plan_dirty = True
+            self.ball_speed_x[balls] = speed_x
+            self.ball_speed_y[balls] = speed_y
+            left_remaining = numpy.where(impact, left_remaining * (1.0 - when), 0.0)
+            remaining[balls] = left_remaining
+            again = impact & (left_remaining > 0)
+            balls = numpy.nonzero(again)[0] if isinstance(balls, slice) else balls[again]
+            if not len(balls):
+                break
+        self.ball_x[:] = numpy.round(x)
+        self.ball_y[:] = numpy.round(y)
+        return hit_side
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run an AI-vs-AI multi-ball match headless and time its ticks')
+    parser.add_argument('--balls', type=int, default=1000)
+    parser.add_argument('--ticks', type=int, default=1200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    game = MultiBallState(10 ** 9, rng=random.Random(args.seed), balls=args.balls)
+    times = []
+    points = 0
+    for _ in range(args.ticks):
+        start = time.perf_counter()
+        events = game.step()
+        times.append(time.perf_counter() - start)
+        points += sum(event[0] == POINT for event in events)
+    times.sort()
+    print(f'{args.balls} balls, {args.ticks} ticks: mean {sum(times) / len(times) * 1000:.3f} ms, '
+          f'p95 {times[len(times) * 95 // 100] * 1000:.3f} ms, max {times[-1] * 1000:.3f} ms per tick '
+          f'({points} points, score {game.left.score}-{game.right.score})')
+
+
+if __name__ == '__main__':
+    main()
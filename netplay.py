@@ -0,0 +1,416 @@
+"""Two-player play over UDP with prediction and rollback.
+
+Both machines run the same MatchFlow at the fixed TICK_RATE from a shared
+seed and the host's engine settings, so the only thing they have to exchange is input.  Each side sends
+the ticks at which its input bits changed that the other side has not yet
+acknowledged, so a lost packet is covered by the next one.
+
+The remote player's input for ticks that have not arrived yet is predicted
+(the last known bits, without fire).  Before every tick the match state is
+snapshotted; when the real input turns out to differ from the prediction,
+the match is restored to that tick and resimulated up to the present.  The
+local side never runs more than MAX_ROLLBACK ticks ahead of the remote
+input it has, which bounds the work of one rollback.
+
+LossyLink injects latency, jitter and loss for testing on localhost:
+
+    python netplay.py --test --latency 60 --jitter 15 --loss 0.05
+    python main.py --host 7777 --latency 40
+    python main.py --connect 127.0.0.1:7777
+"""
+import argparse
+import heapq
+import random
+import socket
+import struct
+import time
+
+from engine import FLOW_TIMING, GameState, MatchFlow, INPUT_UP, INPUT_DOWN, INPUT_FIRE, LEFT, RIGHT, \
+    PHASE_GAME_OVER, TICK_RATE, WINNING_SCORE
+from settings import TUNABLES, apply_engine_values, engine_values
+
+PORT = 7777
+MAX_ROLLBACK = 8  # ticks of unconfirmed remote input we will predict
+HISTORY = MAX_ROLLBACK + 2  # snapshots kept
+MAX_CHANGES = 64  # input changes per packet
+HELLO_INTERVAL = 0.2  # seconds between connection attempts
+WAIT_POLL = 0.02  # seconds a waiting host or client blocks on its socket before calling back
+
+# Packet types
+HELLO, WELCOME, INPUT = 1, 2, 3
+WELCOME_PACKET = struct.Struct('<BQH')  # type, seed, winning score, then settings.TUNABLES
+# type, last tick with input, last remote tick received, sent ms, echoed ms, changes
+INPUT_PACKET = struct.Struct('<BiiIIB')
+CHANGE = struct.Struct('<iB')  # tick, bits
+
+
+def now_ms():
+    return int(time.perf_counter() * 1000) & 0xffffffff
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class RollbackSession:
+    """The match as seen from one side, with prediction and rollback."""
+
+    def __init__(self, local_side, seed, winning_score=WINNING_SCORE, timing=FLOW_TIMING,
+                 max_rollback=MAX_ROLLBACK):
+        self.local_side = local_side
+        self.game = GameState(winning_score, rng=random.Random(seed))
+        self.flow = MatchFlow(self.game, timing)
+        self.max_rollback = max_rollback
+        self.tick = 0  # the next tick to simulate
+        self.local = []  # local bits per tick
+        self.local_changes = [(-1, 0)]  # (tick, bits) whenever they changed
+        self.remote = []  # confirmed remote bits per tick
+        self.used = []  # remote bits each simulated tick actually ran with
+        self.snapshots = {}  # tick: flow snapshot taken before it
+        self.peer_ack = -1  # the remote side has our input up to here
+        # Stats
+        self.rollbacks = 0
+        self.resimulated = 0
+        self.rollback_times = []
+        self.stalls = 0
+
+    @property
+    def confirmed(self):
+        """Ticks up to which both inputs are known."""
+        return min(len(self.remote), self.tick)
+
+    def can_advance(self):
+        return self.tick - len(self.remote) < self.max_rollback
+
+    def advance(self, bits):
+        """Run the next tick with the local bits and return its events."""
+        if bits != self.local_changes[-1][1]:
+            self.local_changes.append((self.tick, bits))
+        self.local.append(bits)
+        return self._simulate()
+
+    def _simulate(self):
+        tick = self.tick
+        if tick < len(self.remote):
+            remote = self.remote[tick]
+        else:
+            # Prediction: keep moving the way they were, but fire is a press
+            remote = self.remote[-1] & ~INPUT_FIRE if self.remote else 0
+        self.snapshots[tick] = self.flow.snapshot()
+        self.snapshots.pop(tick - HISTORY, None)
+        self.used.append(remote)
+        local = self.local[tick]
+        events = self.flow.step(*((local, remote) if self.local_side == LEFT else (remote, local)))
+        self.tick = tick + 1
+        return events
+
+    def receive(self, latest, changes):
+        """Take the remote input up to tick `latest`, given as the ticks at
+        which it changed.  Rolls back if a prediction was wrong."""
+        remote = self.remote
+        start = len(remote)
+        if latest < start:
+            return
+        bits = remote[-1] if remote else 0
+        changes = sorted(change for change in changes if change[0] >= start)
+        i = 0
+        for tick in range(start, latest + 1):
+            while i < len(changes) and changes[i][0] <= tick:
+                bits = changes[i][1]
+                i += 1
+            remote.append(bits)
+        for tick in range(start, min(len(remote), self.tick)):
+            if self.used[tick] != remote[tick]:
+                self.rollback(tick)
+                break
+
+    def rollback(self, tick):
+        started = time.perf_counter()
+        target = self.tick
+        self.flow.restore(self.snapshots[tick])
+        self.tick = tick
+        del self.used[tick:]
+        while self.tick < target:
+            # Events of resimulated ticks were already played (or predicted)
+            self._simulate()
+        self.rollbacks += 1
+        self.resimulated += target - tick
+        self.rollback_times.append(time.perf_counter() - started)
+
+    def outgoing(self):
+        """(last tick covered, local input changes the remote side has not
+        acknowledged).  Too many changes for one packet cover fewer ticks."""
+        changes = [change for change in self.local_changes if change[0] > self.peer_ack]
+        if len(changes) > MAX_CHANGES:
+            return changes[MAX_CHANGES][0] - 1, changes[:MAX_CHANGES]
+        return self.tick - 1, changes
+
+    def over(self):
+        """Game over on confirmed input, so no rollback can undo it."""
+        return self.flow.phase == PHASE_GAME_OVER and self.confirmed >= self.tick
+
+
+class LossyLink:
+    """Sends datagrams after an injected latency +- jitter, losing a
+    fraction of them.  pump() sends whatever is due."""
+
+    def __init__(self, sock, latency=0.0, jitter=0.0, loss=0.0, seed=None):
+        self.sock = sock
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.queue = []
+        self.sent = 0
+
+    def sendto(self, data, address):
+        if self.loss and self.rng.random() < self.loss:
+            return
+        if not self.latency and not self.jitter:
+            self.sock.sendto(data, address)
+            return
+        delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+        self.sent += 1
+        heapq.heappush(self.queue, (time.perf_counter() + delay, self.sent, data, address))
+        self.pump()
+
+    def pump(self):
+        now = time.perf_counter()
+        while self.queue and self.queue[0][0] <= now:
+            _, _, data, address = heapq.heappop(self.queue)
+            self.sock.sendto(data, address)
+
+
+class Peer:
+    """A RollbackSession connected to the other player over UDP."""
+
+    def __init__(self, sock, address, session, link=None):
+        self.sock = sock
+        self.address = address
+        self.session = session
+        self.link = link or LossyLink(sock)
+        self.echo = 0
+        self.rtts = []
+        self.received = 0
+        self.welcome = None  # resent by the host if a HELLO repeats
+
+    @classmethod
+    def host(cls, port=PORT, winning_score=WINNING_SCORE, seed=None, timeout=None, waiting=None, **link):
+        """Wait for a player to connect and start a match as the left side.
+
+        `waiting`, if given, is called every WAIT_POLL seconds until someone
+        connects; when it returns False host() gives up and returns None.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('', port))
+        sock.settimeout(WAIT_POLL)
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        seed = random.randrange(2 ** 63) if seed is None else seed
+        while True:
+            if deadline is not None and time.perf_counter() > deadline:
+                sock.close()
+                raise TimeoutError(f'nobody connected to port {port}')
+            try:
+                data, address = sock.recvfrom(64)
+            except (socket.timeout, ConnectionResetError):
+                if waiting and not waiting():
+                    sock.close()
+                    return None
+                continue
+            if data[:1] == bytes([HELLO]):
+                break
+        welcome = WELCOME_PACKET.pack(WELCOME, seed, winning_score) + TUNABLES.pack(*engine_values())
+        sock.sendto(welcome, address)
+        sock.setblocking(False)
+        peer = cls(sock, address, RollbackSession(LEFT, seed, winning_score), LossyLink(sock, **link))
+        peer.welcome = welcome
+        return peer
+
+    @classmethod
+    def connect(cls, address, timeout=10.0, waiting=None, **link):
+        """Join a hosted match as the right side.  `waiting` is called
+        back as in host()."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.settimeout(WAIT_POLL)
+        deadline = time.perf_counter() + timeout
+        next_hello = 0.0
+        while True:
+            now = time.perf_counter()
+            if now > deadline:
+                sock.close()
+                raise TimeoutError(f'no answer from {address[0]}:{address[1]}')
+            if now >= next_hello:
+                sock.sendto(bytes([HELLO]), address)
+                next_hello = now + HELLO_INTERVAL
+            try:
+                data, _ = sock.recvfrom(256)
+            except (socket.timeout, ConnectionResetError):
+                if waiting and not waiting():
+                    sock.close()
+                    return None
+                continue
+            if data[:1] == bytes([WELCOME]) and len(data) == WELCOME_PACKET.size + TUNABLES.size:
+                break
+        _, seed, winning_score = WELCOME_PACKET.unpack_from(data)
+        # Both sides simulate with the host's settings
+        apply_engine_values(TUNABLES.unpack_from(data, WELCOME_PACKET.size))
+        sock.setblocking(False)
+        return cls(sock, address, RollbackSession(RIGHT, seed, winning_score), LossyLink(sock, **link))
+
+    def send(self):
+        session = self.session
+        latest, changes = session.outgoing()
+        data = bytearray(INPUT_PACKET.pack(INPUT, latest, len(session.remote) - 1,
+                                           now_ms(), self.echo, len(changes)))
+        for change in changes:
+            data += CHANGE.pack(*change)
+        self.link.sendto(bytes(data), self.address)
+
+    def poll(self):
+        """Send what the link holds that is due and read every waiting packet."""
+        self.link.pump()
+        while True:
+            try:
+                data, _ = self.sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except ConnectionResetError:
+                # The other side is not listening (yet); UDP on Windows says so
+                continue
+            if data[:1] == bytes([HELLO]):
+                if self.welcome:
+                    # Our WELCOME was lost
+                    self.sock.sendto(self.welcome, self.address)
+                continue
+            if data[:1] != bytes([INPUT]) or len(data) < INPUT_PACKET.size:
+                continue
+            _, latest, ack, sent, echo, count = INPUT_PACKET.unpack_from(data)
+            changes = [CHANGE.unpack_from(data, INPUT_PACKET.size + i * CHANGE.size) for i in range(count)]
+            self.received += 1
+            self.echo = sent
+            if echo:
+                self.rtts.append(((now_ms() - echo) & 0xffffffff) / 1000)
+            self.session.peer_ack = max(self.session.peer_ack, ack)
+            self.session.receive(latest, changes)
+
+    def close(self):
+        self.sock.close()
+
+
+class LatencyMeter:
+    """Input-to-display latency: from sampling a changed input to the end
+    of the first frame that shows a tick run with it."""
+
+    def __init__(self):
+        self.waiting = []  # (tick, sampled at)
+        self.samples = []
+
+    def sampled(self, tick, at):
+        self.waiting.append((tick, at))
+
+    def displayed(self, tick, at):
+        """The frame just presented shows ticks up to `tick`."""
+        while self.waiting and self.waiting[0][0] <= tick:
+            self.samples.append(at - self.waiting.pop(0)[1])
+
+    def report(self):
+        return {'p50_ms': percentile(self.samples, 50) * 1000, 'p95_ms': percentile(self.samples, 95) * 1000,
+                'samples': len(self.samples)}
+
+
+def report(peer, meter=None):
+    session = peer.session
+    lines = [f'ticks {session.tick}, rollbacks {session.rollbacks} '
+             f'({session.resimulated / max(1, session.rollbacks):.1f} ticks each, '
+             f'worst {max(session.rollback_times, default=0) * 1000:.2f} ms), stalls {session.stalls}',
+             f'round trip p50 {percentile(peer.rtts, 50) * 1000:.0f} ms, p95 {percentile(peer.rtts, 95) * 1000:.0f} ms']
+    if meter:
+        latency = meter.report()
+        lines.append(f"input to display p50 {latency['p50_ms']:.1f} ms, p95 {latency['p95_ms']:.1f} ms "
+                     f"({latency['samples']} inputs)")
+    return '\n'.join(lines)
+
+
+def bot_input(rng, bits):
+    """A restless player: changes direction now and then, fires sometimes."""
+    if rng.random() < 0.05:
+        bits = rng.choice((0, INPUT_UP, INPUT_DOWN))
+    return bits | (INPUT_FIRE if rng.random() < 0.02 else 0)
+
+
+def loopback_test(seconds=20, latency=0.05, jitter=0.01, loss=0.05, seed=1):
+    """Two bot players in one process over localhost UDP, in real time.
+    Returns True when both ended in exactly the same state."""
+    socks = []
+    for _ in range(2):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.setblocking(False)
+        socks.append(sock)
+    link = {'latency': latency, 'jitter': jitter, 'loss': loss}
+    peers = [Peer(socks[i], socks[1 - i].getsockname(), RollbackSession(side, seed, 10 ** 6),
+                  LossyLink(socks[i], seed=seed + i, **link))
+             for i, side in enumerate((LEFT, RIGHT))]
+    bots = [(random.Random(seed * 2 + i), [0]) for i in range(2)]
+    meters = [LatencyMeter(), LatencyMeter()]
+    # Both peers share a clock here, so the remote player's presses can be
+    # timed from the moment they were made
+    remote_meters = [LatencyMeter(), LatencyMeter()]
+    ticks = int(seconds * TICK_RATE)
+    next_tick = time.perf_counter()
+    while any(peer.session.tick < ticks or peer.session.confirmed < ticks for peer in peers):
+        now = time.perf_counter()
+        if now < next_tick:
+            time.sleep(min(0.001, next_tick - now))
+            for peer in peers:
+                peer.poll()
+            continue
+        next_tick += 1 / TICK_RATE
+        for i, (peer, (rng, held), meter) in enumerate(zip(peers, bots, meters)):
+            peer.poll()
+            session = peer.session
+            if session.tick < ticks:
+                if session.can_advance():
+                    bits = bot_input(rng, held[0])
+                    if bits != session.local_changes[-1][1]:
+                        meter.sampled(session.tick, time.perf_counter())
+                        remote_meters[1 - i].sampled(session.tick, time.perf_counter())
+                    held[0] = bits & ~INPUT_FIRE
+                    session.advance(bits)
+                    meter.displayed(session.tick - 1, time.perf_counter())
+                else:
+                    session.stalls += 1
+            remote_meters[i].displayed(session.confirmed - 1, time.perf_counter())
+            peer.send()
+    states = [peer.session.flow.snapshot() for peer in peers]
+    for i, (peer, meter) in enumerate(zip(peers, meters)):
+        remote = remote_meters[i].report()
+        print(f'{"left" if i == LEFT else "right"}:')
+        print('  ' + report(peer, meter).replace('\n', '\n  '))
+        print(f"  remote input to display p50 {remote['p50_ms']:.1f} ms, p95 {remote['p95_ms']:.1f} ms")
+        peer.close()
+    return states[0] == states[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rollback netplay loopback test')
+    parser.add_argument('--test', action='store_true', help='run two bot players over localhost')
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--latency', type=float, default=50, help='one-way ms')
+    parser.add_argument('--jitter', type=float, default=10, help='+- ms')
+    parser.add_argument('--loss', type=float, default=0.05, help='fraction of packets dropped')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if not args.test:
+        parser.error('use --test here; play with main.py --host / --connect')
+    same = loopback_test(args.seconds, args.latency / 1000, args.jitter / 1000, args.loss, args.seed)
+    print('states match' if same else 'DESYNC: final states differ')
+    if not same:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""Match recordings: the seed, the settings and the player's input per tick.
+
+A match is fully determined by its seed, winning score, difficulties, the
+engine settings (see settings.engine_values()) and the input bits the player's side gave GameState.step() on every tick, so
+that is all a recording holds.  Inputs are run-length encoded, one byte per
+run of up to 32 ticks with the same bits, and the file ends with a summary
+of the final state so a replay can check it reached the same place.
+
+    python replay.py match.rec              # replay headless and verify
+    python replay.py match.rec --repeat 20  # use a real match as a benchmark
+    python main.py --replay match.rec --speed 4
+"""
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+
+from engine import AI_DIFFICULTY_MAP, GameState
+from settings import ENGINE_DEFAULTS, TUNABLES, apply_engine_values, engine_values
+
+MAGIC = b'PONGREC2'
+OLD_MAGIC = b'PONGREC1'  # no engine settings: played with the defaults
+# seed, winning score, left difficulty, right difficulty (None = player),
+# then the engine settings packed with settings.TUNABLES
+HEADER = struct.Struct('<QHbb')
+# tick, scores, paddle tops, ball position, winner (-1 = none)
+FOOTER = struct.Struct('<I7i')
+INPUT_BITS = 3  # INPUT_UP | INPUT_DOWN | INPUT_FIRE
+MAX_RUN = 256 >> INPUT_BITS
+DIFFICULTIES = list(AI_DIFFICULTY_MAP)
+
+
+def new_seed():
+    return random.randrange(2 ** 63)
+
+
+def signature(game):
+    """The parts of a GameState a replay has to reproduce exactly."""
+    return (game.tick, game.left.score, game.right.score, game.left.rect.y, game.right.rect.y,
+            game.ball_rect.x, game.ball_rect.y, -1 if game.winner is None else game.winner)
+
+
+def _difficulty_index(difficulty):
+    return -1 if difficulty is None else DIFFICULTIES.index(difficulty)
+
+
+class Recording:
+    """A recorded match.  `inputs` holds (bits, ticks) runs for the left
+    side; a side with difficulty None was played by a person.  `tunables`
+    are the engine settings, by default those in force now."""
+
+    def __init__(self, seed, winning_score, left_difficulty=None, right_difficulty='Normal',
+                 inputs=None, final=None, tunables=None):
+        self.seed = seed
+        self.winning_score = winning_score
+        self.left_difficulty = left_difficulty
+        self.right_difficulty = right_difficulty
+        self.inputs = inputs if inputs is not None else []
+        self.final = final
+        self.tunables = tuple(tunables) if tunables is not None else engine_values()
+
+    def new_game(self):
+        """The match at its start.  Puts the recorded engine settings in
+        force, which stay until settings are applied again."""
+        apply_engine_values(self.tunables)
+        return GameState(self.winning_score, self.right_difficulty or 'Normal',
+                         self.left_difficulty or 'Normal', rng=random.Random(self.seed))
+
+    @property
+    def ticks(self):
+        return sum(count for _, count in self.inputs)
+
+    def __iter__(self):
+        """Input bits for the left side, one per tick."""
+        for bits, count in self.inputs:
+            for _ in range(count):
+                yield bits
+
+    def encode(self):
+        data = bytearray(MAGIC)
+        data += HEADER.pack(self.seed, self.winning_score, _difficulty_index(self.left_difficulty),
+                            _difficulty_index(self.right_difficulty))
+        data += TUNABLES.pack(*self.tunables)
+        for bits, count in self.inputs:
+            while count > 0:
+                run = min(count, MAX_RUN)
+                data.append((run - 1) << INPUT_BITS | bits)
+                count -= run
+        data += FOOTER.pack(*(self.final or (0,) * 7 + (-1,)))
+        return bytes(data)
+
+    @classmethod
+    def decode(cls, data):
+        magic = data[:len(MAGIC)]
+        if magic not in (MAGIC, OLD_MAGIC):
+            raise ValueError('not a match recording')
+        start = len(MAGIC) + HEADER.size
+        seed, winning_score, left, right = HEADER.unpack_from(data, len(MAGIC))
+        if magic == MAGIC:
+            tunables = TUNABLES.unpack_from(data, start)
+            start += TUNABLES.size
+        else:
+            tunables = ENGINE_DEFAULTS
+        inputs = []
+        for byte in data[start:len(data) - FOOTER.size]:
+            bits = byte & (1 << INPUT_BITS) - 1
+            count = (byte >> INPUT_BITS) + 1
+            if inputs and inputs[-1][0] == bits:
+                inputs[-1] = (bits, inputs[-1][1] + count)
+            else:
+                inputs.append((bits, count))
+        final = FOOTER.unpack_from(data, len(data) - FOOTER.size)
+        return cls(seed, winning_score, DIFFICULTIES[left] if left >= 0 else None,
+                   DIFFICULTIES[right] if right >= 0 else None, inputs, final, tunables)
+
+    def save(self, path):
+        # Written whole and renamed so a crash never leaves half a file
+        with open(path + '.tmp', 'wb') as f:
+            f.write(self.encode())
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.decode(f.read())
+
+
+class Recorder:
+    """Collects the player's inputs tick by tick while a match is played."""
+
+    def __init__(self, recording):
+        self.recording = recording
+
+    def record(self, bits):
+        inputs = self.recording.inputs
+        if inputs and inputs[-1][0] == bits:
+            inputs[-1] = (bits, inputs[-1][1] + 1)
+        else:
+            inputs.append((bits, 1))
+
+    def finish(self, game, path):
+        self.recording.final = signature(game)
+        self.recording.save(path)
+
+
+def replay(recording):
+    """Replay a recording headless at full speed and return the game."""
+    game = recording.new_game()
+    step = game.step
+    for bits in recording:
+        step(bits, None)
+    return game
+
+
+def verify(recording, game):
+    """True when a replayed game ended in the recorded final state."""
+    return recording.final == signature(game)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded match headless and verify it')
+    parser.add_argument('path')
+    parser.add_argument('--repeat', type=int, default=1, help='replay this many times and report ticks/s')
+    args = parser.parse_args()
+
+    recording = Recording.load(args.path)
+    size = os.path.getsize(args.path)
+    print(f'seed {recording.seed}, first to {recording.winning_score}, '
+          f'{recording.ticks} ticks in {size} bytes ({len(recording.inputs)} input runs)')
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        game = replay(recording)
+    elapsed = time.perf_counter() - start
+    print(f'{recording.ticks * args.repeat / elapsed:,.0f} ticks/s')
+    if not verify(recording, game):
+        print(f'MISMATCH: recorded {recording.final}, replayed {signature(game)}')
+        sys.exit(1)
+    print('final state matches')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+"""Dedicated match server: many Pong matches in one asyncio process.
+
+Players talk to the server over UDP.  JOIN puts a player in the queue and
+every two queued players get a match: a MatchFlow over a GameState, the
+same rules main_game() plays.  A single fixed-rate scheduler steps every
+match once per tick and then sends all of that tick's state packets in one
+pass.
+
+With --workers N, N processes share the port through SO_REUSEPORT and the
+kernel spreads players over them by hashing each client's address and port.
+A worker whose tick time is getting close to the tick length stops starting
+matches and answers JOIN with FULL.  That only rejects: a retry from the same
+socket hashes to the same worker again, so a client should retry from a new
+socket (a new source port), which the kernel may send to another worker, as
+loadgen.py does.  A player left waiting for an opponent for WAIT_TIMEOUT
+gets FULL too, so it moves on to a worker that may have someone waiting.
+Every few seconds the workers report their matches, CPU use and tick time
+percentiles.
+
+    python server.py --port 7777 --workers 4
+    python loadgen.py --players 400 --port 7777
+"""
+import argparse
+import asyncio
+import collections
+import multiprocessing
+import queue
+import random
+import socket
+import struct
+import time
+
+from engine import FLOW_TIMING, GameState, MatchFlow, INPUT_FIRE, LEFT, RIGHT, TICK_RATE, WINNING_SCORE, \
+    PHASE_COUNTDOWN, PHASE_SERVING, PHASE_PLAYING, PHASE_POINT_SCORED, PHASE_GAME_OVER
+
+PORT = 7777
+TICK_TIME = 1.0 / TICK_RATE
+MAX_MATCHES = 2000  # per worker
+SATURATION = 0.5  # p95 tick time, as a share of TICK_TIME, above which no new matches start
+STATS_INTERVAL = 5.0  # seconds
+IDLE_TIMEOUT = 10.0  # seconds without a packet before a player is dropped
+WAIT_TIMEOUT = 10.0  # seconds waiting for an opponent before the player is sent FULL
+MAX_MISSILES_SENT = 32
+MAX_WINNING_SCORE = 0xffff  # scores go out as unsigned shorts
+
+PHASES = (PHASE_COUNTDOWN, PHASE_SERVING, PHASE_PLAYING, PHASE_POINT_SCORED, PHASE_GAME_OVER)
+
+# Client to server
+JOIN, INPUT, LEAVE = 1, 2, 3
+INPUT_PACKET = struct.Struct('<BBI')  # type, bits, client ms
+# Server to client
+WELCOME, FULL, STATE, END = 11, 12, 13, 14
+WELCOME_PACKET = struct.Struct('<BIB')  # type, match id, side
+END_PACKET = struct.Struct('<BB')  # type, winner (255 = abandoned)
+# type, tick, phase, ball x, y, paddle ys, scores, echoed client ms per side, missiles
+STATE_PACKET = struct.Struct('<BIBhhhhHHIIB')
+MISSILE = struct.Struct('<hhB')
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class Match:
+    __slots__ = ('id', 'flow', 'game', 'players', 'inputs', 'fire', 'echo', 'seen')
+
+    def __init__(self, match_id, players, winning_score, timing=FLOW_TIMING):
+        self.id = match_id
+        self.game = GameState(winning_score, rng=random.Random())
+        self.flow = MatchFlow(self.game, timing)
+        self.players = players  # address per side
+        self.inputs = [0, 0]  # held bits per side
+        self.fire = [0, 0]  # fire pressed since the last tick
+        self.echo = [0, 0]  # last client timestamp per side, sent back for round trips
+        now = time.monotonic()
+        self.seen = [now, now]
+
+    def step(self):
+        inputs = self.inputs
+        fire = self.fire
+        self.flow.step(inputs[LEFT] | fire[LEFT], inputs[RIGHT] | fire[RIGHT])
+        fire[LEFT] = fire[RIGHT] = 0
+
+    def state(self):
+        game = self.game
+        ball = game.ball_rect
+        missiles = game.missiles
+        n = min(len(missiles), MAX_MISSILES_SENT)
+        data = bytearray(STATE_PACKET.pack(
+            STATE, self.flow.tick, PHASES.index(self.flow.phase), ball.x, ball.y,
+            game.left.rect.y, game.right.rect.y, game.left.score, game.right.score,
+            self.echo[LEFT], self.echo[RIGHT], n))
+        xs, ys, sides = missiles.x, missiles.y, missiles.side
+        for i in range(n):
+            data += MISSILE.pack(xs[i], ys[i], sides[i])
+        return bytes(data)
+
+
+class MatchServer(asyncio.DatagramProtocol):
+    """Every match of one worker, stepped together on one clock."""
+
+    def __init__(self, winning_score=WINNING_SCORE, max_matches=MAX_MATCHES, worker=0, stats=None):
+        self.winning_score = winning_score
+        self.max_matches = max_matches
+        self.worker = worker
+        self.stats = stats  # a multiprocessing queue, or None to print
+        self.transport = None
+        self.matches = {}
+        self.players = {}  # address: (match, side)
+        self.waiting = None  # address of a player waiting for an opponent
+        self.waiting_since = 0.0
+        self.next_id = worker << 24
+        self.outbox = []
+        self.tick_times = collections.deque(maxlen=TICK_RATE)  # the last second
+        self.window = []  # tick times since the last report
+        self.overruns = 0
+        self.rejected = 0
+        self.finished = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def saturated(self):
+        return (len(self.matches) >= self.max_matches
+                or percentile(self.tick_times, 95) > SATURATION * TICK_TIME)
+
+    def datagram_received(self, data, address):
+        kind = data[0] if data else 0
+        if kind == INPUT and len(data) >= INPUT_PACKET.size:
+            joined = self.players.get(address)
+            if joined:
+                match, side = joined
+                _, bits, sent = INPUT_PACKET.unpack_from(data)
+                match.inputs[side] = bits & ~INPUT_FIRE
+                match.fire[side] |= bits & INPUT_FIRE
+                match.echo[side] = sent
+                match.seen[side] = time.monotonic()
+        elif kind == JOIN:
+            self.join(address)
+        elif kind == LEAVE:
+            joined = self.players.get(address)
+            if joined:
+                self.end(joined[0], None)
+            elif self.waiting == address:
+                self.waiting = None
+
+    def join(self, address):
+        joined = self.players.get(address)
+        if joined:
+            # Our WELCOME was lost
+            match, side = joined
+            self.transport.sendto(WELCOME_PACKET.pack(WELCOME, match.id, side), address)
+        elif self.waiting is None or self.waiting == address:
+            if self.waiting is None and self.saturated():
+                self.rejected += 1
+                self.transport.sendto(bytes([FULL]), address)
+                return
+            if self.waiting is None:
+                self.waiting_since = time.monotonic()
+            self.waiting = address
+        else:
+            opponent = self.waiting
+            self.waiting = None
+            self.next_id += 1
+            match = Match(self.next_id, (opponent, address), self.winning_score)
+            self.matches[match.id] = match
+            for side, player in enumerate(match.players):
+                self.players[player] = (match, side)
+                self.transport.sendto(WELCOME_PACKET.pack(WELCOME, match.id, side), player)
+
+    def end(self, match, winner):
+        del self.matches[match.id]
+        packet = END_PACKET.pack(END, 255 if winner is None else winner)
+        for player in match.players:
+            self.players.pop(player, None)
+            self.outbox.append((packet, player))
+        self.finished += 1
+
+    def tick(self):
+        outbox = self.outbox
+        ended = []
+        for match in self.matches.values():
+            match.step()
+            if match.flow.phase == PHASE_GAME_OVER:
+                ended.append(match)
+                continue
+            state = match.state()
+            for player in match.players:
+                outbox.append((state, player))
+        for match in ended:
+            self.end(match, match.game.winner)
+        # Everything for this tick goes out in one pass
+        sendto = self.transport.sendto
+        for data, address in outbox:
+            sendto(data, address)
+        outbox.clear()
+
+    def drop_idle(self):
+        now = time.monotonic()
+        cutoff = now - IDLE_TIMEOUT
+        for match in [m for m in self.matches.values() if min(m.seen) < cutoff]:
+            self.end(match, None)
+        # Nobody has come for the waiting player: send them elsewhere
+        if self.waiting is not None and now - self.waiting_since >= WAIT_TIMEOUT:
+            self.transport.sendto(bytes([FULL]), self.waiting)
+            self.waiting = None
+
+    def report(self, elapsed, cpu):
+        window = self.window
+        stats = {
+            'worker': self.worker, 'matches': len(self.matches), 'players': len(self.players),
+            'ticks': len(window), 'cpu': cpu / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(window, 50) * 1000, 'p95_ms': percentile(window, 95) * 1000,
+            'p99_ms': percentile(window, 99) * 1000, 'max_ms': max(window, default=0) * 1000,
+            'overruns': self.overruns, 'rejected': self.rejected, 'finished': self.finished,
+        }
+        self.window = []
+        if self.stats is not None:
+            self.stats.put(stats)
+        else:
+            print(format_stats([stats]), flush=True)
+
+    async def run(self, duration=None):
+        """Tick every match at TICK_RATE until `duration` seconds (or forever)."""
+        loop = asyncio.get_running_loop()
+        start = next_tick = loop.time()
+        last_report = time.perf_counter()
+        last_cpu = time.process_time()
+        while duration is None or loop.time() - start < duration:
+            began = time.perf_counter()
+            self.tick()
+            spent = time.perf_counter() - began
+            self.tick_times.append(spent)
+            self.window.append(spent)
+            next_tick += TICK_TIME
+            now = loop.time()
+            if now > next_tick:
+                # A whole tick late: skip ahead rather than bunch ticks up
+                self.overruns += 1
+                next_tick = now
+            if began - last_report >= STATS_INTERVAL:
+                cpu = time.process_time()
+                self.drop_idle()
+                self.report(began - last_report, cpu - last_cpu)
+                last_report = began
+                last_cpu = cpu
+            await asyncio.sleep(next_tick - loop.time())
+
+
+def format_stats(reports):
+    matches = sum(r['matches'] for r in reports)
+    cpu = sum(r['cpu'] for r in reports)
+    return (f"{len(reports)} worker(s): {matches} matches, {sum(r['players'] for r in reports)} players, "
+            f"{matches / cpu if cpu else 0:,.0f} matches/core, cpu {cpu:.2f} | "
+            f"tick p50 {max(r['p50_ms'] for r in reports):.2f} p95 {max(r['p95_ms'] for r in reports):.2f} "
+            f"p99 {max(r['p99_ms'] for r in reports):.2f} max {max(r['max_ms'] for r in reports):.2f} ms | "
+            f"overruns {sum(r['overruns'] for r in reports)}, rejected {sum(r['rejected'] for r in reports)}, "
+            f"finished {sum(r['finished'] for r in reports)}")
+
+
+def bind(port, shared):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if shared:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    sock.bind(('', port))
+    return sock
+
+
+async def serve(port=PORT, winning_score=WINNING_SCORE, max_matches=MAX_MATCHES, worker=0, shared=False,
+                stats=None, duration=None):
+    loop = asyncio.get_running_loop()
+    server = MatchServer(winning_score, max_matches, worker, stats)
+    transport, _ = await loop.create_datagram_endpoint(lambda: server, sock=bind(port, shared))
+    try:
+        await server.run(duration)
+    finally:
+        transport.close()
+
+
+def worker_main(port, winning_score, max_matches, worker, stats, duration):
+    try:
+        asyncio.run(serve(port, winning_score, max_matches, worker, True, stats, duration))
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dedicated Pong match server')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=1, help='processes sharing the port (SO_REUSEPORT)')
+    parser.add_argument('--winning-score', type=int, default=WINNING_SCORE)
+    parser.add_argument('--max-matches', type=int, default=MAX_MATCHES, help='per worker')
+    parser.add_argument('--duration', type=float, help='stop after this many seconds')
+    args = parser.parse_args()
+    if not 1 <= args.winning_score <= MAX_WINNING_SCORE:
+        parser.error(f'--winning-score must be between 1 and {MAX_WINNING_SCORE}')
+
+    if args.workers == 1:
+        try:
+            asyncio.run(serve(args.port, args.winning_score, args.max_matches, duration=args.duration))
+        except KeyboardInterrupt:
+            pass
+        return
+    stats = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=worker_main, daemon=True,
+                                       args=(args.port, args.winning_score, args.max_matches, i, stats,
+                                             args.duration))
+               for i in range(args.workers)]
+    for process in workers:
+        process.start()
+    # One line per interval, once every worker has reported
+    latest = {}
+    try:
+        while any(process.is_alive() for process in workers):
+            try:
+                report = stats.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            latest[report['worker']] = report
+            if len(latest) == args.workers:
+                print(format_stats(list(latest.values())), flush=True)
+                latest = {}
+    except KeyboardInterrupt:
+        pass
+    for process in workers:
+        process.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Settings: a typed schema, a JSON file, atomic saves and hot reload.
+
+Every tunable is a Setting in SCHEMA with its type, default and allowed
+range.  The file is plain JSON and is only ever parsed, never executed;
+unknown keys are ignored and bad values fall back to their defaults.
+Saves go to a temporary file that is renamed over the real one, so a
+crash never leaves half a file behind.
+
+Gameplay settings live in engine.py as module constants and apply() sets
+them there, so a running match picks up new values on its next tick.
+reload_if_changed(), called once per frame, watches the file's mtime: edit
+settings.json while the game runs and the change takes effect within
+RELOAD_INTERVAL.
+
+Recordings and netplay carry the engine settings a match was played with
+(engine_values(), packed with TUNABLES) and apply_engine_values() puts
+them in force before it is simulated again.
+
+The old config.py is read with ast, without running it, the first time
+and its values carried over into settings.json.
+"""
+import ast
+import json
+import os
+import struct
+import sys
+import time
+from collections.abc import MutableMapping
+
+import engine
+
+SETTINGS_FILE = 'settings.json'
+LEGACY_FILE = 'config.py'
+RELOAD_INTERVAL = 0.5  # seconds between mtime checks
+
+
+class Setting:
+    __slots__ = ('name', 'type', 'default', 'low', 'high', 'choices', 'engine', 'doc')
+
+    def __init__(self, name, type, default, low=None, high=None, choices=None, engine=False, doc=''):
+        self.name = name
+        self.type = type
+        self.default = default
+        self.low = low
+        self.high = high
+        self.choices = choices
+        self.engine = engine  # also an engine.py constant of the same name
+        self.doc = doc
+
+    def validate(self, value):
+        """The value converted to the setting's type; ValueError if it
+        cannot be or is out of range."""
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError(f'{self.name} must be {self.type.__name__}, not {value!r}')
+        if self.type is int and isinstance(value, float) and not value.is_integer():
+            raise ValueError(f'{self.name} must be a whole number, not {value!r}')
+        if self.type is not str and isinstance(value, str):
+            raise ValueError(f'{self.name} must be {self.type.__name__}, not {value!r}')
+        value = self.type(value)
+        if self.choices is not None and value not in self.choices:
+            raise ValueError(f"{self.name} must be one of {', '.join(map(str, self.choices))}, not {value!r}")
+        if self.low is not None and value < self.low or self.high is not None and value > self.high:
+            raise ValueError(f'{self.name} must be between {self.low} and {self.high}, not {value!r}')
+        return value
+
+
+SCHEMA = (
+    Setting('WINNING_SCORE', int, 10, 1, 99, doc='points to win a match'),
+    Setting('AI_DIFFICULTY', str, 'Normal', choices=tuple(engine.AI_DIFFICULTY_MAP), doc="the AI's difficulty"),
+    Setting('BALLS', int, 1, 1, 5000, doc='balls in play, more than one for multi-ball'),
+    Setting('PADDLE_SPEED', int, engine.PADDLE_SPEED, 1, 50, engine=True, doc='pixels per tick'),
+    Setting('BALL_SPEED_X', int, engine.BALL_SPEED_X, 1, 50, engine=True, doc='pixels per tick at serve'),
+    Setting('BALL_SPEED_Y', int, engine.BALL_SPEED_Y, 1, 50, engine=True, doc='pixels per tick at serve'),
+    Setting('MISSILE_SPEED', int, engine.MISSILE_SPEED, 1, 100, engine=True, doc='pixels per tick'),
+    Setting('MISSILE_COOLDOWN_FRAMES', int, engine.MISSILE_COOLDOWN_FRAMES, 0, 3600, engine=True,
+            doc='ticks between shots'),
+    Setting('AI_FIRE_CHANCE', float, engine.AI_FIRE_CHANCE, 0.0, 1.0, engine=True, doc='per tick'),
+    Setting('STAR_SPAWN_INTERVAL', int, engine.STAR_SPAWN_INTERVAL, 1, 36000, engine=True,
+            doc='ticks until a new star'),
+    Setting('MAX_STARS', int, engine.MAX_STARS, 1, 50, engine=True, doc='stars on the field at once'),
+    Setting('POWER_UP_DURATION', int, engine.POWER_UP_DURATION, 1, 36000, engine=True, doc='ticks'),
+    Setting('STUN_DURATION', int, engine.STUN_DURATION, 1, 3600, engine=True, doc='ticks'),
+    Setting('FAST_MOVEMENT_FACTOR', float, engine.FAST_MOVEMENT_FACTOR, 1.0, 5.0, engine=True,
+            doc='paddle speed multiplier'),
+)
+
+# The engine settings, in the order recordings and netplay packets hold them
+ENGINE_SETTINGS = tuple(setting for setting in SCHEMA if setting.engine)
+ENGINE_DEFAULTS = tuple(setting.default for setting in ENGINE_SETTINGS)
+TUNABLES = struct.Struct('<' + ''.join('i' if setting.type is int else 'd' for setting in ENGINE_SETTINGS))
+
+
+def engine_values():
+    """The engine settings in force now, in ENGINE_SETTINGS order."""
+    return tuple(getattr(engine, setting.name) for setting in ENGINE_SETTINGS)
+
+
+def apply_engine_values(values):
+    """Put engine settings from engine_values() in force; ValueError if
+    one is out of range."""
+    values = [setting.validate(value) for setting, value in zip(ENGINE_SETTINGS, values)]
+    for setting, value in zip(ENGINE_SETTINGS, values):
+        setattr(engine, setting.name, value)
+
+
+def read_legacy(path):
+    """NAME = literal assignments from an old config.py, without running it."""
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    values = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                values[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                pass
+    return values
+
+
+def warn(message):
+    print(f'settings: {message}', file=sys.stderr)
+
+
+class SettingsStore(MutableMapping):
+    """The current settings, as a mapping from name to value."""
+
+    def __init__(self, path=SETTINGS_FILE, schema=SCHEMA, legacy=LEGACY_FILE):
+        self.path = path
+        self.schema = {setting.name: setting for setting in schema}
+        self.legacy = legacy
+        self.values = {name: setting.default for name, setting in self.schema.items()}
+        self.mtime = None
+        self.checked = 0.0
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def __setitem__(self, name, value):
+        self.values[name] = self.schema[name].validate(value)
+
+    def __delitem__(self, name):
+        self.values[name] = self.schema[name].default
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def _merge(self, data, source):
+        values = {name: setting.default for name, setting in self.schema.items()}
+        for name, value in data.items():
+            setting = self.schema.get(name)
+            if setting is None:
+                continue
+            try:
+                values[name] = setting.validate(value)
+            except ValueError as error:
+                warn(f'{source}: {error}, using {setting.default!r}')
+        self.values = values
+
+    def load(self):
+        """Read the file (or migrate config.py) and apply it.  A missing
+        or broken file leaves the defaults."""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            if self.legacy and os.path.exists(self.legacy):
+                try:
+                    self._merge(read_legacy(self.legacy), self.legacy)
+                except (OSError, SyntaxError) as error:
+                    warn(f'cannot read {self.legacy}: {error}')
+                else:
+                    self.save()
+            self.apply()
+            return self
+        except (OSError, ValueError) as error:
+            # A half-written or hand-mangled file: keep what we have
+            warn(f'cannot read {self.path}: {error}')
+            self.mtime = os.stat(self.path).st_mtime_ns if os.path.exists(self.path) else None
+            return self
+        if not isinstance(data, dict):
+            warn(f'{self.path} should hold an object')
+            data = {}
+        self._merge(data, self.path)
+        self.apply()
+        return self
+
+    def save(self):
+        """Write every setting atomically and apply them."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        temporary = os.path.join(directory, f'.{os.path.basename(self.path)}.tmp')
+        with open(temporary, 'w') as f:
+            json.dump(self.values, f, indent=2)
+            f.write('\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        self.mtime = os.stat(self.path).st_mtime_ns
+        self.apply()
+
+    def reload_if_changed(self, now=None):
+        """Reload when the file changed since it was last read or written.
+        Checks at most every RELOAD_INTERVAL; returns True after a reload."""
+        now = time.monotonic() if now is None else now
+        if now - self.checked < RELOAD_INTERVAL:
+            return False
+        self.checked = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self.mtime:
+            return False
+        self.load()
+        return True
+
+    def apply(self):
+        """Set the gameplay constants in engine.py."""
+        for name, setting in self.schema.items():
+            if setting.engine:
+                setattr(engine, name, self.values[name])
@@ -0,0 +1,155 @@
+"""Procedural sound bank.
+
+Every sound is a row in SOUNDS and is synthesized once (then cached on disk)
+when the bank loads.  Sounds play on a pool of reserved mixer channels, and
+timed sequences such as the triple miss beep are queued and played by
+update(), which the main loop calls every frame instead of sleeping.
+"""
+import heapq
+import os
+
+import pygame
+
+SAMPLE_RATE = 44100
+AMPLITUDE = 0.5
+
+# name: frequency (Hz), duration (s), envelope (attack s, release s), and an
+# optional file that replaces the tone when it exists
+SOUNDS = {
+    'paddle': {'frequency': 440, 'duration': 0.05, 'envelope': (0, 0), 'file': 'paddle.wav'},
+    'miss': {'frequency': 220, 'duration': 0.05, 'envelope': (0, 0)},  # lower pitch
+    'missile': {'frequency': 880, 'duration': 0.1, 'envelope': (0, 0)},  # higher pitch
+    'celebration': {'frequency': 660, 'duration': 0.2, 'envelope': (0, 0)},  # medium pitch
+    'countdown': {'frequency': 330, 'duration': 0.1, 'envelope': (0, 0)},  # lower pitch
+}
+
+# name: [(delay in ms, sound), ...]
+SEQUENCES = {
+    'miss': [(0, 'miss'), (60, 'miss'), (120, 'miss')],
+}
+
+CHANNELS = 8  # reserved for the bank so nothing else steals them
+
+
+def synthesize(frequency, duration, envelope=(0, 0), sample_rate=SAMPLE_RATE):
+    """16-bit mono sine tone with a linear attack/release envelope."""
+    import numpy
+    t = numpy.linspace(0, duration, int(sample_rate * duration), False)
+    tone = numpy.sin(frequency * 2 * numpy.pi * t) * AMPLITUDE
+    attack, release = envelope
+    if attack:
+        tone *= numpy.clip(t / attack, 0, 1)
+    if release:
+        tone *= numpy.clip((duration - t) / release, 0, 1)
+    return numpy.array(tone * 32767, dtype=numpy.int16).tobytes()
+
+
+class SoundBank:
+    """Synthesized sounds, a reserved channel pool and a sequence scheduler.
+
+    Until load() has run (or when there is no audio device) every method is a
+    no-op, so callers never have to check.
+    """
+
+    def __init__(self, table=SOUNDS, sequences=SEQUENCES, cache_dir=None, channels=CHANNELS):
+        self.table = table
+        self.sequences = sequences
+        self.cache_dir = cache_dir
+        self.channel_count = channels
+        self.sounds = {}
+        self.channels = []
+        self.next_channel = 0
+        self.queue = []  # heap of (due ms, order, sound)
+        self.queued = 0
+
+    def buffer(self, name):
+        spec = self.table[name]
+        key = f"tone-{spec['frequency']}-{spec['duration']}-{'-'.join(map(str, spec['envelope']))}-{SAMPLE_RATE}.raw"
+        path = os.path.join(self.cache_dir, key) if self.cache_dir else None
+        if path:
+            try:
+                with open(path, 'rb') as f:
+                    return f.read()
+            except OSError:
+                pass
+        data = synthesize(spec['frequency'], spec['duration'], spec['envelope'])
+        if path:
+            # A cache that cannot be written just means the work is redone next time
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(data)
+                os.replace(path + '.tmp', path)
+            except OSError:
+                pass
+        return data
+
+    def load(self):
+        """Start the mixer and build every sound.  Returns False without audio."""
+        try:
+            pygame.mixer.init()
+        except pygame.error:
+            return False
+        pygame.mixer.set_num_channels(max(pygame.mixer.get_num_channels(), self.channel_count))
+        pygame.mixer.set_reserved(self.channel_count)
+        self.channels = [pygame.mixer.Channel(i) for i in range(self.channel_count)]
+        sounds = {}
+        for name, spec in self.table.items():
+            sound = None
+            if spec.get('file'):
+                try:
+                    sound = pygame.mixer.Sound(spec['file'])
+                except Exception:
+                    pass
+            if sound is None:
+                sound = pygame.mixer.Sound(buffer=self.buffer(name))
+            sounds[name] = sound
+        self.sounds = sounds
+        return True
+
+    def play(self, name):
+        sound = self.sounds.get(name)
+        if sound is None:
+            return
+        # An idle channel from the pool, or the least recently started one
+        for _ in range(len(self.channels)):
+            channel = self.channels[self.next_channel]
+            self.next_channel = (self.next_channel + 1) % len(self.channels)
+            if not channel.get_busy():
+                break
+        channel.play(sound)
+
+    def schedule(self, name, delay_ms=0, now=None):
+        if not self.sounds:
+            return
+        if now is None:
+            now = pygame.time.get_ticks()
+        self.queued += 1
+        heapq.heappush(self.queue, (now + delay_ms, self.queued, name))
+
+    def play_sequence(self, name, delay_ms=0):
+        now = pygame.time.get_ticks()
+        for offset, sound in self.sequences[name]:
+            self.schedule(sound, delay_ms + offset, now)
+        self.update(now)
+
+    def sequence_length(self, name):
+        """Milliseconds from the start of a sequence to its last sound."""
+        return max(offset for offset, _ in self.sequences[name])
+
+    def next_due(self, now=None):
+        """Milliseconds until the next queued sound is due, or None."""
+        if not self.queue:
+            return None
+        if now is None:
+            now = pygame.time.get_ticks()
+        return max(0, self.queue[0][0] - now)
+
+    def update(self, now=None):
+        """Play everything that is due.  Call once per frame."""
+        if not self.queue:
+            return
+        if now is None:
+            now = pygame.time.get_ticks()
+        while self.queue and self.queue[0][0] <= now:
+            self.play(heapq.heappop(self.queue)[2])
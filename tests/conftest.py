@@ -0,0 +1,17 @@
+import os
+
+import pytest
+
+# Nothing here opens a window or plays a sound
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+from settings import apply_engine_values, engine_values  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def engine_settings():
+    """Recordings and settings put engine values in force; undo that."""
+    values = engine_values()
+    yield
+    apply_engine_values(values)
@@ -0,0 +1,37 @@
+import random
+
+import numpy
+
+from engine import INPUT_UP
+from multiball import MultiBallState
+
+TICKS = 300
+
+
+def state(game):
+    return (game.tick, game.left.score, game.right.score, game.left.rect.y, game.right.rect.y,
+            game.ball_x.tolist(), game.ball_y.tolist(), game.ball_speed_x.tolist(),
+            game.ball_speed_y.tolist(), game.speed_multiplier.tolist())
+
+
+def run(game, ticks):
+    for tick in range(ticks):
+        game.step(INPUT_UP if tick % 50 < 25 else 0, None)
+    return state(game)
+
+
+def test_restore_replays_the_same_ticks():
+    game = MultiBallState(10 ** 6, rng=random.Random(1), balls=50)
+    run(game, TICKS)
+    saved = game.snapshot()
+    first = run(game, TICKS)
+    game.restore(saved)
+    assert run(game, TICKS) == first
+
+
+def test_snapshot_is_not_changed_by_play():
+    game = MultiBallState(10 ** 6, rng=random.Random(2), balls=20)
+    saved = game.snapshot()
+    ball_x = saved[1].copy()
+    run(game, TICKS)
+    assert numpy.array_equal(saved[1], ball_x)
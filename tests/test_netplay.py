@@ -0,0 +1,5 @@
+from netplay import loopback_test
+
+
+def test_loopback_states_match():
+    assert loopback_test(seconds=3)
@@ -0,0 +1,65 @@
+import random
+
+from engine import INPUT_DOWN, INPUT_FIRE, INPUT_UP
+from replay import HEADER, MAGIC, OLD_MAGIC, Recorder, Recording, replay, signature, verify
+from settings import ENGINE_DEFAULTS, ENGINE_SETTINGS, TUNABLES, engine_values
+
+MAX_TICKS = 100000
+
+
+def record_match(path, seed=1, winning_score=2):
+    """Play the left side with random held keys and save the recording."""
+    recording = Recording(seed, winning_score)
+    recorder = Recorder(recording)
+    game = recording.new_game()
+    rng = random.Random(seed)
+    bits = 0
+    while game.winner is None and game.tick < MAX_TICKS:
+        if rng.random() < 0.05:
+            bits = rng.choice((0, INPUT_UP, INPUT_DOWN))
+        pressed = bits | (INPUT_FIRE if rng.random() < 0.01 else 0)
+        recorder.record(pressed)
+        game.step(pressed, None)
+    recorder.finish(game, path)
+    return game
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'match.rec')
+    game = record_match(path)
+    assert game.winner is not None
+    recording = Recording.load(path)
+    replayed = replay(recording)
+    assert verify(recording, replayed)
+    assert signature(replayed) == signature(game)
+
+
+def test_other_seed_does_not_verify(tmp_path):
+    path = str(tmp_path / 'match.rec')
+    # Long enough that the AI's misses, drawn from the seed, decide points
+    record_match(path, winning_score=5)
+    recording = Recording.load(path)
+    recording.seed += 1
+    assert not verify(recording, replay(recording))
+
+
+def test_engine_settings_are_recorded(tmp_path):
+    path = str(tmp_path / 'match.rec')
+    speed = ENGINE_SETTINGS.index(next(s for s in ENGINE_SETTINGS if s.name == 'BALL_SPEED_X'))
+    tunables = list(engine_values())
+    tunables[speed] += 2
+    Recording(1, 2, tunables=tunables).new_game()
+    record_match(path)
+    Recording(1, 2, tunables=ENGINE_DEFAULTS).new_game()
+    recording = Recording.load(path)
+    assert recording.tunables[speed] == tunables[speed]
+    assert verify(recording, replay(recording))
+
+
+def test_old_recordings_use_the_defaults(tmp_path):
+    data = Recording(1, 2, inputs=[(INPUT_UP, 10)]).encode()
+    start = len(MAGIC) + HEADER.size
+    old = OLD_MAGIC + data[len(MAGIC):start] + data[start + TUNABLES.size:]
+    recording = Recording.decode(old)
+    assert recording.tunables == ENGINE_DEFAULTS
+    assert recording.inputs == [(INPUT_UP, 10)]
@@ -0,0 +1,37 @@
+import json
+
+import engine
+from settings import SettingsStore
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'settings.json')
+    store = SettingsStore(path, legacy=None)
+    store['PADDLE_SPEED'] = 9
+    store.save()
+    assert json.loads((tmp_path / 'settings.json').read_text())['PADDLE_SPEED'] == 9
+    loaded = SettingsStore(path, legacy=None).load()
+    assert loaded['PADDLE_SPEED'] == 9
+    assert engine.PADDLE_SPEED == 9
+
+
+def test_bad_values_fall_back_to_defaults(tmp_path):
+    path = tmp_path / 'settings.json'
+    path.write_text(json.dumps({'PADDLE_SPEED': 1000, 'BALL_SPEED_X': 'fast', 'UNKNOWN': 1}))
+    store = SettingsStore(str(path), legacy=None).load()
+    defaults = SettingsStore(str(tmp_path / 'missing.json'), legacy=None)
+    assert store['PADDLE_SPEED'] == defaults['PADDLE_SPEED']
+    assert store['BALL_SPEED_X'] == defaults['BALL_SPEED_X']
+    assert 'UNKNOWN' not in store
+
+
+def test_legacy_config_is_imported(tmp_path):
+    legacy = tmp_path / 'config.py'
+    marker = tmp_path / 'ran'
+    legacy.write_text(f'PADDLE_SPEED = 11\nopen({str(marker)!r}, "w")\n')
+    path = tmp_path / 'settings.json'
+    store = SettingsStore(str(path), legacy=str(legacy)).load()
+    assert store['PADDLE_SPEED'] == 11
+    # Read, never run, and carried over into the new file
+    assert not marker.exists()
+    assert json.loads(path.read_text())['PADDLE_SPEED'] == 11
@@ -0,0 +1,175 @@
+"""AI-vs-AI tournament over every difficulty pairing and winning score.
+
+Matches are split into chunks and played on a process pool.  Each chunk
+gets its own RNG seeded from --seed and the chunk number, so a run is
+reproducible no matter how the chunks land on workers.  Results stream
+back as chunks finish and are merged into one report.  A match still
+running after match_tick_limit() ticks is stopped and counted as a timeout,
+on either backend, so an endless rally cannot hang a worker.
+
+    python tournament.py --matches 500 --scores 3,5,10 --workers 8
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+
+from engine import AI_DIFFICULTY_MAP, GameState, LEFT, PADDLE_HIT, POINT
+
+CHUNK_SIZE = 50
+MAX_TICKS_PER_POINT = 20000  # ~5.5 minutes; an Extreme rally averages under 2000
+
+
+def parse_scores(text):
+    """'3,5,10' or '1-10' (or a mix) -> sorted list of winning scores."""
+    scores = set()
+    for part in text.split(','):
+        if '-' in part:
+            low, high = part.split('-')
+            scores.update(range(int(low), int(high) + 1))
+        else:
+            scores.add(int(part))
+    return sorted(scores)
+
+
+def wilson_interval(wins, n, z=1.96):
+    """95% confidence interval for a win rate."""
+    if n == 0:
+        return 0.0, 1.0
+    p = wins / n
+    denom = 1 + z * z / n
+    centre = (p + z * z / (2 * n)) / denom
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denom
+    return max(0.0, centre - half), min(1.0, centre + half)
+
+
+def match_tick_limit(winning_score):
+    """Ticks after which a match counts as a timeout: MAX_TICKS_PER_POINT
+    for each of the most points a match can have."""
+    return MAX_TICKS_PER_POINT * (2 * winning_score - 1)
+
+
+def empty_stats():
+    return {'matches': 0, 'left_wins': 0, 'timeouts': 0, 'ticks': 0, 'paddle_hits': 0, 'points': 0}
+
+
+def play_chunk(task):
+    """Play one chunk of matches; runs in a worker process."""
+    left, right, winning_score, count, seed, backend = task
+    stats = empty_stats()
+    max_ticks = match_tick_limit(winning_score)
+    if backend == 'batch':
+        from batch import BatchSim
+        played = BatchSim(count, winning_score, left, right, seed).run(max_ticks).results()
+        stats['matches'] = count
+        stats['left_wins'] = int((played['done'] & (played['winner'] == LEFT)).sum())
+        stats['timeouts'] = int((~played['done']).sum())
+        stats['ticks'] = int(played['ticks'].sum())
+        stats['paddle_hits'] = int(played['paddle_hits'].sum())
+        stats['points'] = int(played['points'].sum())
+        return (left, right, winning_score), stats
+    rng = random.Random(seed)
+    for _ in range(count):
+        game = GameState(winning_score, right, left, rng=rng)
+        while game.winner is None:
+            if game.tick >= max_ticks:
+                stats['timeouts'] += 1
+                break
+            for event in game.step():
+                if event[0] == PADDLE_HIT:
+                    stats['paddle_hits'] += 1
+                elif event[0] == POINT:
+                    stats['points'] += 1
+        stats['matches'] += 1
+        stats['left_wins'] += game.winner == LEFT
+        stats['ticks'] += game.tick
+    return (left, right, winning_score), stats
+
+
+def make_tasks(matches, scores, seed, backend, chunk_size=CHUNK_SIZE):
+    tasks = []
+    for winning_score in scores:
+        for left in AI_DIFFICULTY_MAP:
+            for right in AI_DIFFICULTY_MAP:
+                remaining = matches
+                while remaining > 0:
+                    count = min(chunk_size, remaining)
+                    tasks.append((left, right, winning_score, count, seed * 1_000_003 + len(tasks), backend))
+                    remaining -= count
+    # Long matches (high scores) first so the pool does not finish on a straggler
+    tasks.sort(key=lambda task: -task[2] * task[3])
+    return tasks
+
+
+def run_tournament(matches, scores, workers=None, seed=0, backend='engine', chunk_size=CHUNK_SIZE):
+    """Play everything and return {(left, right, winning_score): stats}."""
+    tasks = make_tasks(matches, scores, seed, backend, chunk_size)
+    results = {}
+    with multiprocessing.Pool(workers) as pool:
+        for key, stats in pool.imap_unordered(play_chunk, tasks):
+            merged = results.setdefault(key, empty_stats())
+            for name, value in stats.items():
+                merged[name] += value
+    return results
+
+
+def report(results):
+    rows = []
+    for (left, right, winning_score), stats in sorted(
+            results.items(), key=lambda item: (item[0][2], list(AI_DIFFICULTY_MAP).index(item[0][0]),
+                                               list(AI_DIFFICULTY_MAP).index(item[0][1]))):
+        # Timeouts have no winner, so win rates are over finished matches
+        n = stats['matches'] - stats['timeouts']
+        low, high = wilson_interval(stats['left_wins'], n)
+        rows.append({
+            'left': left,
+            'right': right,
+            'winning_score': winning_score,
+            'matches': stats['matches'],
+            'timeouts': stats['timeouts'],
+            'left_win_rate': stats['left_wins'] / n if n else 0.0,
+            'ci_low': low,
+            'ci_high': high,
+            'rally_length': stats['paddle_hits'] / stats['points'] if stats['points'] else 0.0,
+            'match_ticks': stats['ticks'] / stats['matches'] if stats['matches'] else 0.0,
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AI-vs-AI tournament across difficulties and winning scores')
+    parser.add_argument('--matches', type=int, default=200, help='matches per pairing and winning score')
+    parser.add_argument('--scores', type=parse_scores, default=parse_scores('1-10'),
+                        help="winning scores, e.g. '3,5,10' or '1-10'")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=['engine', 'batch'], default='engine',
+                        help='engine plays full matches one at a time, batch vectorizes each chunk')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = run_tournament(args.matches, args.scores, args.workers, args.seed, args.backend, args.chunk_size)
+    elapsed = time.perf_counter() - start
+
+    rows = report(results)
+    print(f"{'Score':>5} {'Left':>8} {'Right':>8} {'Left wins':>9} {'95% CI':>15} {'Rally':>7} {'Ticks':>8}")
+    for row in rows:
+        ci = f"{row['ci_low']:.3f}-{row['ci_high']:.3f}"
+        print(f"{row['winning_score']:>5} {row['left']:>8} {row['right']:>8} {row['left_win_rate']:>9.3f} "
+              f"{ci:>15} {row['rally_length']:>7.2f} {row['match_ticks']:>8.0f}")
+    total = sum(row['matches'] for row in rows)
+    timeouts = sum(row['timeouts'] for row in rows)
+    print(f'{total} matches on {args.workers} workers in {elapsed:.1f}s'
+          + (f', {timeouts} stopped after the tick limit' if timeouts else ''))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()